@@ -0,0 +1,132 @@
+"""
+Almacenamiento local columnar de DataFrames (snapshots del REPO filtrado).
+
+Cada snapshot es un directorio con un archivo .npy por columna y un
+`manifiesto.json` (hash del archivo de origen, filas, versión de filtros).
+Las columnas numéricas se reabren memory-mapped, sin volver a parsear el Excel.
+"""
+
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from calculo import VERSION_FILTRO
+
+
+DIR_SNAPSHOTS = Path(os.environ.get('COMPRAS_SNAPSHOTS', 'snapshots'))
+
+MANIFIESTO = 'manifiesto.json'
+
+
+# ─────────────────────────────────────────────
+# Formato columnar
+# ─────────────────────────────────────────────
+def guardar_columnar(df: pd.DataFrame, directorio, **meta) -> Path:
+    """Guarda `df` como un .npy por columna más un manifiesto JSON.
+
+    Las columnas numéricas se guardan con su dtype; las categóricas como códigos
+    más su tabla de categorías; las de texto como unicode de ancho fijo con una
+    máscara de nulos. La escritura es atómica: se escribe en un directorio
+    temporal y luego se renombra.
+    """
+    directorio = Path(directorio)
+    tmp = directorio.with_name(directorio.name + '.tmp')
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+
+    columnas = []
+    for i, col in enumerate(df.columns):
+        serie = df[col]
+        archivo = f'c{i}.npy'
+        if isinstance(serie.dtype, pd.CategoricalDtype):
+            np.save(tmp / archivo, serie.cat.codes.to_numpy())
+            np.save(tmp / f'c{i}.categorias.npy', serie.cat.categories.to_numpy().astype(str))
+            columnas.append({'nombre': col, 'archivo': archivo, 'tipo': 'categoria',
+                             'categorias': f'c{i}.categorias.npy'})
+        elif pd.api.types.is_numeric_dtype(serie.dtype):
+            np.save(tmp / archivo, serie.to_numpy())
+            columnas.append({'nombre': col, 'archivo': archivo, 'tipo': 'numero'})
+        else:
+            nulos = serie.isna().to_numpy()
+            valores = serie.astype(object).where(~nulos, '').to_numpy().astype(str)
+            np.save(tmp / archivo, valores)
+            entrada = {'nombre': col, 'archivo': archivo, 'tipo': 'texto'}
+            if nulos.any():
+                entrada['nulos'] = f'c{i}.nulos.npy'
+                np.save(tmp / entrada['nulos'], nulos)
+            columnas.append(entrada)
+
+    manifiesto = dict(meta, filas=len(df), columnas=columnas, creado=time.time())
+    (tmp / MANIFIESTO).write_text(json.dumps(manifiesto, ensure_ascii=False, indent=1), encoding='utf-8')
+
+    shutil.rmtree(directorio, ignore_errors=True)
+    tmp.rename(directorio)
+    return directorio
+
+
+def leer_manifiesto(directorio) -> dict:
+    manifiesto = json.loads((Path(directorio) / MANIFIESTO).read_text(encoding='utf-8'))
+    manifiesto['ruta'] = str(directorio)
+    return manifiesto
+
+
+def abrir_columnar(directorio):
+    """Reabre un directorio de `guardar_columnar`. Retorna (df, manifiesto).
+
+    Las columnas numéricas quedan respaldadas por memory-map (solo lectura).
+    """
+    directorio = Path(directorio)
+    manifiesto = leer_manifiesto(directorio)
+    datos = {}
+    for c in manifiesto['columnas']:
+        valores = np.load(directorio / c['archivo'], mmap_mode='r')
+        if c['tipo'] == 'categoria':
+            categorias = np.load(directorio / c['categorias']).astype(object)
+            valores = pd.Categorical.from_codes(valores, categories=categorias)
+        elif c['tipo'] == 'texto':
+            valores = valores.astype(object)
+            if 'nulos' in c:
+                valores[np.load(directorio / c['nulos'])] = None
+        datos[c['nombre']] = valores
+    df = pd.DataFrame(datos, columns=[c['nombre'] for c in manifiesto['columnas']], copy=False)
+    return df, manifiesto
+
+
+# ─────────────────────────────────────────────
+# Snapshots del REPO
+# ─────────────────────────────────────────────
+def guardar_snapshot_repo(df: pd.DataFrame, hash_origen: str, nombre_origen: str,
+                          filas_origen: int, directorio=None) -> Path:
+    """Guarda el REPO filtrado como snapshot identificado por el hash del Excel."""
+    directorio = Path(directorio or DIR_SNAPSHOTS)
+    return guardar_columnar(
+        df, directorio / hash_origen[:16],
+        hash_origen=hash_origen, nombre_origen=nombre_origen,
+        filas_origen=filas_origen, version_filtro=VERSION_FILTRO,
+    )
+
+
+def existe_snapshot(hash_origen: str, directorio=None) -> bool:
+    ruta = Path(directorio or DIR_SNAPSHOTS) / hash_origen[:16] / MANIFIESTO
+    if not ruta.exists():
+        return False
+    return leer_manifiesto(ruta.parent).get('version_filtro') == VERSION_FILTRO
+
+
+def listar_snapshots(directorio=None) -> list:
+    """Manifiestos de los snapshots vigentes (misma versión de filtros), más nuevos primero."""
+    directorio = Path(directorio or DIR_SNAPSHOTS)
+    if not directorio.is_dir():
+        return []
+    manifiestos = []
+    for ruta in directorio.iterdir():
+        if (ruta / MANIFIESTO).exists():
+            m = leer_manifiesto(ruta)
+            if m.get('version_filtro') == VERSION_FILTRO:
+                manifiestos.append(m)
+    return sorted(manifiestos, key=lambda m: m['creado'], reverse=True)
@@ -6,7 +6,25 @@ Determina cantidades a comprar por proveedor (México / Polifiltro)
 import streamlit as st
 import pandas as pd
 import numpy as np
+import hashlib
+import time
+import uuid
 from io import BytesIO
+from pathlib import Path
+
+import calculo
+from almacen import abrir_columnar, existe_snapshot, guardar_snapshot_repo, listar_snapshots
+from calculo import (COLUMNAS_ENTRADA, HOJAS_LIBRO, NOMBRE_POLITICA, POLITICA_DUPLICADOS, PREFIJOS_CONTRATOS,
+                     agregar_duplicados, compactar_repo, reporte_memoria,
+                     MESES_CONTRATOS, TABLA_CASOS, UMBRAL_POLI_FUERTE, UMBRAL_POLI_LEVE,
+                     PipelineCompras, ordenes_compra)
+from diagnostico import Medidor
+from escenarios import evaluar_escenarios, grilla
+from presupuesto import ajustar_a_presupuesto, quitar_ajuste
+from historial import archivar_corrida, diferencias_corridas, listar_corridas, resumen_diferencias
+from exportar import FORMATOS, exportar_bytes, formatos_disponibles
+import sesiones
+from compartido import RegistroCompartido
 import warnings
 warnings.filterwarnings('ignore')
 
@@ -312,14 +330,28 @@ div[data-testid="stExpander"] { background: var(--surface2); border: 1px solid v
 def init_state():
     defaults = {
         'repo': None,                  # DataFrame REPO filtrado
+        'repo_hash': None,             # SHA-256 del Excel REPO cargado
         'reserv_mexico': None,         # {codigo: cantidad}
         'reserv_polifiltro': None,
         'bo_mexico': None,
         'bo_polifiltro': None,
         'contratos_vigentes': [],      # lista de DataFrames {codigo, q_fact, q_contrato}
         'contratos_excluir': [],       # lista de DataFrames {codigo, q_3m, q_6m, q_12m}
+        'n_cv': 0,                     # contadores de empresas de la pestaña Contratos
+        'n_ce': 0,                     # (siguen el largo de las listas de contratos)
         'precio_polifiltro': None,     # {codigo: precio}
         'resultado': None,             # DataFrame final
+        'pipeline': None,              # PipelineCompras con el cache de cada etapa
+        'resultado_version': 0,        # se incrementa con cada cálculo
+        'memo_resultado': {},          # {(version, nombre): objeto} derivados de resultado
+        'medidor': None,               # diagnostico.Medidor de la sesión (tiempos por etapa)
+        'resumen_presupuesto': None,   # resumen del último ajuste a presupuesto
+        'archivos_cargados': {},       # {clave de entrada: hash del último archivo subido}
+        'sesion': None,                # id de la sesión persistente (parámetro ?sesion= de la URL)
+        'guardado': {},                # {clave: (df, meta)} última versión guardada de cada entrada
+        'sesion_tocada': 0.0,          # último registro de uso de la sesión en el índice
+        'cliente': uuid.uuid4().hex,   # id de esta sesión de Streamlit en el registro compartido
+        'diff_historial': None,        # ((id_antes, id_despues), DataFrame) último diff del historial
     }
     for k, v in defaults.items():
         if k not in st.session_state:
@@ -328,36 +360,257 @@ def init_state():
 init_state()
 
 
+# ─────────────────────────────────────────────
+# Entradas compartidas entre sesiones (ver compartido.py)
+# ─────────────────────────────────────────────
+ENTRADAS_COMPARTIDAS = ['repo', 'precio_polifiltro']
+
+
+@st.cache_resource
+def registro_compartido() -> RegistroCompartido:
+    """Registro único por proceso: todas las sesiones del servidor ven el mismo."""
+    return RegistroCompartido()
+
+
+def asignar_entrada(clave: str, df: pd.DataFrame | None, contenido_hash=None):
+    """Pasa `df` a la sesión como entrada `clave`.
+
+    El REPO y los precios se registran en el registro compartido: si otra sesión
+    ya cargó el mismo contenido, la sesión queda con una referencia a esa copia.
+    `contenido_hash` es el hash del archivo de origen cuando se conoce.
+    """
+    if clave in ENTRADAS_COMPARTIDAS:
+        if df is None:
+            registro_compartido().soltar(st.session_state['cliente'], clave)
+        else:
+            df = registro_compartido().compartir(st.session_state['cliente'], clave, df, contenido_hash)
+    st.session_state[clave] = df
+
+
+# ─────────────────────────────────────────────
+# Sesión persistente (ver sesiones.py)
+# ─────────────────────────────────────────────
+ENTRADAS_SESION = ['repo', 'reserv_mexico', 'bo_mexico', 'reserv_polifiltro', 'bo_polifiltro', 'precio_polifiltro']
+
+# Lista de contratos: key del number_input con su cantidad de empresas
+CONTADORES_CONTRATOS = {'contratos_vigentes': 'n_cv', 'contratos_excluir': 'n_ce'}
+
+
+def entradas_sesion() -> dict:
+    """Entradas cargadas en sesión como {clave: (df, meta)}; los contratos van uno por clave (cv_0, ce_1, ...)."""
+    entradas = {}
+    for clave in ENTRADAS_SESION:
+        if st.session_state[clave] is not None:
+            meta = {'repo_hash': st.session_state['repo_hash']} if clave == 'repo' else {}
+            entradas[clave] = (st.session_state[clave], meta)
+    for prefijo, clave in PREFIJOS_CONTRATOS.items():
+        lista = st.session_state[clave]
+        for i, df in enumerate(lista):
+            if df is not None:
+                entradas[f'{prefijo}{i}'] = (df, {'empresas': len(lista)})
+    return entradas
+
+
+def restaurar_sesion():
+    """Toma el id de sesión de la URL (o crea uno) y reabre sus entradas guardadas.
+
+    Corre una vez por sesión de Streamlit. Las entradas se reabren memory-mapped desde
+    el almacén, sin volver a parsear los archivos originales.
+    """
+    sesion = st.query_params.get('sesion')
+    if not sesiones.es_id_valido(sesion):
+        # Solo ids con el formato de nueva_sesion: el id se usa como nombre de directorio
+        sesion = sesiones.nueva_sesion()
+        st.query_params['sesion'] = sesion
+    st.session_state['sesion'] = sesion
+    try:
+        # Se marca como usada antes de desalojar, y el desalojo la excluye
+        sesiones.tocar_sesion(sesion)
+        st.session_state['sesion_tocada'] = time.time()
+        sesiones.desalojar(excluir=(sesion,))
+        guardadas = sesiones.listar_entradas(sesion)
+        for clave, meta in guardadas.items():
+            df = sesiones.abrir_entrada(sesion, clave)
+            prefijo = clave[:3]
+            if prefijo in PREFIJOS_CONTRATOS:
+                lista = st.session_state[PREFIJOS_CONTRATOS[prefijo]]
+                lista.extend([None] * (meta['empresas'] - len(lista)))
+                lista[int(clave[3:])] = df
+            else:
+                contenido_hash = None
+                if clave == 'repo':
+                    # Se guardó ya compactado: no se vuelve a compactar, que copiaría a RAM las columnas memory-mapped
+                    contenido_hash = st.session_state['repo_hash'] = meta.get('repo_hash')
+                asignar_entrada(clave, df, contenido_hash)
+                df = st.session_state[clave]
+            st.session_state['guardado'][clave] = (df, meta)
+        for clave, contador in CONTADORES_CONTRATOS.items():
+            st.session_state[contador] = len(st.session_state[clave])
+    except Exception as e:
+        st.warning(f"No se pudo restaurar la sesión guardada: {e}")
+
+
+def guardar_sesion():
+    """Guarda las entradas nuevas o reemplazadas desde el último guardado y borra las quitadas.
+
+    Las entradas se comparan por identidad: una entrada que no se reasignó no se vuelve
+    a escribir, salvo que ya no esté en el almacén (p. ej. si se borró a mano). Además
+    renueva el último uso de la sesión (a lo sumo una vez por minuto) para que el
+    desalojo la considere activa.
+    """
+    sesion, guardado = st.session_state['sesion'], st.session_state['guardado']
+    actuales = entradas_sesion()
+    try:
+        if time.time() - st.session_state['sesion_tocada'] > 60:
+            sesiones.tocar_sesion(sesion)
+            st.session_state['sesion_tocada'] = time.time()
+        en_disco = sesiones.listar_entradas(sesion) if guardado else {}
+        for clave, (df, meta) in actuales.items():
+            previo = guardado.get(clave)
+            if previo is None or previo[0] is not df or previo[1] != meta or clave not in en_disco:
+                sesiones.guardar_entrada(sesion, clave, df, **meta)
+                guardado[clave] = (df, meta)
+        for clave in set(guardado) - set(actuales):
+            sesiones.borrar_entrada(sesion, clave)
+            del guardado[clave]
+    except Exception as e:
+        st.warning(f"No se pudo guardar la sesión: {e}")
+
+
+if st.session_state['sesion'] is None:
+    restaurar_sesion()
+
+
 # ─────────────────────────────────────────────
 # Helpers
 # ─────────────────────────────────────────────
 def parse_paste(text: str, columns: list, sep='\t') -> pd.DataFrame | None:
-    """Parsea texto pegado (TSV/CSV) y retorna DataFrame con columnas dadas."""
+    """Parsea texto pegado (TSV/CSV); muestra el error en pantalla si falla."""
     try:
-        from io import StringIO
-        lines = [l for l in text.strip().splitlines() if l.strip()]
-        if not lines:
-            return None
-        # Detectar si tiene header
-        first = lines[0].split(sep)
-        if len(first) != len(columns):
-            # intentar coma
-            sep = ','
-            first = lines[0].split(sep)
-        df = pd.read_csv(StringIO('\n'.join(lines)), sep=sep, header=None, names=columns, dtype=str)
-        # Si primera fila parece header, eliminarla
-        if df.iloc[0].str.lower().tolist() == [c.lower() for c in columns]:
-            df = df.iloc[1:].reset_index(drop=True)
-        # Convertir tipos
-        for col in columns[1:]:
-            df[col] = pd.to_numeric(df[col].str.replace(',', '.'), errors='coerce').fillna(0)
-        df[columns[0]] = df[columns[0]].astype(str).str.strip()
-        return df
+        return calculo.parse_paste(text, columns, sep)
     except Exception as e:
         st.error(f"Error al parsear: {e}")
         return None
 
 
+def aviso_duplicados(df: pd.DataFrame, clave: str) -> pd.DataFrame:
+    """Agrega códigos repetidos de una entrada (ver POLITICA_DUPLICADOS) y avisa cuántos hubo."""
+    politica = POLITICA_DUPLICADOS[clave]
+    df, n_repetidos = agregar_duplicados(df, politica)
+    if n_repetidos:
+        st.warning(f"{n_repetidos:,} códigos repetidos se agregaron en un registro ({NOMBRE_POLITICA[politica]}).")
+    return df
+
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def cargar_repo(repo_hash: str, _repo_bytes: bytes, _medidor=None):
+    """Lee y filtra el Excel REPO (ver `calculo.leer_repo`).
+
+    El cache se indexa solo por `repo_hash` (hash SHA-256 del contenido); el
+    parámetro `_repo_bytes` no se hashea. Así el Excel se parsea una sola vez por
+    archivo distinto y no en cada rerun de Streamlit. El REPO se compacta
+    (`calculo.compactar_repo`) antes de guardarlo en sesión. Con `_medidor` se
+    registra el tiempo de la lectura y la compactación (solo cuando no hay acierto
+    de cache); la memoria pico no se mide aquí aunque el medidor la tenga activa.
+    Retorna (df_filtrado, n_total, columnas_faltantes, columnas_disponibles, reporte_memoria).
+    """
+    medidor = _medidor or Medidor(memoria=False, log=None)
+    with medidor.etapa('leer_repo', memoria=False, bytes=len(_repo_bytes)) as registro:
+        df, n_total, missing, columnas = calculo.leer_repo(BytesIO(_repo_bytes))
+        registro['filas'] = n_total
+    memoria = None
+    if df is not None:
+        with medidor.etapa('compactar_repo', filas=len(df), memoria=False):
+            compacto = compactar_repo(df)
+        memoria = reporte_memoria(df, compacto)
+        df = compacto
+    return df, n_total, missing, columnas, memoria
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def cargar_tabla(archivo_hash: str, columnas: tuple, _datos: bytes) -> pd.DataFrame | None:
+    """Parsea un archivo CSV/TSV/Excel subido (ver `calculo.leer_tabla_bytes`).
+
+    Como `cargar_repo`, el cache se indexa por el hash del contenido y no por los
+    bytes, que no pasan por el frontend ni se vuelven a parsear en cada rerun.
+    """
+    return calculo.leer_tabla_bytes(_datos, list(columnas))
+
+
+TIPOS_TABLA = ['csv', 'tsv', 'txt', 'xlsx', 'xls']
+ORIGENES_TABLA = ["Subir archivo", "Pegar texto"]
+
+
+def subir_tabla(etiqueta: str, clave: str, columns: list):
+    """Uploader de una entrada. Retorna (df, nombre_archivo) solo si el archivo es nuevo.
+
+    Si no hay archivo, no se pudo leer o es el mismo que ya se cargó para `clave`,
+    retorna (None, None), así la entrada en sesión conserva su identidad entre reruns.
+    """
+    archivo = st.file_uploader(etiqueta, type=TIPOS_TABLA, key=f"up_{clave}")
+    if archivo is None:
+        return None, None
+    datos = archivo.getvalue()
+    archivo_hash = hashlib.sha256(datos).hexdigest()
+    if st.session_state['archivos_cargados'].get(clave) == archivo_hash:
+        return None, None
+    try:
+        df = cargar_tabla(archivo_hash, tuple(columns), datos)
+    except Exception as e:
+        st.error(f"Error al leer {archivo.name}: {e}")
+        return None, None
+    if df is None:
+        st.warning(f"{archivo.name} no tiene datos.")
+        return None, None
+    st.session_state['archivos_cargados'][clave] = archivo_hash
+    return df, archivo.name
+
+
+def olvidar_archivo(clave: str):
+    """Olvida el último archivo subido para `clave`, al reasignar la entrada por otra vía
+    (texto pegado, libro): volver a subir ese archivo lo carga de nuevo."""
+    st.session_state['archivos_cargados'].pop(clave, None)
+
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def cargar_libro(libro_hash: str, _libro_bytes: bytes):
+    """Lee un libro con todas las entradas (ver `calculo.leer_libro_entradas`), cacheado por hash.
+
+    El REPO del libro se compacta igual que en `cargar_repo`.
+    """
+    entradas, info = calculo.leer_libro_entradas(BytesIO(_libro_bytes))
+    if 'repo' in entradas:
+        entradas['repo'] = compactar_repo(entradas['repo'])
+    return entradas, info
+
+
+def aplicar_libro(entradas: dict, libro_hash: str):
+    """Pasa a la sesión las entradas leídas de un libro; las que no están en el libro no cambian."""
+    for clave, valor in entradas.items():
+        if clave in PREFIJOS_CONTRATOS.values():
+            if valor:
+                st.session_state[clave] = list(valor)
+                # El contador de empresas de la pestaña Contratos sigue a la lista
+                st.session_state[CONTADORES_CONTRATOS[clave]] = len(valor)
+                prefijo = next(p for p, c in PREFIJOS_CONTRATOS.items() if c == clave)
+                for cargado in [k for k in st.session_state['archivos_cargados'] if k.startswith(prefijo)]:
+                    olvidar_archivo(cargado)
+        else:
+            asignar_entrada(clave, valor, libro_hash if clave == 'repo' else None)
+            olvidar_archivo(clave)
+    if 'repo' in entradas:
+        st.session_state['repo_hash'] = libro_hash
+    st.session_state['archivos_cargados']['libro'] = libro_hash
+
+
+def lista_numeros(texto: str) -> list:
+    """'-10 -8,5; -6' → [-10.0, -8.5, -6.0] (separados por espacio o ';', coma decimal admitida)."""
+    valores = [float(v.replace(',', '.')) for v in texto.replace(';', ' ').split()]
+    if not valores:
+        raise ValueError("hay un campo vacío")
+    return valores
+
+
 def badge(status):
     icons = {'ok': ('✓', 'badge-ok', 'Cargado'), 'pending': ('○', 'badge-pending', 'Pendiente'), 'error': ('✕', 'badge-error', 'Error')}
     ic, cls, lbl = icons.get(status, icons['pending'])
@@ -368,13 +621,92 @@ def status_of(key):
     return 'ok' if st.session_state.get(key) is not None else 'pending'
 
 
-def to_excel_bytes(dfs: dict) -> bytes:
-    """Convierte dict {sheet_name: df} a bytes Excel."""
-    buf = BytesIO()
-    with pd.ExcelWriter(buf, engine='openpyxl') as writer:
-        for sheet, df in dfs.items():
-            df.to_excel(writer, sheet_name=sheet[:31], index=False)
-    return buf.getvalue()
+def medidor_sesion() -> Medidor:
+    """Medidor de la sesión; el log estructurado se activa con COMPRAS_LOG_DIAGNOSTICO."""
+    if st.session_state['medidor'] is None:
+        st.session_state['medidor'] = Medidor()
+    return st.session_state['medidor']
+
+
+def memo_resultado(nombre: str, builder=None):
+    """Devuelve un derivado de `resultado` (ej. bytes de un Excel) memoizado por versión.
+
+    Si no está calculado para la versión actual y se pasa `builder`, lo construye y
+    lo guarda; sin `builder` retorna None. Los derivados de versiones anteriores se
+    descartan, así los reruns que no exportan no serializan nada.
+    """
+    memo = st.session_state['memo_resultado']
+    clave = (st.session_state['resultado_version'], nombre)
+    if clave not in memo and builder is not None:
+        for k in [k for k in memo if k[0] != clave[0]]:
+            del memo[k]
+        memo[clave] = builder()
+    return memo.get(clave)
+
+
+FILTROS_TABLA = ['estado', 'caso', 'donde_comprar', 'clasificacion']
+COLUMNAS_QTY = ['qty_comprar_mexico', 'qty_comprar_polifiltro']
+
+
+def tabla_paginada(df: pd.DataFrame, key: str, filas_por_pagina=50):
+    """Muestra `df` paginado, filtrando y ordenando del lado del servidor.
+
+    Solo se envía al navegador la página visible. Filtra por las columnas de
+    FILTROS_TABLA presentes y, si hay cantidades, por "qty > 0". Las posiciones
+    filtradas y ordenadas se guardan en sesión junto con `df` (se compara por
+    identidad, como en `PipelineCompras`), así cambiar de página no vuelve a
+    filtrar ni ordenar.
+    """
+    filtros = [c for c in FILTROS_TABLA if c in df.columns]
+    qty_cols = [c for c in COLUMNAS_QTY if c in df.columns]
+
+    cols = st.columns(len(filtros) + 1 if filtros or qty_cols else 1)
+    seleccion = {}
+    for col_ui, col in zip(cols, filtros):
+        with col_ui:
+            opciones = sorted(df[col].dropna().astype(str).unique())
+            seleccion[col] = tuple(st.multiselect(col, opciones, key=f"{key}_f_{col}"))
+    solo_qty = False
+    if qty_cols:
+        with cols[-1]:
+            solo_qty = st.checkbox("Solo qty > 0", key=f"{key}_qty")
+
+    c_orden, c_dir, c_tam = st.columns([2, 1, 1])
+    with c_orden:
+        orden = st.selectbox("Ordenar por", ['(sin orden)'] + list(df.columns), key=f"{key}_orden")
+    with c_dir:
+        ascendente = st.radio("Dirección", ["Asc", "Desc"], horizontal=True, key=f"{key}_dir") == "Asc"
+    with c_tam:
+        filas_por_pagina = st.selectbox("Filas por página", [25, 50, 100, 250],
+                                        index=[25, 50, 100, 250].index(filas_por_pagina), key=f"{key}_tam")
+
+    clave = (tuple(sorted(seleccion.items())), solo_qty, orden, ascendente)
+    cache = st.session_state.get(f"{key}_idx")
+    if cache is not None and cache[0] is df and cache[1] == clave:
+        idx = cache[2]
+    else:
+        mask = np.ones(len(df), dtype=bool)
+        for col, valores in seleccion.items():
+            if valores:
+                mask &= df[col].astype(str).isin(valores).to_numpy()
+        if solo_qty:
+            mask &= (df[qty_cols].to_numpy() > 0).any(axis=1)
+        idx = np.flatnonzero(mask)
+        if orden != '(sin orden)':
+            valores_orden = df[orden].iloc[idx]
+            valores_orden.index = idx
+            idx = valores_orden.sort_values(ascending=ascendente, kind='stable', na_position='last').index.to_numpy()
+        st.session_state[f"{key}_idx"] = (df, clave, idx)
+
+    n_paginas = max(1, -(-len(idx) // filas_por_pagina))
+    if st.session_state.get(f"{key}_pagina", 1) > n_paginas:
+        st.session_state[f"{key}_pagina"] = n_paginas
+    pagina = st.number_input(f"Página (de {n_paginas:,})", min_value=1, max_value=n_paginas, step=1, key=f"{key}_pagina")
+
+    inicio = (pagina - 1) * filas_por_pagina
+    fin = min(inicio + filas_por_pagina, len(idx))
+    st.dataframe(df.iloc[idx[inicio:fin]], use_container_width=True)
+    st.caption(f"Filas {inicio + 1 if len(idx) else 0:,}–{fin:,} de {len(idx):,} (total {len(df):,})")
 
 
 # ─────────────────────────────────────────────
@@ -435,6 +767,8 @@ with st.sidebar:
 
     st.markdown("---")
     if st.button("🔄 Reiniciar todo"):
+        sesiones.borrar_sesion(st.session_state['sesion'])
+        registro_compartido().soltar(st.session_state['cliente'])
         for key in list(st.session_state.keys()):
             del st.session_state[key]
         st.rerun()
@@ -470,7 +804,32 @@ with tab_repo:
 
     col_upload, col_info = st.columns([2, 1])
     with col_upload:
-        repo_file = st.file_uploader("Archivo Excel REPO (.xlsx / .xls)", type=['xlsx', 'xls'], key='repo_uploader')
+        repo_file = None
+        snapshot_sel = None
+        libro_file = None
+        origen = st.radio("Origen", ["Subir Excel", "Snapshot guardado", "Libro con todas las entradas"],
+                          horizontal=True, key='repo_origen')
+        if origen == "Subir Excel":
+            repo_file = st.file_uploader("Archivo Excel REPO (.xlsx / .xls)", type=['xlsx', 'xls'], key='repo_uploader')
+        elif origen == "Libro con todas las entradas":
+            libro_file = st.file_uploader(
+                "Libro .xlsx con una hoja por entrada", type=['xlsx'], key='libro_uploader',
+                help=("Hojas: " + ", ".join(HOJAS_LIBRO) +
+                      "; contratos vigentes en hojas cv_<empresa> y a excluir en ce_<empresa>.")
+            )
+        else:
+            snapshots = listar_snapshots()
+            if snapshots:
+                snapshot_sel = st.selectbox(
+                    "Snapshot del REPO filtrado",
+                    snapshots,
+                    format_func=lambda m: (f"{m['nombre_origen']} · "
+                                           f"{time.strftime('%d/%m/%Y %H:%M', time.localtime(m['creado']))} · "
+                                           f"{m['filas']:,} registros"),
+                    key='repo_snapshot'
+                )
+            else:
+                st.info("No hay snapshots guardados. Subí un Excel REPO para crear uno.")
 
     with col_info:
         st.markdown("""
@@ -483,68 +842,102 @@ with tab_repo:
         </div>
         """, unsafe_allow_html=True)
 
-    REPO_COLS = [
-        'familia', 'subfamilia', 'grupo', 'inactivo', 'codigo', 'codfabricante',
-        'descripcion', 'descripcion2', 'clasificacion', 'consolidado',
-        'q_fact_3', 'q_fact_6', 'q_fact_12',
-        'en_sv_en_menos_30_dias', 'en_sv_en_mas_30_dias',
-        'pc', 'qty_piezas_por_caja'
-    ]
+    def mostrar_resumen_repo(df_filtrado, n_total, mensaje):
+        n_filtrado = len(df_filtrado)
+        st.markdown(f"""
+        <div class="metric-row">
+            <div class="metric-box"><div class="metric-label">Total registros</div><div class="metric-value">{n_total:,}</div></div>
+            <div class="metric-box"><div class="metric-label">Después de filtros</div><div class="metric-value" style="color:var(--success)">{n_filtrado:,}</div></div>
+            <div class="metric-box"><div class="metric-label">Excluidos</div><div class="metric-value" style="color:var(--muted)">{n_total - n_filtrado:,}</div></div>
+        </div>
+        """, unsafe_allow_html=True)
+
+        st.markdown(f'<div class="success-box">✓ {mensaje}</div>', unsafe_allow_html=True)
+
+        with st.expander("Vista previa (primeras 50 filas)"):
+            st.dataframe(df_filtrado.head(50), use_container_width=True)
 
     if repo_file:
         try:
+            repo_bytes = repo_file.getvalue()
+            repo_hash = hashlib.sha256(repo_bytes).hexdigest()
             with st.spinner("Procesando REPO..."):
-                df_raw = pd.read_excel(repo_file, dtype=str)
+                df_filtrado, n_total, missing, columnas, memoria = cargar_repo(repo_hash, repo_bytes, medidor_sesion())
 
-            # Normalizar nombres de columna
-            df_raw.columns = df_raw.columns.str.strip().str.lower().str.replace(' ', '_')
-
-            missing = [c for c in REPO_COLS if c not in df_raw.columns]
             if missing:
                 st.error(f"Columnas faltantes en el archivo: {missing}")
                 st.markdown("**Columnas disponibles:**")
-                st.code(list(df_raw.columns))
+                st.code(columnas)
             else:
-                df = df_raw[REPO_COLS].copy()
-
-                # Filtros
-                mask = (
-                    (df['familia'].str.strip().str.lower() == 'filtros') &
-                    (df['subfamilia'].str.strip().str.lower() == 'donaldson') &
-                    (df['inactivo'].str.strip().str.lower() == 'no') &
-                    (~df['grupo'].str.strip().str.lower().isin(['dns - inmovilizado', 'dns - a demanda']))
-                )
-                df_filtrado = df[mask].copy()
-
-                # Convertir numéricos
-                numeric_cols = ['consolidado', 'q_fact_3', 'q_fact_6', 'q_fact_12',
-                                'en_sv_en_menos_30_dias', 'en_sv_en_mas_30_dias', 'pc', 'qty_piezas_por_caja']
-                for col in numeric_cols:
-                    df_filtrado[col] = pd.to_numeric(
-                        df_filtrado[col].str.replace(',', '.'), errors='coerce'
-                    ).fillna(0)
-
-                df_filtrado['codigo'] = df_filtrado['codigo'].astype(str).str.strip()
-                st.session_state['repo'] = df_filtrado
-
-                n_total = len(df_raw)
-                n_filtrado = len(df_filtrado)
-
-                st.markdown(f"""
-                <div class="metric-row">
-                    <div class="metric-box"><div class="metric-label">Total registros</div><div class="metric-value">{n_total:,}</div></div>
-                    <div class="metric-box"><div class="metric-label">Después de filtros</div><div class="metric-value" style="color:var(--success)">{n_filtrado:,}</div></div>
-                    <div class="metric-box"><div class="metric-label">Excluidos</div><div class="metric-value" style="color:var(--muted)">{n_total - n_filtrado:,}</div></div>
-                </div>
-                """, unsafe_allow_html=True)
+                # Solo se reemplaza el REPO de la sesión si cambió el contenido del archivo
+                if st.session_state.get('repo_hash') != repo_hash or st.session_state['repo'] is None:
+                    asignar_entrada('repo', df_filtrado, repo_hash)
+                    st.session_state['repo_hash'] = repo_hash
+                df_filtrado = st.session_state['repo']
+
+                # Snapshot columnar para reabrir el mismo REPO sin parsear el Excel
+                if not existe_snapshot(repo_hash):
+                    try:
+                        guardar_snapshot_repo(df_filtrado, repo_hash, repo_file.name, n_total)
+                    except OSError as e:
+                        st.warning(f"No se pudo guardar el snapshot del REPO: {e}")
+
+                mostrar_resumen_repo(df_filtrado, n_total, "REPO cargado y filtrado correctamente.")
+
+                with st.expander("Memoria del REPO en sesión"):
+                    st.markdown(
+                        f"{memoria.loc['TOTAL', 'bytes_antes'] / 1e6:,.1f} MB → "
+                        f"**{memoria.loc['TOTAL', 'bytes'] / 1e6:,.1f} MB** después de compactar "
+                        "(categorías, tabla de códigos y enteros int32)."
+                    )
+                    st.dataframe(memoria, use_container_width=True)
 
-                st.markdown('<div class="success-box">✓ REPO cargado y filtrado correctamente.</div>', unsafe_allow_html=True)
+        except Exception as e:
+            st.error(f"Error al procesar el archivo: {e}")
 
-                with st.expander("Vista previa (primeras 50 filas)"):
-                    st.dataframe(df_filtrado.head(50), use_container_width=True)
+    elif snapshot_sel is not None:
+        try:
+            if st.session_state.get('repo_hash') != snapshot_sel['hash_origen'] or st.session_state['repo'] is None:
+                df_snap, _ = abrir_columnar(snapshot_sel['ruta'])
+                # El snapshot se guardó compactado; se usa tal cual para conservar el memory-map
+                asignar_entrada('repo', df_snap, snapshot_sel['hash_origen'])
+                st.session_state['repo_hash'] = snapshot_sel['hash_origen']
+            mostrar_resumen_repo(st.session_state['repo'], snapshot_sel['filas_origen'],
+                                 f"REPO cargado desde snapshot de {snapshot_sel['nombre_origen']}.")
+        except Exception as e:
+            st.error(f"Error al abrir el snapshot: {e}")
 
+    elif libro_file is not None:
+        try:
+            libro_bytes = libro_file.getvalue()
+            libro_hash = hashlib.sha256(libro_bytes).hexdigest()
+            with st.spinner("Procesando libro de entradas..."):
+                entradas, info = cargar_libro(libro_hash, libro_bytes)
+
+            if info['repo_faltantes']:
+                st.error(f"Columnas faltantes en la hoja REPO: {info['repo_faltantes']}")
+                st.code(info['columnas_repo'])
+            else:
+                if st.session_state['archivos_cargados'].get('libro') != libro_hash:
+                    aplicar_libro(entradas, libro_hash)
+                    for clave, n_repetidos in info['duplicados'].items():
+                        if n_repetidos:
+                            st.warning(f"{clave}: {n_repetidos:,} códigos repetidos se agregaron en un registro "
+                                       f"({NOMBRE_POLITICA[POLITICA_DUPLICADOS[clave]]}).")
+                if 'repo' in entradas:
+                    mostrar_resumen_repo(st.session_state['repo'], info['repo_total'],
+                                         f"REPO cargado desde el libro {libro_file.name}.")
+                st.dataframe(pd.DataFrame(
+                    [(clave, len(v)) for clave, v in entradas.items()
+                     if clave not in PREFIJOS_CONTRATOS.values()] +
+                    [(f"{clave}: {df['empresa'].iat[0]}", len(df)) for clave in PREFIJOS_CONTRATOS.values()
+                     for df in entradas[clave]],
+                    columns=['entrada', 'registros']
+                ), use_container_width=True, hide_index=True)
+                if info['hojas_ignoradas']:
+                    st.info("Hojas ignoradas (nombre no reconocido): " + ", ".join(info['hojas_ignoradas']))
         except Exception as e:
-            st.error(f"Error al procesar el archivo: {e}")
+            st.error(f"Error al procesar el libro: {e}")
 
     elif st.session_state['repo'] is not None:
         df_filtrado = st.session_state['repo']
@@ -566,23 +959,34 @@ with tab_prov:
 
             with col1:
                 st.markdown(f"**Disponible (Reserv.) — {proveedor_label}**")
-                st.markdown('<div class="info-box">Pegá: <code>codigo TAB cantidad</code></div>', unsafe_allow_html=True)
-                txt_reserv = st.text_area(
-                    f"Datos reserv. {proveedor_label}",
-                    height=160,
-                    key=f"txt_{reserv_key}",
-                    placeholder="P12345\t100\nP67890\t50"
-                )
-                if st.button(f"Cargar Reserv. {proveedor_label}", key=f"btn_{reserv_key}"):
-                    if txt_reserv.strip():
-                        df_r = parse_paste(txt_reserv, ['codigo', f'reserv_{proveedor_label.lower()}'])
-                        if df_r is not None:
-                            st.session_state[reserv_key] = df_r
-                            st.success(f"✓ {len(df_r)} registros cargados.")
+                st.markdown('<div class="info-box">Columnas: <code>codigo · cantidad</code></div>', unsafe_allow_html=True)
+                origen = st.radio("Origen", ORIGENES_TABLA, horizontal=True, key=f"origen_{reserv_key}")
+                if origen == "Subir archivo":
+                    df_r, nombre = subir_tabla(f"Archivo reserv. {proveedor_label}", reserv_key,
+                                               COLUMNAS_ENTRADA[reserv_key])
+                    if df_r is not None:
+                        df_r = aviso_duplicados(df_r, reserv_key)
+                        st.session_state[reserv_key] = df_r
+                        st.success(f"✓ {len(df_r)} registros cargados de {nombre}.")
+                else:
+                    txt_reserv = st.text_area(
+                        f"Datos reserv. {proveedor_label}",
+                        height=160,
+                        key=f"txt_{reserv_key}",
+                        placeholder="P12345\t100\nP67890\t50"
+                    )
+                    if st.button(f"Cargar Reserv. {proveedor_label}", key=f"btn_{reserv_key}"):
+                        if txt_reserv.strip():
+                            df_r = parse_paste(txt_reserv, COLUMNAS_ENTRADA[reserv_key])
+                            if df_r is not None:
+                                df_r = aviso_duplicados(df_r, reserv_key)
+                                st.session_state[reserv_key] = df_r
+                                olvidar_archivo(reserv_key)
+                                st.success(f"✓ {len(df_r)} registros cargados.")
+                            else:
+                                st.error("No se pudo parsear. Verificá el formato.")
                         else:
-                            st.error("No se pudo parsear. Verificá el formato.")
-                    else:
-                        st.warning("El campo está vacío.")
+                            st.warning("El campo está vacío.")
 
                 if st.session_state.get(reserv_key) is not None:
                     df_show = st.session_state[reserv_key]
@@ -591,23 +995,33 @@ with tab_prov:
 
             with col2:
                 st.markdown(f"**Backorder — {proveedor_label}**")
-                st.markdown('<div class="info-box">Pegá: <code>codigo TAB cantidad_bo</code></div>', unsafe_allow_html=True)
-                txt_bo = st.text_area(
-                    f"Datos BO {proveedor_label}",
-                    height=160,
-                    key=f"txt_{bo_key}",
-                    placeholder="P12345\t20\nP67890\t10"
-                )
-                if st.button(f"Cargar BO {proveedor_label}", key=f"btn_{bo_key}"):
-                    if txt_bo.strip():
-                        df_b = parse_paste(txt_bo, ['codigo', f'bo_{proveedor_label.lower()}'])
-                        if df_b is not None:
-                            st.session_state[bo_key] = df_b
-                            st.success(f"✓ {len(df_b)} registros cargados.")
+                st.markdown('<div class="info-box">Columnas: <code>codigo · cantidad_bo</code></div>', unsafe_allow_html=True)
+                origen = st.radio("Origen", ORIGENES_TABLA, horizontal=True, key=f"origen_{bo_key}")
+                if origen == "Subir archivo":
+                    df_b, nombre = subir_tabla(f"Archivo BO {proveedor_label}", bo_key, COLUMNAS_ENTRADA[bo_key])
+                    if df_b is not None:
+                        df_b = aviso_duplicados(df_b, bo_key)
+                        st.session_state[bo_key] = df_b
+                        st.success(f"✓ {len(df_b)} registros cargados de {nombre}.")
+                else:
+                    txt_bo = st.text_area(
+                        f"Datos BO {proveedor_label}",
+                        height=160,
+                        key=f"txt_{bo_key}",
+                        placeholder="P12345\t20\nP67890\t10"
+                    )
+                    if st.button(f"Cargar BO {proveedor_label}", key=f"btn_{bo_key}"):
+                        if txt_bo.strip():
+                            df_b = parse_paste(txt_bo, COLUMNAS_ENTRADA[bo_key])
+                            if df_b is not None:
+                                df_b = aviso_duplicados(df_b, bo_key)
+                                st.session_state[bo_key] = df_b
+                                olvidar_archivo(bo_key)
+                                st.success(f"✓ {len(df_b)} registros cargados.")
+                            else:
+                                st.error("No se pudo parsear. Verificá el formato.")
                         else:
-                            st.error("No se pudo parsear. Verificá el formato.")
-                    else:
-                        st.warning("El campo está vacío.")
+                            st.warning("El campo está vacío.")
 
                 if st.session_state.get(bo_key) is not None:
                     df_show = st.session_state[bo_key]
@@ -631,7 +1045,7 @@ with tab_contratos:
         st.markdown("**Contratos Vigentes por Empresa**")
         st.markdown('<div class="info-box">Columnas: <code>codigo · q_fact · q_contrato</code></div>', unsafe_allow_html=True)
 
-        n_cv = st.number_input("Número de empresas con contrato vigente", min_value=0, max_value=20, value=len(st.session_state['contratos_vigentes']), step=1, key="n_cv")
+        n_cv = st.number_input("Número de empresas con contrato vigente", min_value=0, max_value=20, step=1, key="n_cv")
 
         if n_cv != len(st.session_state['contratos_vigentes']):
             # Ajustar lista
@@ -639,20 +1053,30 @@ with tab_contratos:
                 st.session_state['contratos_vigentes'].append(None)
             while len(st.session_state['contratos_vigentes']) > n_cv:
                 st.session_state['contratos_vigentes'].pop()
+                st.session_state['archivos_cargados'].pop(f"cv_{len(st.session_state['contratos_vigentes'])}", None)
 
         for i in range(int(n_cv)):
             with st.expander(f"Empresa {i+1}" + (" ✓" if st.session_state['contratos_vigentes'][i] is not None else " ○"), expanded=(i == 0)):
                 empresa_name = st.text_input(f"Nombre empresa", key=f"cv_name_{i}", placeholder=f"Empresa {i+1}")
-                txt = st.text_area(f"Datos empresa {i+1}", height=130, key=f"cv_txt_{i}",
-                                   placeholder="P12345\t50\t60\nP67890\t30\t30")
-                if st.button(f"Cargar empresa {i+1}", key=f"cv_btn_{i}"):
-                    df_cv = parse_paste(txt, ['codigo', 'q_fact', 'q_contrato'])
+                origen = st.radio("Origen", ORIGENES_TABLA, horizontal=True, key=f"cv_origen_{i}")
+                if origen == "Subir archivo":
+                    df_cv, nombre = subir_tabla(f"Archivo empresa {i+1}", f"cv_{i}", COLUMNAS_ENTRADA['contratos_vigentes'])
                     if df_cv is not None:
-                        df_cv['empresa'] = empresa_name or f"Empresa_{i+1}"
+                        df_cv['empresa'] = empresa_name or Path(nombre).stem
                         st.session_state['contratos_vigentes'][i] = df_cv
                         st.success(f"✓ {len(df_cv)} registros")
-                    else:
-                        st.error("Error al parsear.")
+                else:
+                    txt = st.text_area(f"Datos empresa {i+1}", height=130, key=f"cv_txt_{i}",
+                                       placeholder="P12345\t50\t60\nP67890\t30\t30")
+                    if st.button(f"Cargar empresa {i+1}", key=f"cv_btn_{i}"):
+                        df_cv = parse_paste(txt, COLUMNAS_ENTRADA['contratos_vigentes'])
+                        if df_cv is not None:
+                            df_cv['empresa'] = empresa_name or f"Empresa_{i+1}"
+                            st.session_state['contratos_vigentes'][i] = df_cv
+                            olvidar_archivo(f"cv_{i}")
+                            st.success(f"✓ {len(df_cv)} registros")
+                        else:
+                            st.error("Error al parsear.")
                 if st.session_state['contratos_vigentes'][i] is not None:
                     st.dataframe(st.session_state['contratos_vigentes'][i].head(5), use_container_width=True)
 
@@ -661,27 +1085,37 @@ with tab_contratos:
         st.markdown("**Contratos a Excluir**")
         st.markdown('<div class="info-box">Columnas: <code>codigo · q_3m · q_6m · q_12m</code></div>', unsafe_allow_html=True)
 
-        n_ce = st.number_input("Número de empresas a excluir", min_value=0, max_value=20, value=len(st.session_state['contratos_excluir']), step=1, key="n_ce")
+        n_ce = st.number_input("Número de empresas a excluir", min_value=0, max_value=20, step=1, key="n_ce")
 
         if n_ce != len(st.session_state['contratos_excluir']):
             while len(st.session_state['contratos_excluir']) < n_ce:
                 st.session_state['contratos_excluir'].append(None)
             while len(st.session_state['contratos_excluir']) > n_ce:
                 st.session_state['contratos_excluir'].pop()
+                st.session_state['archivos_cargados'].pop(f"ce_{len(st.session_state['contratos_excluir'])}", None)
 
         for i in range(int(n_ce)):
             with st.expander(f"Empresa excluir {i+1}" + (" ✓" if st.session_state['contratos_excluir'][i] is not None else " ○"), expanded=(i == 0)):
                 empresa_name = st.text_input(f"Nombre empresa excluir", key=f"ce_name_{i}", placeholder=f"Excluir {i+1}")
-                txt = st.text_area(f"Datos excluir {i+1}", height=130, key=f"ce_txt_{i}",
-                                   placeholder="P12345\t10\t20\t45\nP67890\t5\t10\t22")
-                if st.button(f"Cargar excluir {i+1}", key=f"ce_btn_{i}"):
-                    df_ce = parse_paste(txt, ['codigo', 'q_3m', 'q_6m', 'q_12m'])
+                origen = st.radio("Origen", ORIGENES_TABLA, horizontal=True, key=f"ce_origen_{i}")
+                if origen == "Subir archivo":
+                    df_ce, nombre = subir_tabla(f"Archivo excluir {i+1}", f"ce_{i}", COLUMNAS_ENTRADA['contratos_excluir'])
                     if df_ce is not None:
-                        df_ce['empresa'] = empresa_name or f"Excluir_{i+1}"
+                        df_ce['empresa'] = empresa_name or Path(nombre).stem
                         st.session_state['contratos_excluir'][i] = df_ce
                         st.success(f"✓ {len(df_ce)} registros")
-                    else:
-                        st.error("Error al parsear.")
+                else:
+                    txt = st.text_area(f"Datos excluir {i+1}", height=130, key=f"ce_txt_{i}",
+                                       placeholder="P12345\t10\t20\t45\nP67890\t5\t10\t22")
+                    if st.button(f"Cargar excluir {i+1}", key=f"ce_btn_{i}"):
+                        df_ce = parse_paste(txt, COLUMNAS_ENTRADA['contratos_excluir'])
+                        if df_ce is not None:
+                            df_ce['empresa'] = empresa_name or f"Excluir_{i+1}"
+                            st.session_state['contratos_excluir'][i] = df_ce
+                            olvidar_archivo(f"ce_{i}")
+                            st.success(f"✓ {len(df_ce)} registros")
+                        else:
+                            st.error("Error al parsear.")
                 if st.session_state['contratos_excluir'][i] is not None:
                     st.dataframe(st.session_state['contratos_excluir'][i].head(5), use_container_width=True)
 
@@ -693,25 +1127,36 @@ with tab_precios:
     st.markdown('<div class="section-title">💲 Lista de Precios Polifiltro</div>', unsafe_allow_html=True)
     st.markdown('<div class="info-box">Columnas: <code>codigo · precio_polifiltro</code></div>', unsafe_allow_html=True)
 
-    txt_precio = st.text_area("Pegá los precios de Polifiltro", height=250, key="txt_precio",
-                              placeholder="P12345\t15.50\nP67890\t8.00")
-    if st.button("Cargar precios Polifiltro"):
-        if txt_precio.strip():
-            df_p = parse_paste(txt_precio, ['codigo', 'precio_polifiltro'])
-            if df_p is not None:
-                st.session_state['precio_polifiltro'] = df_p
-                st.markdown(f'<div class="success-box">✓ {len(df_p)} precios cargados.</div>', unsafe_allow_html=True)
-                st.dataframe(df_p.head(20), use_container_width=True)
+    origen = st.radio("Origen", ORIGENES_TABLA, horizontal=True, key="origen_precio")
+    if origen == "Subir archivo":
+        df_p, nombre = subir_tabla("Archivo de precios Polifiltro", 'precio_polifiltro',
+                                   COLUMNAS_ENTRADA['precio_polifiltro'])
+        if df_p is not None:
+            df_p = aviso_duplicados(df_p, 'precio_polifiltro')
+            asignar_entrada('precio_polifiltro', df_p)
+            st.markdown(f'<div class="success-box">✓ {len(df_p)} precios cargados de {nombre}.</div>', unsafe_allow_html=True)
+    else:
+        txt_precio = st.text_area("Pegá los precios de Polifiltro", height=250, key="txt_precio",
+                                  placeholder="P12345\t15.50\nP67890\t8.00")
+        if st.button("Cargar precios Polifiltro"):
+            if txt_precio.strip():
+                df_p = parse_paste(txt_precio, COLUMNAS_ENTRADA['precio_polifiltro'])
+                if df_p is not None:
+                    df_p = aviso_duplicados(df_p, 'precio_polifiltro')
+                    asignar_entrada('precio_polifiltro', df_p)
+                    olvidar_archivo('precio_polifiltro')
+                    st.markdown(f'<div class="success-box">✓ {len(df_p)} precios cargados.</div>', unsafe_allow_html=True)
+                    st.dataframe(df_p.head(20), use_container_width=True)
+                else:
+                    st.error("Error al parsear. Verificá el formato.")
             else:
-                st.error("Error al parsear. Verificá el formato.")
-        else:
-            st.warning("Campo vacío.")
+                st.warning("Campo vacío.")
 
     if st.session_state['precio_polifiltro'] is not None:
         df_show = st.session_state['precio_polifiltro']
         st.markdown(f'<div class="success-box">✓ {len(df_show)} precios ya cargados.</div>', unsafe_allow_html=True)
         with st.expander("Ver precios"):
-            st.dataframe(df_show, use_container_width=True)
+            tabla_paginada(df_show, "tabla_precios")
 
 
 # ═══════════════════════════════════════════════════════
@@ -748,215 +1193,36 @@ with tab_proceso:
         try:
             with st.spinner("Procesando datos..."):
 
-                # ── 1. Base: REPO ──
-                df = st.session_state['repo'].copy()
-
-                # ── 2. Merge datos de proveedores ──
-                def merge_col(df_base, df_prov, col_name, default=0):
-                    if df_prov is not None:
-                        df_prov_renamed = df_prov.rename(columns={df_prov.columns[1]: col_name})
-                        return df_base.merge(df_prov_renamed[['codigo', col_name]], on='codigo', how='left')
-                    else:
-                        df_base[col_name] = default
-                        return df_base
-
-                df = merge_col(df, st.session_state['reserv_mexico'], 'reserv_mexico')
-                df = merge_col(df, st.session_state['bo_mexico'], 'bo_mexico')
-                df = merge_col(df, st.session_state['reserv_polifiltro'], 'reserv_polifiltro')
-                df = merge_col(df, st.session_state['bo_polifiltro'], 'bo_polifiltro')
-                df = merge_col(df, st.session_state['precio_polifiltro'], 'precio_polifiltro')
-
-                # Rellenar NaN
-                for col in ['reserv_mexico', 'bo_mexico', 'reserv_polifiltro', 'bo_polifiltro', 'precio_polifiltro']:
-                    df[col] = df[col].fillna(0)
-
-                # ── 3. Contratos vigentes ──
-                # Se calculan dos agregados separados por código:
-                #   a) suma_min_contratos: min(q_fact, q_contrato) por contrato → se usa para
-                #      restar de la demanda histórica al calcular demanda sin contratos,
-                #      representando lo que efectivamente se facturó dentro del marco del contrato.
-                #   b) demanda_mensual_contratos: sum(q_contrato) → demanda comprometida
-                #      contractualmente, independiente de lo que se haya facturado.
-
-                cv_list = [c for c in st.session_state['contratos_vigentes'] if c is not None]
-                if cv_list:
-                    df_cv_all = pd.concat(cv_list, ignore_index=True)
-
-                    # a) Mín(facturado, contrato) — para depurar la demanda histórica
-                    df_cv_all['min_cv'] = df_cv_all[['q_fact', 'q_contrato']].min(axis=1)
-                    df_min_agg = df_cv_all.groupby('codigo')['min_cv'].sum().reset_index()
-                    df_min_agg.rename(columns={'min_cv': 'suma_min_contratos'}, inplace=True)
-
-                    # b) Cantidad en contrato — demanda futura comprometida
-                    df_contrato_agg = df_cv_all.groupby('codigo')['q_contrato'].sum().reset_index()
-                    df_contrato_agg.rename(columns={'q_contrato': 'demanda_mensual_contratos'}, inplace=True)
-
-                    df = df.merge(df_min_agg, on='codigo', how='left')
-                    df = df.merge(df_contrato_agg, on='codigo', how='left')
-                else:
-                    df['suma_min_contratos'] = 0
-                    df['demanda_mensual_contratos'] = 0
-
-                df['suma_min_contratos'] = df['suma_min_contratos'].fillna(0)
-                df['demanda_mensual_contratos'] = df['demanda_mensual_contratos'].fillna(0)
-
-                # Procesar contratos a excluir
-                ce_list = [c for c in st.session_state['contratos_excluir'] if c is not None]
-                if ce_list:
-                    df_ce_all = pd.concat(ce_list, ignore_index=True)
-                    df_ce_agg = df_ce_all.groupby('codigo')[['q_3m', 'q_6m', 'q_12m']].sum().reset_index()
-                    df = df.merge(df_ce_agg, on='codigo', how='left')
-                else:
-                    df['q_3m'] = 0
-                    df['q_6m'] = 0
-                    df['q_12m'] = 0
-                for c in ['q_3m', 'q_6m', 'q_12m']:
-                    df[c] = df[c].fillna(0)
-
-                # ── 4. Demanda mensual sin contratos ──
-                # Promedio mensual de facturación neta (descontando lo facturado bajo contrato),
-                # luego se resta la demanda_mensual_contratos para aislar la demanda libre de contratos.
-                # Se usa suma_min_contratos (no q_contrato) para la depuración histórica, ya que
-                # representa lo que realmente se facturó dentro del marco del contrato.
-                prom_3  = (df['q_fact_3']  - df['q_3m'])  / 3
-                prom_6  = (df['q_fact_6']  - df['q_6m'])  / 6
-                prom_12 = (df['q_fact_12'] - df['q_12m']) / 12
-
-                # Promedio de los tres horizontes menos el mínimo facturado bajo contratos vigentes
-                df['demanda_mensual_sin_contratos'] = (
-                    ((prom_3 + prom_6 + prom_12) / 3) - df['suma_min_contratos']
-                ).clip(lower=0)
-
-                # ── 5. Stock virtual ──
-                df['stock_virtual'] = (
-                    df['consolidado'] +
-                    df['en_sv_en_menos_30_dias'] +
-                    df['en_sv_en_mas_30_dias'] +
-                    df['reserv_mexico'] +
-                    df['bo_mexico']
-                )
-
-                # ── 6. Diferencia de precio (Polifiltro vs México) ──
-                # Valor negativo = Polifiltro más barato. Ej: -10 significa 10% más barato.
-                df['diferencia_precio_pct'] = np.where(
-                    df['pc'] > 0,
-                    (df['precio_polifiltro'] - df['pc']) / df['pc'] * 100,
-                    np.nan
-                )
-
-                # Clasificación del tramo de precio para decidir dónde y cuánto comprar:
-                #   'POLI_FUERTE' : Polifiltro >= 8% más barato  → proporciones máximas en Poli
-                #   'POLI_LEVE'   : Polifiltro entre 5.5% y 8% más barato → proporciones intermedias
-                #   'MEX'         : diferencia < 5.5%  → todo México
-                tiene_precio_poli = df['precio_polifiltro'] > 0
-                diff = df['diferencia_precio_pct']
-
-                df['donde_comprar'] = np.where(
-                    tiene_precio_poli & (diff <= -8.0),   'POLI_FUERTE',
-                    np.where(
-                    tiene_precio_poli & (diff <= -5.5),   'POLI_LEVE',
-                                                          'MEX'
-                ))
-
-                # ── 7. Stock objetivo, casos y proporciones ──
-                # Calificaciones premium (mayor rotación / criticidad)
-                cal_aa = df['clasificacion'].str.upper().isin(['AA', 'AB', 'AC', 'BA'])
-
-                dms = df['demanda_mensual_sin_contratos']
-                dmc = df['demanda_mensual_contratos']
-
-                # ┌──────────────┬──────────────────┬───────────────────────────────────────┐
-                # │ Caso         │ Condición        │ Stock objetivo / Proporción           │
-                # ├──────────────┼──────────────────┼───────────────────────────────────────┤
-                # │ A  (MEX)     │ donde_comprar=MEX│ 6×dms + 4×dmc  |  6x0                │
-                # │ B1 (POLI AA) │ POLI_FUERTE + AA │ 8×dms + 4×dmc  |  5x3                │
-                # │ B2 (POLI)    │ POLI_FUERTE      │ 7×dms + 4×dmc  |  4x3                │
-                # │ C1 (POLI AA) │ POLI_LEVE + AA   │ 8×dms + 4×dmc  |  6x2                │
-                # │ C2 (POLI)    │ POLI_LEVE        │ 7×dms + 4×dmc  |  5x2                │
-                # └──────────────┴──────────────────┴───────────────────────────────────────┘
-                cond_a  = df['donde_comprar'] == 'MEX'
-                cond_b1 = (df['donde_comprar'] == 'POLI_FUERTE') &  cal_aa
-                cond_b2 = (df['donde_comprar'] == 'POLI_FUERTE') & ~cal_aa
-                cond_c1 = (df['donde_comprar'] == 'POLI_LEVE')   &  cal_aa
-                cond_c2 = (df['donde_comprar'] == 'POLI_LEVE')   & ~cal_aa
-
-                df['stock_objetivo'] = np.select(
-                    [cond_a,        cond_b1,         cond_b2,         cond_c1,         cond_c2],
-                    [6*dms+4*dmc,   8*dms+4*dmc,     7*dms+4*dmc,     8*dms+4*dmc,     7*dms+4*dmc],
-                    default=6*dms+4*dmc
-                )
-
-                df['caso'] = np.select(
-                    [cond_a, cond_b1, cond_b2, cond_c1, cond_c2],
-                    ['A',    'B1',    'B2',    'C1',    'C2'],
-                    default='A'
-                )
-
-                df['proporcion'] = np.select(
-                    [cond_a, cond_b1, cond_b2, cond_c1, cond_c2],
-                    ['6x0',  '5x3',   '4x3',   '6x2',   '5x2'],
-                    default='6x0'
-                )
-
-                # ── 8. Cantidades a comprar ──
-                so  = df['stock_objetivo']
-                sv  = df['stock_virtual']
-                rp  = df['reserv_polifiltro']
-                bop = df['bo_polifiltro']
-
-                # Caso A — todo México, nada en Polifiltro
-                qty_mex_a   = (so - sv).clip(lower=0)
-                qty_poli_a  = pd.Series(0.0, index=df.index)
-
-                # Caso B1 — proporción 5x3: 5/8 meses en México, 3/8 en Polifiltro
-                qty_mex_b1  = (((5 * so) / 8) - sv).clip(lower=0)
-                qty_poli_b1 = (so - sv - qty_mex_b1 - rp - bop).clip(lower=0)
-
-                # Caso B2 — proporción 4x3: 4/7 meses en México, 3/7 en Polifiltro
-                qty_mex_b2  = (((4 * so) / 7) - sv).clip(lower=0)
-                qty_poli_b2 = (so - sv - qty_mex_b2 - rp - bop).clip(lower=0)
-
-                # Caso C1 — proporción 6x2: 6/8 meses en México, 2/8 en Polifiltro
-                qty_mex_c1  = (((6 * so) / 8) - sv).clip(lower=0)
-                qty_poli_c1 = (so - sv - qty_mex_c1 - rp - bop).clip(lower=0)
-
-                # Caso C2 — proporción 5x2: 5/7 meses en México, 2/7 en Polifiltro
-                qty_mex_c2  = (((5 * so) / 7) - sv).clip(lower=0)
-                qty_poli_c2 = (so - sv - qty_mex_c2 - rp - bop).clip(lower=0)
-
-                df['qty_comprar_mexico'] = np.select(
-                    [cond_a,      cond_b1,      cond_b2,      cond_c1,      cond_c2],
-                    [qty_mex_a,   qty_mex_b1,   qty_mex_b2,   qty_mex_c1,   qty_mex_c2],
-                    default=qty_mex_a
-                )
-                df['qty_comprar_polifiltro'] = np.select(
-                    [cond_a,      cond_b1,       cond_b2,       cond_c1,       cond_c2],
-                    [qty_poli_a,  qty_poli_b1,   qty_poli_b2,   qty_poli_c1,   qty_poli_c2],
-                    default=qty_poli_a
+                # Pipeline por etapas: solo se recalcula lo que depende de entradas que cambiaron
+                if st.session_state['pipeline'] is None:
+                    st.session_state['pipeline'] = PipelineCompras()
+                pipeline = st.session_state['pipeline']
+                df = pipeline.calcular(
+                    st.session_state['repo'],
+                    reserv_mexico=st.session_state['reserv_mexico'],
+                    bo_mexico=st.session_state['bo_mexico'],
+                    reserv_polifiltro=st.session_state['reserv_polifiltro'],
+                    bo_polifiltro=st.session_state['bo_polifiltro'],
+                    precio_polifiltro=st.session_state['precio_polifiltro'],
+                    contratos_vigentes=st.session_state['contratos_vigentes'],
+                    contratos_excluir=st.session_state['contratos_excluir'],
+                    medidor=medidor_sesion(),
                 )
 
-                # ── 9. Redondeo al tamaño de caja (ceiling al múltiplo de qty_piezas_por_caja) ──
-                # Si qty_piezas_por_caja <= 0 o es NaN, se trata como caja de 1 (sin efecto).
-                # Fórmula: ceil(qty / caja) * caja  →  garantiza comprar cajas completas.
-                caja = df['qty_piezas_por_caja'].fillna(1).clip(lower=1)
-
-                def redondear_caja(qty_serie, caja_serie):
-                    """Redondea cada cantidad hacia arriba al múltiplo de caja más cercano.
-                    Si la cantidad es 0, devuelve 0 (no se genera pedido)."""
-                    qty = qty_serie.clip(lower=0)
-                    redondeado = np.where(
-                        qty > 0,
-                        np.ceil(qty / caja_serie) * caja_serie,
-                        0
-                    )
-                    return redondeado.astype(int)
-
-                df['qty_comprar_mexico']     = redondear_caja(df['qty_comprar_mexico'],     caja)
-                df['qty_comprar_polifiltro'] = redondear_caja(df['qty_comprar_polifiltro'], caja)
-
                 st.session_state['resultado'] = df
+                st.session_state['resultado_version'] += 1
 
             st.markdown('<div class="success-box">✓ Procesamiento completado correctamente.</div>', unsafe_allow_html=True)
+            recalculadas = st.session_state['pipeline'].recalculadas
+            st.caption("Etapas recalculadas: " + (", ".join(recalculadas) if recalculadas else "ninguna (sin cambios en las entradas)"))
+            try:
+                corrida = archivar_corrida(df, sesion=st.session_state['sesion'], repo_hash=st.session_state['repo_hash'])
+                if corrida is None:
+                    st.caption("Resultado igual al de la última corrida del historial: no se archivó de nuevo.")
+                else:
+                    st.caption(f"Corrida archivada en el historial como `{corrida['id']}`.")
+            except OSError as e:
+                st.warning(f"No se pudo archivar la corrida: {e}")
 
         except Exception as e:
             import traceback
@@ -1014,62 +1280,127 @@ with tab_proceso:
         # Distribución por caso
         caso_counts = df_res['caso'].value_counts()
         st.markdown(
-            f"**Distribución por caso:** "
-            f"A={caso_counts.get('A',0)} · "
-            f"B1={caso_counts.get('B1',0)} · "
-            f"B2={caso_counts.get('B2',0)} · "
-            f"C1={caso_counts.get('C1',0)} · "
-            f"C2={caso_counts.get('C2',0)}"
+            "**Distribución por caso:** " +
+            " · ".join(f"{caso}={caso_counts.get(caso, 0)}" for caso, *_ in TABLA_CASOS)
         )
 
         with st.expander("📊 Ver tabla completa de resultados"):
-            st.dataframe(df_res, use_container_width=True)
+            tabla_paginada(df_res, "tabla_resultados")
+
+        # ── Ajuste a presupuesto ──
+        ajustado = any(c.startswith('qty_sugerida_') for c in df_res.columns)
+        with st.expander("💰 Ajuste a presupuesto por proveedor" + (" (aplicado)" if ajustado else ""),
+                         expanded=ajustado):
+            st.markdown(
+                "Recorta las órdenes por cajas completas, priorizando la cobertura del stock "
+                "objetivo ponderada por clasificación (A=3, B=2, C=1). 0 = sin tope."
+            )
+            col_p1, col_p2 = st.columns(2)
+            with col_p1:
+                tope_mex = st.number_input("Presupuesto México ($)", min_value=0.0, step=10000.0, key="tope_mex")
+            with col_p2:
+                tope_poli = st.number_input("Presupuesto Polifiltro ($)", min_value=0.0, step=10000.0, key="tope_poli")
+            col_b1, col_b2 = st.columns(2)
+            with col_b1:
+                if st.button("Ajustar a presupuesto", key="btn_presupuesto", disabled=not (tope_mex or tope_poli)):
+                    df_ajustado, resumen = ajustar_a_presupuesto(
+                        df_res, {'mexico': tope_mex or None, 'polifiltro': tope_poli or None})
+                    st.session_state['resultado'] = df_ajustado
+                    st.session_state['resultado_version'] += 1
+                    st.session_state['resumen_presupuesto'] = resumen
+                    st.rerun()
+            with col_b2:
+                if st.button("Quitar ajuste", key="btn_quitar_presupuesto", disabled=not ajustado):
+                    st.session_state['resultado'] = quitar_ajuste(df_res)
+                    st.session_state['resultado_version'] += 1
+                    st.session_state['resumen_presupuesto'] = None
+                    st.rerun()
+            if ajustado and st.session_state['resumen_presupuesto'] is not None:
+                st.dataframe(st.session_state['resumen_presupuesto'], use_container_width=True, hide_index=True)
+
+        # ── Escenarios what-if ──
+        with st.expander("🔬 Escenarios: umbrales, meses y proporciones"):
+            st.markdown(
+                "Evalúa todas las combinaciones de los valores indicados (separados por espacio) "
+                "sobre el resultado actual, sin volver a calcular demanda ni stock."
+            )
+            col_e1, col_e2, col_e3 = st.columns(3)
+            with col_e1:
+                txt_fuerte = st.text_input("Umbral POLI_FUERTE (%)", f"{UMBRAL_POLI_FUERTE:g}", key="esc_fuerte")
+                txt_leve = st.text_input("Umbral POLI_LEVE (%)", f"{UMBRAL_POLI_LEVE:g}", key="esc_leve")
+            with col_e2:
+                txt_mc = st.text_input("Meses de contratos", f"{MESES_CONTRATOS:g}", key="esc_mc")
+                txt_dms = st.text_input("Δ meses DMS (todos los casos)", "0", key="esc_dms")
+            with col_e3:
+                txt_poli = st.text_input("Meses que pasan de México a Polifiltro", "0", key="esc_poli",
+                                         help="Ej. 1: 5x3 → 4x4, 6x2 → 5x3.")
+            try:
+                valores = {
+                    'umbral_poli_fuerte': lista_numeros(txt_fuerte),
+                    'umbral_poli_leve': lista_numeros(txt_leve),
+                    'meses_contratos': lista_numeros(txt_mc),
+                    'delta_meses_dms': [int(v) for v in lista_numeros(txt_dms)],
+                    'delta_meses_poli': [int(v) for v in lista_numeros(txt_poli)],
+                }
+                lista_escenarios = grilla(**valores)
+            except ValueError as e:
+                st.error(f"Valores inválidos: {e}")
+                lista_escenarios = []
+            st.caption(f"{len(lista_escenarios):,} escenarios × {len(df_res):,} códigos")
+            clave_esc = f"escenarios.{valores!r}" if lista_escenarios else None
+            if st.button("Evaluar escenarios", key="btn_escenarios", disabled=not lista_escenarios):
+                with st.spinner("Evaluando escenarios..."):
+                    memo_resultado(clave_esc, lambda: evaluar_escenarios(df_res, lista_escenarios))
+            df_esc = memo_resultado(clave_esc) if clave_esc else None
+            if df_esc is not None:
+                st.dataframe(df_esc.sort_values('monto_total'), use_container_width=True, hide_index=True)
 
         # ── Exportar ──
         st.markdown("---")
         st.markdown("### 📥 Exportar resultados")
 
+        formato = st.radio(
+            "Formato", formatos_disponibles(), format_func=lambda f: FORMATOS[f][0],
+            horizontal=True, key="formato_export",
+            help="CSV y Parquet se escriben mucho más rápido que Excel; en esos formatos cada orden va en su propio archivo."
+        )
+        mime = FORMATOS[formato][2]
+
         col_ex1, col_ex2 = st.columns(2)
 
         with col_ex1:
             st.markdown("**Archivo completo con todos los cálculos**")
-            excel_full = to_excel_bytes({'Resultados': df_res})
-            st.download_button(
-                label="⬇ Descargar resultados completos",
-                data=excel_full,
-                file_name="resultados_compras_completo.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-            )
+            if st.button("Generar archivo completo", key="gen_completo"):
+                with st.spinner("Generando archivo..."):
+                    memo_resultado(f'completo.{formato}', lambda: exportar_bytes(
+                        {'Resultados': df_res}, 'resultados_compras_completo', formato, medidor_sesion()))
+            for nombre, datos in memo_resultado(f'completo.{formato}') or []:
+                st.download_button(
+                    label=f"⬇ Descargar {nombre}",
+                    data=datos,
+                    file_name=nombre,
+                    mime=mime,
+                    key=f"dl_{nombre}"
+                )
+
+        df_mex, df_poli = memo_resultado('ordenes', lambda: ordenes_compra(df_res))
 
         with col_ex2:
             st.markdown("**Órdenes de compra por proveedor**")
-
-            # Orden México
-            df_mex = df_res[df_res['qty_comprar_mexico'] > 0][[
-                'codigo', 'codfabricante', 'descripcion', 'clasificacion', 'caso', 'proporcion',
-                'demanda_mensual_sin_contratos', 'demanda_mensual_contratos',
-                'stock_virtual', 'stock_objetivo', 'qty_comprar_mexico', 'pc'
-            ]].copy()
-            df_mex['monto_mexico'] = (df_mex['qty_comprar_mexico'] * df_mex['pc']).round(2)
-
-            # Orden Polifiltro
-            df_poli = df_res[df_res['qty_comprar_polifiltro'] > 0][[
-                'codigo', 'codfabricante', 'descripcion', 'clasificacion', 'caso', 'proporcion',
-                'demanda_mensual_sin_contratos', 'demanda_mensual_contratos',
-                'stock_virtual', 'stock_objetivo', 'qty_comprar_polifiltro', 'precio_polifiltro'
-            ]].copy()
-            df_poli['monto_polifiltro'] = (df_poli['qty_comprar_polifiltro'] * df_poli['precio_polifiltro']).round(2)
-
-            excel_oc = to_excel_bytes({
-                'OC México': df_mex,
-                'OC Polifiltro': df_poli
-            })
-            st.download_button(
-                label="⬇ Descargar órdenes de compra",
-                data=excel_oc,
-                file_name="ordenes_compra_proveedores.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-            )
+            if st.button("Generar órdenes de compra", key="gen_oc"):
+                with st.spinner("Generando archivo..."):
+                    memo_resultado(f'oc.{formato}', lambda: exportar_bytes({
+                        'OC México': df_mex,
+                        'OC Polifiltro': df_poli
+                    }, 'ordenes_compra_proveedores', formato, medidor_sesion()))
+            for nombre, datos in memo_resultado(f'oc.{formato}') or []:
+                st.download_button(
+                    label=f"⬇ Descargar {nombre}",
+                    data=datos,
+                    file_name=nombre,
+                    mime=mime,
+                    key=f"dl_{nombre}"
+                )
 
         # Preview OC
         with st.expander("Vista previa: OC México (top 20)"):
@@ -1082,4 +1413,75 @@ with tab_proceso:
             if len(df_poli) > 0:
                 st.dataframe(df_poli.head(20), use_container_width=True)
             else:
-                st.info("No hay compras a Polifiltro.")
\ No newline at end of file
+                st.info("No hay compras a Polifiltro.")
+
+    # ── Historial de corridas ──
+    with st.expander("🕘 Historial de corridas (comparar con cálculos anteriores)"):
+        corridas = listar_corridas()
+        if len(corridas) < 2:
+            st.info("Se necesitan al menos dos corridas archivadas: cada cálculo se agrega al historial.")
+        else:
+            corridas = corridas.iloc[::-1].reset_index(drop=True)
+            st.dataframe(corridas.head(20), use_container_width=True, hide_index=True)
+            etiquetas = {
+                r.id: f"{r.fecha} · {r.codigos:,} códigos · ${r.monto_mexico + r.monto_polifiltro:,.0f}"
+                for r in corridas.itertuples()
+            }
+            c_antes, c_despues = st.columns(2)
+            with c_antes:
+                id_antes = st.selectbox("Corrida anterior", list(etiquetas), index=1,
+                                        format_func=etiquetas.get, key="hist_antes")
+            with c_despues:
+                id_despues = st.selectbox("Corrida posterior", list(etiquetas), index=0,
+                                          format_func=etiquetas.get, key="hist_despues")
+
+            # El diff se guarda en sesión para que paginar no vuelva a unir las corridas
+            memo = st.session_state['diff_historial']
+            if memo is None or memo[0] != (id_antes, id_despues):
+                try:
+                    memo = ((id_antes, id_despues), diferencias_corridas(id_antes, id_despues))
+                except FileNotFoundError as e:
+                    st.error(f"No se encontró la corrida en el historial: {e.filename}")
+                    memo = ((id_antes, id_despues), None)
+                except Exception as e:
+                    st.error(f"No se pudieron comparar las corridas: {e}")
+                    memo = ((id_antes, id_despues), None)
+                st.session_state['diff_historial'] = memo
+            diff = memo[1]
+            if diff is not None:
+                st.dataframe(resumen_diferencias(diff), use_container_width=True, hide_index=True)
+                if diff.empty:
+                    st.info("Las dos corridas tienen los mismos casos y cantidades.")
+                else:
+                    tabla_paginada(diff, key="hist_diff")
+
+    # ── Diagnóstico ──
+    with st.expander("🩺 Diagnóstico (tiempo, filas y memoria por etapa)"):
+        medidor = medidor_sesion()
+        medidor.memoria = st.checkbox(
+            "Medir memoria pico (tracemalloc: hace varias veces más lento el cálculo y la exportación)",
+            value=medidor.memoria, key="diag_memoria",
+            help="Solo para diagnóstico. También se activa por defecto con COMPRAS_DIAGNOSTICO_MEMORIA=1.")
+        registros = medidor.tabla()
+        if registros.empty:
+            st.info("Todavía no hay etapas medidas: carga el REPO o ejecuta el cálculo.")
+        else:
+            st.dataframe(registros.iloc[::-1], use_container_width=True, hide_index=True)
+            if st.button("Limpiar registros", key="diag_limpiar"):
+                medidor.registros.clear()
+                st.rerun()
+        if medidor.log:
+            st.caption(f"Cada registro se agrega también como línea JSON en `{medidor.log}`.")
+        else:
+            st.caption("Define COMPRAS_LOG_DIAGNOSTICO para guardar los registros en un archivo JSON Lines.")
+
+        compartidas = registro_compartido().estadisticas()
+        if not compartidas.empty:
+            st.markdown("**Entradas compartidas entre sesiones** (una copia por contenido en este servidor)")
+            st.dataframe(compartidas, use_container_width=True, hide_index=True)
+
+
+# Al final de cada rerun: persistir las entradas que cambiaron y renovar las referencias compartidas
+guardar_sesion()
+registro_compartido().tocar(st.session_state['cliente'])
+registro_compartido().desalojar()
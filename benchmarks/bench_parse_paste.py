@@ -0,0 +1,90 @@
+"""
+Benchmark de `calculo.parse_paste` contra la implementación original.
+
+Genera pegados sintéticos (TSV con punto decimal, TSV con coma decimal y CSV),
+verifica que ambas implementaciones den el mismo resultado y mide tiempos.
+
+Uso:
+    python benchmarks/bench_parse_paste.py [--filas 40000] [--repeticiones 5]
+"""
+
+import argparse
+import sys
+import time
+from io import StringIO
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from calculo import parse_paste  # noqa: E402
+
+
+def parse_paste_original(text: str, columns: list, sep='\t') -> pd.DataFrame | None:
+    """Implementación previa de parse_paste (referencia)."""
+    lines = [l for l in text.strip().splitlines() if l.strip()]
+    if not lines:
+        return None
+    first = lines[0].split(sep)
+    if len(first) != len(columns):
+        sep = ','
+        first = lines[0].split(sep)
+    df = pd.read_csv(StringIO('\n'.join(lines)), sep=sep, header=None, names=columns, dtype=str)
+    if df.iloc[0].str.lower().tolist() == [c.lower() for c in columns]:
+        df = df.iloc[1:].reset_index(drop=True)
+    for col in columns[1:]:
+        df[col] = pd.to_numeric(df[col].str.replace(',', '.'), errors='coerce').fillna(0)
+    df[columns[0]] = df[columns[0]].astype(str).str.strip()
+    return df
+
+
+def generar_pegado(filas: int, columnas: list, sep: str, coma_decimal: bool, seed=0) -> str:
+    rng = np.random.default_rng(seed)
+    datos = {columnas[0]: [f'P{i:06d}' for i in range(filas)]}
+    for col in columnas[1:]:
+        valores = np.round(rng.uniform(0, 500, filas), 2).astype(str)
+        datos[col] = np.char.replace(valores, '.', ',') if coma_decimal else valores
+    buf = StringIO()
+    pd.DataFrame(datos).to_csv(buf, sep=sep, index=False)
+    return buf.getvalue()
+
+
+def medir(fn, repeticiones):
+    tiempos = []
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        fn()
+        tiempos.append(time.perf_counter() - t0)
+    return min(tiempos)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filas', type=int, default=40_000)
+    parser.add_argument('--repeticiones', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    casos = [
+        ('precios TSV punto', ['codigo', 'precio_polifiltro'], '\t', False),
+        ('precios TSV coma', ['codigo', 'precio_polifiltro'], '\t', True),
+        ('excluir TSV coma', ['codigo', 'q_3m', 'q_6m', 'q_12m'], '\t', True),
+        ('contratos CSV', ['codigo', 'q_fact', 'q_contrato'], ',', False),
+    ]
+
+    print(f"{'caso':<20} {'filas':>8} {'original (s)':>13} {'actual (s)':>11} {'speedup':>8}")
+    for nombre, columnas, sep, coma in casos:
+        texto = generar_pegado(args.filas, columnas, sep, coma)
+
+        esperado = parse_paste_original(texto, columnas)
+        obtenido = parse_paste(texto, columnas)
+        pd.testing.assert_frame_equal(obtenido, esperado, check_dtype=False)
+
+        t_orig = medir(lambda: parse_paste_original(texto, columnas), args.repeticiones)
+        t_nuevo = medir(lambda: parse_paste(texto, columnas), args.repeticiones)
+        print(f"{nombre:<20} {args.filas:>8,} {t_orig:>13.4f} {t_nuevo:>11.4f} {t_orig / t_nuevo:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+"""
+Benchmark del pipeline de compras con REPOs sintéticos.
+
+Genera REPOs con el esquema de REPO_COLS (10k a 1M filas), pegados de
+disponible/backorder por proveedor, contratos (hasta 20 empresas por tipo, el
+máximo de la interfaz) y lista de precios Polifiltro, y mide cada etapa:
+lectura del REPO desde los bytes del .xlsx (`leer_repo`, el mismo camino en
+streaming que usa la app) y su compactación, parse_paste, alineación de proveedores, agregación de
+contratos, selección de casos, redondear_caja, un barrido de 100 escenarios,
+to_excel_bytes y la exportación en los demás formatos disponibles (CSV, TSV,
+CSV gzip, Parquet).
+
+Los resultados se escriben en JSON para comparar corridas entre sí.
+
+Uso:
+    python benchmarks/bench_pipeline.py [--filas 10000 100000] [--salida bench_pipeline.json]
+    python benchmarks/bench_pipeline.py --comparar bench_anterior.json
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+from io import BytesIO, StringIO
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import calculo  # noqa: E402
+from calculo import (COLUMNAS_ENTRADA, COLUMNAS_PROVEEDOR, REPO_COLS, REPO_NUMERIC_COLS,  # noqa: E402
+                     compactar_repo, leer_repo, parse_paste, redondear_caja)
+from escenarios import evaluar_escenarios, grilla  # noqa: E402
+from exportar import exportar_bytes, formatos_disponibles, to_excel_bytes  # noqa: E402
+
+
+# ─────────────────────────────────────────────
+# Generadores sintéticos
+# ─────────────────────────────────────────────
+def generar_repo(filas: int, rng) -> pd.DataFrame:
+    """REPO crudo como lo entrega read_excel(dtype=str): encabezados del sistema y todo texto.
+
+    Aproximadamente la mitad de las filas pasa los filtros de familia/subfamilia/
+    inactivo/grupo.
+    """
+    codigos = np.char.add('P', np.arange(filas).astype(str))
+    datos = {
+        'Familia': rng.choice(['Filtros', 'Filtros', 'Filtros', 'Lubricantes'], filas),
+        'Subfamilia': rng.choice(['Donaldson', 'Donaldson', 'Donaldson', 'Fleetguard'], filas),
+        'Grupo': rng.choice(['DNS - Linea', 'DNS - Linea', 'DNS - Inmovilizado', 'DNS - A demanda'], filas),
+        'Inactivo': rng.choice(['No', 'No', 'No', 'Si'], filas),
+        'Codigo': codigos,
+        'CodFabricante': np.char.add('D', np.arange(filas).astype(str)),
+        'Descripcion': rng.choice(['FILTRO AIRE', 'FILTRO ACEITE', 'FILTRO COMBUSTIBLE', 'FILTRO HIDRAULICO'], filas),
+        'Descripcion2': rng.choice(['PRIMARIO', 'SECUNDARIO', ''], filas),
+        'Clasificacion': rng.choice(['AA', 'AB', 'AC', 'BA', 'BB', 'BC', 'CA', 'CB', 'CC'], filas),
+        'Consolidado': rng.integers(0, 200, filas).astype(str),
+        'Q Fact 3': rng.integers(0, 300, filas).astype(str),
+        'Q Fact 6': rng.integers(0, 600, filas).astype(str),
+        'Q Fact 12': rng.integers(0, 1200, filas).astype(str),
+        'En SV en menos 30 dias': rng.integers(0, 50, filas).astype(str),
+        'En SV en mas 30 dias': rng.integers(0, 50, filas).astype(str),
+        'PC': np.char.replace(np.round(rng.uniform(2, 400, filas), 2).astype(str), '.', ','),
+        'Qty Piezas por Caja': rng.choice(['1', '1', '4', '6', '12', '24'], filas),
+    }
+    return pd.DataFrame(datos)
+
+
+COLUMNAS_NUMERICAS_EXCEL = ['Consolidado', 'Q Fact 3', 'Q Fact 6', 'Q Fact 12', 'En SV en menos 30 dias',
+                            'En SV en mas 30 dias', 'PC', 'Qty Piezas por Caja']
+
+
+def repo_a_excel(df_raw: pd.DataFrame) -> bytes:
+    """Bytes .xlsx del REPO crudo.
+
+    Las columnas numéricas van como números, como las exporta el sistema.
+    """
+    df = df_raw.copy()
+    for col in COLUMNAS_NUMERICAS_EXCEL:
+        df[col] = pd.to_numeric(df[col].str.replace(',', '.'))
+    return to_excel_bytes({'REPO': df})
+
+
+def generar_pegado(codigos, columnas: list, rng, fraccion=0.6, maximo=500) -> str:
+    """Texto TSV como el pegado desde Excel para un subconjunto de códigos."""
+    sel = rng.choice(codigos, int(len(codigos) * fraccion), replace=False)
+    df = pd.DataFrame({columnas[0]: sel})
+    for col in columnas[1:]:
+        df[col] = rng.integers(0, maximo, len(sel))
+    buf = StringIO()
+    df.to_csv(buf, sep='\t', index=False, header=False)
+    return buf.getvalue()
+
+
+def generar_precios(repo: pd.DataFrame, rng, fraccion=0.6) -> str:
+    """Lista de precios Polifiltro entre 15% más barata y 5% más cara que el pc."""
+    sel = repo.sample(frac=fraccion, random_state=int(rng.integers(1 << 31)))
+    precio = np.round(sel['pc'].to_numpy() * rng.uniform(0.85, 1.05, len(sel)), 2)
+    buf = StringIO()
+    pd.DataFrame({'codigo': sel['codigo'], 'precio': precio}).to_csv(buf, sep='\t', index=False, header=False)
+    return buf.getvalue()
+
+
+# ─────────────────────────────────────────────
+# Medición
+# ─────────────────────────────────────────────
+def medir(resultados, filas, etapa, fn):
+    t0 = time.perf_counter()
+    salida = fn()
+    segundos = time.perf_counter() - t0
+    resultados.append({'filas_repo': filas, 'etapa': etapa, 'segundos': round(segundos, 6)})
+    print(f"{filas:>10,}  {etapa:<26} {segundos:>9.3f} s")
+    return salida
+
+
+def correr(filas: int, empresas: int, max_filas_excel: int, seed: int) -> list:
+    rng = np.random.default_rng(seed)
+    resultados = []
+
+    libro = repo_a_excel(generar_repo(filas, rng))
+    repo, _, _, _ = medir(resultados, filas, 'leer_repo', lambda: leer_repo(BytesIO(libro)))
+    repo = medir(resultados, filas, 'compactar_repo', lambda: compactar_repo(repo))
+    codigos = repo['codigo'].to_numpy()
+
+    textos = {col: generar_pegado(codigos, COLUMNAS_ENTRADA[col], rng) for col in COLUMNAS_PROVEEDOR[:-1]}
+    textos['precio_polifiltro'] = generar_precios(repo, rng)
+    textos_cv = [generar_pegado(codigos, COLUMNAS_ENTRADA['contratos_vigentes'], rng, 0.05, 100)
+                 for _ in range(empresas)]
+    textos_ce = [generar_pegado(codigos, COLUMNAS_ENTRADA['contratos_excluir'], rng, 0.05, 100)
+                 for _ in range(empresas)]
+
+    def parsear():
+        entradas = {col: parse_paste(txt, COLUMNAS_ENTRADA[col]) for col, txt in textos.items()}
+        cv = [parse_paste(t, COLUMNAS_ENTRADA['contratos_vigentes']) for t in textos_cv]
+        ce = [parse_paste(t, COLUMNAS_ENTRADA['contratos_excluir']) for t in textos_ce]
+        return entradas, cv, ce
+    entradas, cv, ce = medir(resultados, filas, 'parse_paste', parsear)
+
+    # Etapas internas del pipeline (mismas funciones que usa PipelineCompras)
+    base = calculo._factorizar_base(repo)
+    prov = medir(resultados, filas, 'merges_proveedores', lambda: {
+        col: calculo._alinear_proveedor(base, entradas[col], col) for col in COLUMNAS_PROVEEDOR
+    })
+    contratos = medir(resultados, filas, 'contratos_groupby',
+                      lambda: calculo._agregar_contratos(base, cv, ce))
+    dms = calculo._demanda(base, contratos)
+    sv = calculo._stock_virtual(base, prov['reserv_mexico'], prov['bo_mexico'])
+    tramo = calculo._tramo_precio(base, prov['precio_polifiltro'])
+    cantidades = medir(resultados, filas, 'seleccion_casos', lambda: calculo._cantidades(
+        base, dms, contratos['demanda_mensual_contratos'], sv, tramo['tramo'],
+        prov['reserv_polifiltro'], prov['bo_polifiltro']
+    ))
+    caja = np.maximum(repo['qty_piezas_por_caja'].to_numpy(dtype=float), 1)
+    medir(resultados, filas, 'redondear_caja',
+          lambda: redondear_caja(cantidades['stock_objetivo'] - sv, caja))
+
+    df_res = medir(resultados, filas, 'pipeline_completo',
+                   lambda: calculo.calcular_compras(repo, contratos_vigentes=cv, contratos_excluir=ce, **entradas))
+    escenarios = grilla(umbral_poli_fuerte=[-12, -10, -8, -7, -6], umbral_poli_leve=[-6, -5.5, -5, -4.5, -4],
+                        meses_contratos=[3, 4], delta_meses_poli=[0, 1])
+    medir(resultados, filas, f'escenarios_{len(escenarios)}', lambda: evaluar_escenarios(df_res, escenarios))
+    if filas <= max_filas_excel:
+        df_mex, df_poli = calculo.ordenes_compra(df_res)
+        medir(resultados, filas, 'to_excel_bytes_oc',
+              lambda: to_excel_bytes({'OC México': df_mex, 'OC Polifiltro': df_poli}))
+        medir(resultados, filas, 'to_excel_bytes_completo',
+              lambda: to_excel_bytes({'Resultados': df_res}))
+    for formato in formatos_disponibles():
+        if formato != 'xlsx':
+            medir(resultados, filas, f'exportar_{formato}_completo',
+                  lambda: exportar_bytes({'Resultados': df_res}, 'resultados', formato))
+    return resultados
+
+
+def comparar(actual: list, previo_path: str):
+    previo = {(r['filas_repo'], r['etapa']): r['segundos']
+              for r in json.loads(Path(previo_path).read_text())['resultados']}
+    print(f"\nComparación con {previo_path}:")
+    for r in actual:
+        antes = previo.get((r['filas_repo'], r['etapa']))
+        if antes:
+            print(f"{r['filas_repo']:>10,}  {r['etapa']:<26} {antes:>9.3f} → {r['segundos']:>9.3f} s "
+                  f"({r['segundos'] / antes:>5.2f}x)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filas', type=int, nargs='+', default=[10_000, 100_000],
+                        help='Tamaños de REPO crudo a generar (default: 10000 100000)')
+    parser.add_argument('--empresas', type=int, default=20,
+                        help='Empresas con contrato vigente y a excluir (default: 20)')
+    parser.add_argument('--max-filas-excel', type=int, default=100_000,
+                        help='No mide to_excel_bytes por encima de este tamaño (default: 100000)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--salida', default='bench_pipeline.json', help='Archivo JSON de resultados')
+    parser.add_argument('--comparar', metavar='JSON', help='Resultados previos con los que comparar')
+    args = parser.parse_args(argv)
+
+    resultados = []
+    for filas in args.filas:
+        resultados.extend(correr(filas, args.empresas, args.max_filas_excel, args.seed))
+
+    Path(args.salida).write_text(json.dumps({
+        'fecha': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'plataforma': platform.platform(),
+        'columnas_repo': REPO_COLS,
+        'columnas_numericas': REPO_NUMERIC_COLS,
+        'resultados': resultados,
+    }, indent=1))
+    print(f"\nResultados escritos en {args.salida}")
+
+    if args.comparar:
+        comparar(resultados, args.comparar)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,1056 @@
+"""
+Motor de cálculo de compras Donaldson (sin Streamlit).
+Contiene la lectura y filtrado del REPO, el parseo de datos pegados y el cálculo
+de cantidades a comprar por proveedor (México / Polifiltro).
+
+Uso por línea de comandos:
+    python -m calculo --repo REPO.xlsx --reserv-mexico reserv_mex.tsv \\
+        --bo-mexico bo_mex.tsv --precio-polifiltro precios.tsv --salida salida/
+"""
+
+import argparse
+import contextlib
+import itertools
+import math
+import sys
+import unicodedata
+from io import BytesIO, StringIO
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from exportar import FORMATOS, formatos_disponibles, guardar_archivos
+
+
+# ─────────────────────────────────────────────
+# Esquema de entradas
+# ─────────────────────────────────────────────
+REPO_COLS = [
+    'familia', 'subfamilia', 'grupo', 'inactivo', 'codigo', 'codfabricante',
+    'descripcion', 'descripcion2', 'clasificacion', 'consolidado',
+    'q_fact_3', 'q_fact_6', 'q_fact_12',
+    'en_sv_en_menos_30_dias', 'en_sv_en_mas_30_dias',
+    'pc', 'qty_piezas_por_caja'
+]
+
+REPO_NUMERIC_COLS = [
+    'consolidado', 'q_fact_3', 'q_fact_6', 'q_fact_12',
+    'en_sv_en_menos_30_dias', 'en_sv_en_mas_30_dias', 'pc', 'qty_piezas_por_caja'
+]
+
+# Columnas de cada entrada pegada / en archivo (la primera siempre es 'codigo')
+COLUMNAS_ENTRADA = {
+    'reserv_mexico':      ['codigo', 'reserv_mexico'],
+    'bo_mexico':          ['codigo', 'bo_mexico'],
+    'reserv_polifiltro':  ['codigo', 'reserv_polifiltro'],
+    'bo_polifiltro':      ['codigo', 'bo_polifiltro'],
+    'precio_polifiltro':  ['codigo', 'precio_polifiltro'],
+    'contratos_vigentes': ['codigo', 'q_fact', 'q_contrato'],
+    'contratos_excluir':  ['codigo', 'q_3m', 'q_6m', 'q_12m'],
+}
+
+
+# ─────────────────────────────────────────────
+# Parámetros de compra
+# ─────────────────────────────────────────────
+# Tramos de precio (valores de donde_comprar) y umbrales de diferencia % Polifiltro vs México
+TRAMOS = ['MEX', 'POLI_FUERTE', 'POLI_LEVE']
+UMBRAL_POLI_FUERTE = -8.0
+UMBRAL_POLI_LEVE = -5.5
+
+# Calificaciones premium (mayor rotación / criticidad)
+CLASIFICACIONES_PREMIUM = ['AA', 'AB', 'AC', 'BA']
+
+# Meses de demanda con contrato que se suman al stock objetivo en todos los casos
+MESES_CONTRATOS = 4
+
+# Casos de compra: una fila por caso; agregar un caso es agregar una fila.
+#   premium    : True = solo calificaciones premium, False = el resto, None = ambas
+#   meses_dms  : stock objetivo = meses_dms × dms + MESES_CONTRATOS × dmc
+#   meses_mex / meses_poli : proporción México x Polifiltro del stock objetivo
+# Las filas sin caso en la tabla toman el primero.
+TABLA_CASOS = [
+    # caso  tramo          premium  meses_dms  meses_mex  meses_poli
+    ('A',  'MEX',         None,    6,         6,         0),
+    ('B1', 'POLI_FUERTE', True,    8,         5,         3),
+    ('B2', 'POLI_FUERTE', False,   7,         4,         3),
+    ('C1', 'POLI_LEVE',   True,    8,         6,         2),
+    ('C2', 'POLI_LEVE',   False,   7,         5,         2),
+]
+
+
+# ─────────────────────────────────────────────
+# Lectura de entradas
+# ─────────────────────────────────────────────
+# Filtros del REPO: (familia, subfamilia, inactivo) exactos y grupos excluidos
+FILTRO_FAMILIA = 'filtros'
+FILTRO_SUBFAMILIA = 'donaldson'
+FILTRO_INACTIVO = 'no'
+GRUPOS_EXCLUIDOS = ['dns - inmovilizado', 'dns - a demanda']
+
+# Incrementar al cambiar filtros o conversiones del REPO (invalida los snapshots guardados)
+VERSION_FILTRO = 1
+
+
+def _normalizar_columnas(columnas):
+    return pd.Index(columnas).astype(str).str.strip().str.lower().str.replace(' ', '_')
+
+
+def filtrar_repo(df_raw: pd.DataFrame):
+    """Normaliza columnas del REPO crudo, aplica filtros y convierte numéricos.
+
+    Retorna (df_filtrado, columnas_faltantes). Si faltan columnas, df_filtrado es None.
+    """
+    # Normalizar nombres de columna
+    df_raw.columns = _normalizar_columnas(df_raw.columns)
+
+    missing = [c for c in REPO_COLS if c not in df_raw.columns]
+    if missing:
+        return None, missing
+
+    df = df_raw[REPO_COLS].copy()
+
+    # Filtros
+    mask = (
+        (df['familia'].str.strip().str.lower() == FILTRO_FAMILIA) &
+        (df['subfamilia'].str.strip().str.lower() == FILTRO_SUBFAMILIA) &
+        (df['inactivo'].str.strip().str.lower() == FILTRO_INACTIVO) &
+        (~df['grupo'].str.strip().str.lower().isin(GRUPOS_EXCLUIDOS))
+    )
+    df_filtrado = df[mask].copy()
+
+    # Convertir numéricos
+    for col in REPO_NUMERIC_COLS:
+        df_filtrado[col] = pd.to_numeric(
+            df_filtrado[col].str.replace(',', '.'), errors='coerce'
+        ).fillna(0)
+
+    df_filtrado['codigo'] = df_filtrado['codigo'].astype(str).str.strip()
+    return df_filtrado, []
+
+
+def _celda_a_texto(v):
+    """Convierte una celda de openpyxl al texto que produce read_excel(dtype=str)."""
+    if v is None:
+        return None
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    return str(v)
+
+
+def _celda_a_numero(v):
+    """Equivalente por celda de to_numeric(str.replace(',', '.'), errors='coerce')."""
+    if v is None or isinstance(v, bool):
+        return np.nan
+    if isinstance(v, (int, float)):
+        return float(v)
+    try:
+        return float(str(v).replace(',', '.'))
+    except ValueError:
+        return np.nan
+
+
+def _es_xlsx(fuente) -> bool:
+    """True si la fuente (ruta o buffer) es un zip OOXML (.xlsx) y no un .xls binario."""
+    if hasattr(fuente, 'read'):
+        pos = fuente.tell()
+        firma = fuente.read(2)
+        fuente.seek(pos)
+    else:
+        with open(fuente, 'rb') as f:
+            firma = f.read(2)
+    return firma == b'PK'
+
+
+def _filtrar_filas_repo(filas):
+    """Filtra el REPO a partir de un iterador de filas de openpyxl (la primera es el encabezado).
+
+    Resuelve una vez la posición de cada columna de REPO_COLS en el encabezado,
+    descarta las filas que no pasan los filtros a medida que se leen y solo
+    acumula valores de las filas que sobreviven.
+    Retorna (df_filtrado, n_total, columnas_faltantes, columnas_disponibles).
+    """
+    encabezado = next(filas, None) or ()
+    columnas = list(_normalizar_columnas(
+        [f'Unnamed: {i}' if h is None else h for i, h in enumerate(encabezado)]
+    ))
+    posicion = {}
+    for i, c in enumerate(columnas):
+        posicion.setdefault(c, i)
+
+    missing = [c for c in REPO_COLS if c not in posicion]
+    if missing:
+        return None, sum(1 for _ in filas), missing, columnas
+
+    i_fam, i_sub, i_ina, i_gru = (posicion[c] for c in ('familia', 'subfamilia', 'inactivo', 'grupo'))
+    ancho = max(posicion[c] for c in REPO_COLS) + 1
+    texto_cols = [c for c in REPO_COLS if c not in REPO_NUMERIC_COLS]
+    texto = [(posicion[c], []) for c in texto_cols]
+    numeros = [(posicion[c], []) for c in REPO_NUMERIC_COLS]
+
+    def _norm(v):
+        return None if v is None else str(v).strip().lower()
+
+    n_total = 0
+    for fila in filas:
+        n_total += 1
+        if len(fila) < ancho:
+            fila = tuple(fila) + (None,) * (ancho - len(fila))
+        if (_norm(fila[i_fam]) != FILTRO_FAMILIA or
+                _norm(fila[i_sub]) != FILTRO_SUBFAMILIA or
+                _norm(fila[i_ina]) != FILTRO_INACTIVO or
+                _norm(fila[i_gru]) in GRUPOS_EXCLUIDOS):
+            continue
+        for i, valores in texto:
+            valores.append(_celda_a_texto(fila[i]))
+        for i, valores in numeros:
+            valores.append(_celda_a_numero(fila[i]))
+
+    datos = {c: np.array(v, dtype=object) for c, (_, v) in zip(texto_cols, texto)}
+    datos.update({c: np.array(v, dtype=float) for c, (_, v) in zip(REPO_NUMERIC_COLS, numeros)})
+    df_filtrado = pd.DataFrame(datos, columns=REPO_COLS)
+    df_filtrado[REPO_NUMERIC_COLS] = df_filtrado[REPO_NUMERIC_COLS].fillna(0)
+    df_filtrado['codigo'] = df_filtrado['codigo'].astype(str).str.strip()
+    return df_filtrado, n_total, [], columnas
+
+
+def leer_repo_streaming(fuente):
+    """Lee y filtra el REPO .xlsx en streaming con openpyxl en modo solo lectura.
+
+    La memoria pico depende de las filas filtradas y no del tamaño de la hoja
+    (ver `_filtrar_filas_repo`).
+    Retorna (df_filtrado, n_total, columnas_faltantes, columnas_disponibles).
+    """
+    import openpyxl
+
+    wb = openpyxl.load_workbook(fuente, read_only=True, data_only=True)
+    try:
+        return _filtrar_filas_repo(wb.worksheets[0].iter_rows(values_only=True))
+    finally:
+        wb.close()
+
+
+def leer_repo(fuente):
+    """Lee el Excel REPO (ruta o buffer) y lo filtra.
+
+    Los .xlsx se leen en streaming (`leer_repo_streaming`); los .xls binarios,
+    que openpyxl no soporta, pasan por pandas.
+    Retorna (df_filtrado, n_total, columnas_faltantes, columnas_disponibles).
+    """
+    if _es_xlsx(fuente):
+        return leer_repo_streaming(fuente)
+    df_raw = pd.read_excel(fuente, dtype=str)
+    df_filtrado, missing = filtrar_repo(df_raw)
+    return df_filtrado, len(df_raw), missing, list(df_raw.columns)
+
+
+# Columnas de texto que siempre se guardan como categóricas (pocos valores distintos)
+COLUMNAS_CATEGORICAS = ['familia', 'subfamilia', 'grupo', 'inactivo', 'clasificacion']
+
+
+def compactar_repo(df: pd.DataFrame, max_ratio_categorias=0.5) -> pd.DataFrame:
+    """Representación compacta del REPO filtrado para mantener en sesión.
+
+    - `codigo` pasa a categórico: una tabla de códigos única más códigos enteros.
+    - COLUMNAS_CATEGORICAS y el resto de las de texto con pocos valores distintos
+      (hasta `max_ratio_categorias` de las filas) pasan a categóricas.
+    - Las numéricas con valores enteros que entran en int32 se convierten a int32;
+      las demás quedan en float64 para no alterar los cálculos.
+    """
+    out = {}
+    n = len(df)
+    for col in df.columns:
+        s = df[col]
+        if isinstance(s.dtype, pd.CategoricalDtype):
+            out[col] = s
+        elif pd.api.types.is_numeric_dtype(s.dtype):
+            valores = s.to_numpy()
+            if (n and np.isfinite(valores).all() and (valores == np.round(valores)).all()
+                    and np.abs(valores).max() < 2**31):
+                out[col] = s.astype(np.int32)
+            else:
+                out[col] = s
+        elif col == 'codigo' or col in COLUMNAS_CATEGORICAS or s.nunique() <= max_ratio_categorias * n:
+            out[col] = s.astype('category')
+        else:
+            out[col] = s
+    return pd.DataFrame(out, index=df.index)
+
+
+def reporte_memoria(antes: pd.DataFrame, despues: pd.DataFrame) -> pd.DataFrame:
+    """Bytes por columna (memory_usage profundo) antes y después de compactar."""
+    rep = pd.DataFrame({
+        'dtype_antes': antes.dtypes.astype(str),
+        'bytes_antes': antes.memory_usage(deep=True, index=False),
+        'dtype': despues.dtypes.astype(str),
+        'bytes': despues.memory_usage(deep=True, index=False),
+    })
+    rep.loc['TOTAL'] = ['', rep['bytes_antes'].sum(), '', rep['bytes'].sum()]
+    return rep
+
+
+SEPARADORES = ['\t', ';', ',']
+
+# Nombres alternativos aceptados en el encabezado de las tablas pegadas/subidas
+# (se comparan normalizados: minúsculas, sin acentos, '_' en lugar de espacios)
+ALIAS_COLUMNAS = {
+    'codigo': {'cod', 'code', 'sku', 'articulo', 'codigo_articulo'},
+    'reserv_mexico': {'reserv', 'reserva', 'disponible', 'reserva_mexico', 'disponible_mexico'},
+    'bo_mexico': {'bo', 'backorder', 'back_order', 'backorder_mexico'},
+    'reserv_polifiltro': {'reserv', 'reserva', 'disponible', 'reserva_polifiltro', 'disponible_polifiltro',
+                          'reserv_poli'},
+    'bo_polifiltro': {'bo', 'backorder', 'back_order', 'backorder_polifiltro', 'bo_poli'},
+    'precio_polifiltro': {'precio', 'precio_poli', 'precio_unitario'},
+    'q_fact': {'facturado', 'cantidad_facturada'},
+    'q_contrato': {'contrato', 'cantidad_contrato'},
+    'q_3m': {'3m', 'q3m'},
+    'q_6m': {'6m', 'q6m'},
+    'q_12m': {'12m', 'q12m'},
+}
+
+
+def _es_numero(texto: str) -> bool:
+    try:
+        float(texto.strip().replace(',', '.'))
+        return True
+    except ValueError:
+        return False
+
+
+def _normalizar_encabezado(texto: str) -> str:
+    """'  Código Artículo ' → 'codigo_articulo'."""
+    sin_acentos = unicodedata.normalize('NFKD', texto).encode('ascii', 'ignore').decode()
+    return '_'.join(''.join(c if c.isalnum() else ' ' for c in sin_acentos.lower()).split())
+
+
+def _es_encabezado(campos: list, columns: list) -> bool:
+    """True si la línea `campos` es un encabezado de `columns`.
+
+    Lo es si cada campo es el nombre de su columna o uno de sus ALIAS_COLUMNAS, o
+    si el primero nombra la columna de código ('Código', 'SKU', ...): ese texto no
+    es un código de producto, así que nunca se descarta una fila con un código.
+    """
+    nombres = [_normalizar_encabezado(c) for c in campos]
+    coincide = [n == col or n in ALIAS_COLUMNAS.get(col, ()) for n, col in zip(nombres, columns)]
+    return coincide[0] or all(coincide)
+
+
+def parse_paste(text: str, columns: list, sep='\t') -> pd.DataFrame | None:
+    """Parsea texto pegado (TSV/CSV) y retorna DataFrame con columnas dadas.
+
+    El separador es el primero de `sep` y SEPARADORES (tab, ';' como en el CSV de
+    Excel en español, ',') que parte la primera línea en tantos campos como
+    `columns`; si ninguno lo hace se lanza ValueError. La primera línea se toma
+    como encabezado solo si nombra las columnas (ver `_es_encabezado`; sin
+    distinguir mayúsculas ni acentos); si no, es una fila de datos.
+    Lee directamente del texto original (sin partir ni volver a unir líneas) y
+    convierte los numéricos durante el parseo, con coma decimal si el texto la
+    usa. Solo las columnas que el parser no pudo convertir pasan por `to_numeric`,
+    quitando los puntos de miles antes de una coma ('1.234,50') y cambiando ',' por '.'.
+    Retorna None si el texto está vacío; los errores de parseo se propagan.
+    """
+    text = text.strip()
+    if not text:
+        return None
+    # Detectar separador y header mirando solo la primera línea
+    fin = text.find('\n')
+    first_line = (text if fin < 0 else text[:fin]).rstrip('\r')
+    for sep in dict.fromkeys([sep] + SEPARADORES):
+        first = first_line.split(sep)
+        if len(first) == len(columns):
+            break
+    else:
+        raise ValueError(f"Se esperaban {len(columns)} columnas ({', '.join(columns)}) separadas por "
+                         f"tabulador, ';' o ',', y la primera línea tiene otro formato: {first_line[:80]!r}")
+    tiene_header = _es_encabezado(first, columns)
+    decimal = ',' if sep != ',' and ',' in text else '.'
+
+    df = pd.read_csv(
+        StringIO(text), sep=sep, header=None, names=columns,
+        skiprows=1 if tiene_header else 0, dtype={columns[0]: str},
+        decimal=decimal, skip_blank_lines=True,
+    )
+    if df.empty:
+        return df
+
+    # Filas de solo espacios: sin código ni valores
+    vacias = df[columns[0]].isna() | (df[columns[0]].str.strip() == '')
+    if vacias.any():
+        vacias &= df[columns[1:]].isna().all(axis=1)
+        if vacias.any():
+            df = df[~vacias].reset_index(drop=True)
+
+    # Convertir tipos (solo las columnas que no quedaron numéricas al parsear)
+    for col in columns[1:]:
+        if not pd.api.types.is_numeric_dtype(df[col].dtype):
+            texto = df[col].astype(str).str.replace(r'\.(?=.*,)', '', regex=True).str.replace(',', '.')
+            df[col] = pd.to_numeric(texto, errors='coerce')
+        df[col] = df[col].fillna(0)
+    df[columns[0]] = df[columns[0]].astype(str).str.strip()
+    return df
+
+
+def _es_excel(datos: bytes) -> bool:
+    """True si el contenido es un .xlsx (zip) o un .xls (OLE2)."""
+    return datos[:2] == b'PK' or datos[:8] == b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+
+
+def hoja_a_tabla(hoja: pd.DataFrame, columns: list) -> pd.DataFrame | None:
+    """Convierte una hoja leída con `read_excel(header=None, dtype=str)` a la tabla de `columns`.
+
+    Se toman las primeras len(columns) columnas y se pasan por `parse_paste` como
+    TSV, así el encabezado opcional y los números se tratan igual que al pegar.
+    """
+    hoja = hoja.dropna(how='all').dropna(axis=1, how='all')
+    if hoja.empty:
+        return None
+    if hoja.shape[1] < len(columns):
+        raise ValueError(f"Se esperaban {len(columns)} columnas ({', '.join(columns)}) "
+                         f"y la hoja tiene {hoja.shape[1]}")
+    texto = hoja.iloc[:, :len(columns)].to_csv(sep='\t', header=False, index=False)
+    return parse_paste(texto, columns)
+
+
+def leer_tabla_bytes(datos: bytes, columns: list) -> pd.DataFrame | None:
+    """Lee una tabla CSV/TSV o Excel (primera hoja) ya cargada en memoria.
+
+    El formato se detecta por el contenido, no por la extensión.
+    """
+    if _es_excel(datos):
+        return hoja_a_tabla(pd.read_excel(BytesIO(datos), header=None, dtype=str), columns)
+    try:
+        texto = datos.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        texto = datos.decode('latin-1')
+    return parse_paste(texto, columns)
+
+
+def leer_tabla(ruta, columns: list) -> pd.DataFrame | None:
+    """Lee un archivo CSV/TSV/Excel con el mismo formato que los datos pegados."""
+    return leer_tabla_bytes(Path(ruta).read_bytes(), columns)
+
+
+def leer_contratos(rutas, tipo: str) -> list:
+    """Lee una lista de archivos de contratos de `tipo` ('contratos_vigentes' o
+    'contratos_excluir'), uno por empresa; la empresa es el nombre del archivo."""
+    contratos = []
+    for ruta in rutas or []:
+        df_c = leer_tabla(ruta, COLUMNAS_ENTRADA[tipo])
+        if df_c is not None:
+            df_c['empresa'] = Path(ruta).stem
+            contratos.append(df_c)
+    return contratos
+
+
+# Libro con todas las entradas: nombre de hoja (normalizado como las columnas) → clave de entrada.
+# Los contratos van en una hoja por empresa: 'cv_<empresa>' (vigentes) y 'ce_<empresa>' (a excluir).
+HOJAS_LIBRO = ['repo', 'reserv_mexico', 'bo_mexico', 'reserv_polifiltro', 'bo_polifiltro', 'precio_polifiltro']
+PREFIJOS_CONTRATOS = {'cv_': 'contratos_vigentes', 'ce_': 'contratos_excluir'}
+
+
+def leer_libro_entradas(fuente):
+    """Lee todas las entradas de un libro .xlsx con una hoja por entrada, abriéndolo una vez.
+
+    Las hojas se asignan por nombre (HOJAS_LIBRO y PREFIJOS_CONTRATOS); el REPO se
+    filtra en streaming como en `leer_repo` y las demás hojas se parsean como los
+    datos pegados, con los códigos repetidos agregados según POLITICA_DUPLICADOS.
+    Retorna (entradas, info): `entradas` tiene las claves encontradas ('repo', las
+    de COLUMNAS_PROVEEDOR y listas 'contratos_vigentes'/'contratos_excluir');
+    `info` tiene 'repo_total', 'repo_faltantes', 'columnas_repo', 'duplicados'
+    {clave: n} y 'hojas_ignoradas'.
+    """
+    import openpyxl
+
+    if not _es_xlsx(fuente):
+        raise ValueError("El libro de entradas debe ser .xlsx")
+    entradas = {'contratos_vigentes': [], 'contratos_excluir': []}
+    info = {'repo_total': 0, 'repo_faltantes': [], 'columnas_repo': [], 'duplicados': {}, 'hojas_ignoradas': []}
+
+    wb = openpyxl.load_workbook(fuente, read_only=True, data_only=True)
+    try:
+        for ws in wb.worksheets:
+            clave = _normalizar_columnas([ws.title])[0]
+            filas = ws.iter_rows(values_only=True)
+            if clave == 'repo':
+                repo, n_total, missing, columnas = _filtrar_filas_repo(filas)
+                info.update(repo_total=n_total, repo_faltantes=missing, columnas_repo=columnas)
+                if repo is not None:
+                    entradas['repo'] = repo
+                continue
+
+            prefijo = clave[:3]
+            tipo = clave if clave in HOJAS_LIBRO else PREFIJOS_CONTRATOS.get(prefijo)
+            if tipo is None:
+                info['hojas_ignoradas'].append(ws.title)
+                continue
+            hoja = pd.DataFrame([[_celda_a_texto(v) for v in fila] for fila in filas])
+            df = hoja_a_tabla(hoja, COLUMNAS_ENTRADA[tipo])
+            if df is None:
+                continue
+            if tipo in PREFIJOS_CONTRATOS.values():
+                df['empresa'] = ws.title[3:].strip() or ws.title
+                entradas[tipo].append(df)
+            else:
+                entradas[tipo], info['duplicados'][tipo] = agregar_duplicados(df, POLITICA_DUPLICADOS[tipo])
+    finally:
+        wb.close()
+    return entradas, info
+
+
+# ─────────────────────────────────────────────
+# Cálculo
+# ─────────────────────────────────────────────
+COLUMNAS_PROVEEDOR = ['reserv_mexico', 'bo_mexico', 'reserv_polifiltro', 'bo_polifiltro', 'precio_polifiltro']
+
+
+# Cómo se agregan los códigos repetidos de cada entrada antes de unirla al REPO
+POLITICA_DUPLICADOS = {
+    'reserv_mexico':     'sum',
+    'bo_mexico':         'sum',
+    'reserv_polifiltro': 'sum',
+    'bo_polifiltro':     'sum',
+    'precio_polifiltro': 'last',
+}
+
+NOMBRE_POLITICA = {'sum': 'suma', 'last': 'último valor', 'first': 'primer valor', 'min': 'mínimo', 'max': 'máximo'}
+
+
+def agregar_duplicados(df, politica='sum'):
+    """Colapsa los códigos repetidos de una entrada según `politica`.
+
+    `politica` es 'sum', 'min', 'max', 'first' o 'last'. Garantiza un registro
+    por código, de modo que la unión con el REPO sea uno a uno.
+    Retorna (df, n_codigos_repetidos).
+    """
+    if df is None:
+        return None, 0
+    repetidos = df['codigo'].duplicated(keep=False)
+    if not repetidos.any():
+        return df, 0
+    n_repetidos = int(df.loc[repetidos, 'codigo'].nunique())
+    if politica in ('first', 'last'):
+        out = df.drop_duplicates('codigo', keep=politica)
+    else:
+        out = df.groupby('codigo', sort=False, as_index=False)[list(df.columns[1:])].agg(politica)
+    return out.reset_index(drop=True), n_repetidos
+
+
+def _alinear(codes, uniques, claves, valores) -> np.ndarray:
+    """Ubica `valores` (indexados por `claves` únicas) en el orden de las filas del REPO.
+
+    `codes`/`uniques` son la factorización del código del REPO; los códigos sin
+    valor quedan en 0. Con `valores` 2-D alinea todas sus columnas a la vez.
+    """
+    # Se busca cada clave en la tabla de códigos (cuyo índice hash queda cacheado
+    # en `uniques` entre llamadas) y se reparte a las filas con un gather.
+    indice = uniques if isinstance(uniques, pd.Index) else pd.Index(uniques)
+    pos = indice.get_indexer(claves)
+    hay = pos >= 0
+    valores = np.nan_to_num(np.asarray(valores, dtype=float))
+    por_codigo = np.zeros((len(indice),) + valores.shape[1:])
+    por_codigo[pos[hay]] = valores[hay]
+    return por_codigo[codes]
+
+
+def _factorizar_base(repo) -> dict:
+    """Paso 1: REPO con índice posicional, `codigo` factorizado una sola vez y
+    marca de clasificación premium."""
+    base = repo.reset_index(drop=True)
+    if isinstance(base['codigo'].dtype, pd.CategoricalDtype):
+        # REPO compactado: la tabla de códigos ya está factorizada
+        codes, uniques = base['codigo'].cat.codes.to_numpy(), base['codigo'].cat.categories
+    else:
+        codes, uniques = pd.factorize(base['codigo'])
+    premium = base['clasificacion'].str.upper().isin(CLASIFICACIONES_PREMIUM).to_numpy()
+    return {'base': base, 'codes': codes, 'uniques': uniques, 'premium': premium}
+
+
+def _alinear_proveedor(base: dict, df_p, col) -> np.ndarray:
+    """Paso 2: vector de una entrada de proveedor/precio alineado con el REPO."""
+    df_p, _ = agregar_duplicados(df_p, POLITICA_DUPLICADOS[col])
+    if df_p is None:
+        return np.zeros(len(base['codes']))
+    return _alinear(base['codes'], base['uniques'], df_p['codigo'], df_p.iloc[:, 1])
+
+
+COLUMNAS_CONTRATOS = {
+    'contratos_vigentes': ['suma_min_contratos', 'demanda_mensual_contratos'],
+    'contratos_excluir': ['q_3m', 'q_6m', 'q_12m'],
+}
+
+
+def _reducir_contrato(base: dict, df: pd.DataFrame, tipo: str) -> dict:
+    """Aporte de un contrato (una empresa) a COLUMNAS_CONTRATOS[tipo], alineado con el REPO.
+
+    Un solo groupby por código reduce todas las columnas del tipo. Para los
+    vigentes se calculan dos agregados:
+      a) suma_min_contratos: min(q_fact, q_contrato) → se usa para restar de la
+         demanda histórica al calcular demanda sin contratos, representando lo
+         que efectivamente se facturó dentro del marco del contrato.
+      b) demanda_mensual_contratos: q_contrato → demanda comprometida
+         contractualmente, independiente de lo que se haya facturado.
+    """
+    if tipo == 'contratos_vigentes':
+        valores = pd.DataFrame({
+            'suma_min_contratos': df[['q_fact', 'q_contrato']].min(axis=1),
+            'demanda_mensual_contratos': df['q_contrato'],
+        })
+    else:
+        valores = df[COLUMNAS_CONTRATOS[tipo]]
+    agregado = valores.groupby(df['codigo'].to_numpy(), sort=False).sum()
+    alineado = _alinear(base['codes'], base['uniques'], agregado.index, agregado.to_numpy())
+    return {c: alineado[:, j] for j, c in enumerate(agregado.columns)}
+
+
+def _sumar_aportes(n: int, aportes_cv: list, aportes_ce: list) -> dict:
+    """Paso 3: suma los aportes por empresa de `_reducir_contrato`."""
+    nuevas = {}
+    for tipo, aportes in (('contratos_vigentes', aportes_cv), ('contratos_excluir', aportes_ce)):
+        for c in COLUMNAS_CONTRATOS[tipo]:
+            total = np.zeros(n)
+            for aporte in aportes:
+                total += aporte[c]
+            nuevas[c] = total
+    return nuevas
+
+
+def _agregar_contratos(base: dict, contratos_vigentes, contratos_excluir) -> dict:
+    """Paso 3: agregados de contratos vigentes y a excluir alineados con el REPO."""
+    aportes = {
+        tipo: [_reducir_contrato(base, c, tipo) for c in contratos if c is not None]
+        for tipo, contratos in (('contratos_vigentes', contratos_vigentes), ('contratos_excluir', contratos_excluir))
+    }
+    return _sumar_aportes(len(base['codes']), aportes['contratos_vigentes'], aportes['contratos_excluir'])
+
+
+def ensamblar_base(repo, proveedores: dict, contratos_vigentes=(), contratos_excluir=()) -> pd.DataFrame:
+    """Pasos 1-3: une al REPO los datos de proveedores, precio y contratos.
+
+    Factoriza `codigo` una sola vez y alinea cada vector por posición, en lugar
+    de un merge (y una copia completa del DataFrame) por entrada. Las columnas
+    nuevas se agregan al final en el orden de los merges originales. Los códigos
+    repetidos de cada entrada se agregan según POLITICA_DUPLICADOS, así el
+    resultado tiene siempre una fila por fila del REPO.
+    """
+    base = _factorizar_base(repo)
+    nuevas = {col: _alinear_proveedor(base, proveedores.get(col), col) for col in COLUMNAS_PROVEEDOR}
+    nuevas.update(_agregar_contratos(base, contratos_vigentes, contratos_excluir))
+    return pd.concat([base['base'], pd.DataFrame(nuevas, index=base['base'].index)], axis=1)
+
+
+def _num(base: dict, col) -> np.ndarray:
+    return base['base'][col].to_numpy(dtype=float)
+
+
+def _demanda(base: dict, contratos: dict) -> np.ndarray:
+    """Paso 4: demanda mensual sin contratos."""
+    # Promedio mensual de facturación neta (descontando lo facturado bajo contrato),
+    # luego se resta la demanda_mensual_contratos para aislar la demanda libre de contratos.
+    # Se usa suma_min_contratos (no q_contrato) para la depuración histórica, ya que
+    # representa lo que realmente se facturó dentro del marco del contrato.
+    prom_3  = (_num(base, 'q_fact_3')  - contratos['q_3m'])  / 3
+    prom_6  = (_num(base, 'q_fact_6')  - contratos['q_6m'])  / 6
+    prom_12 = (_num(base, 'q_fact_12') - contratos['q_12m']) / 12
+
+    # Promedio de los tres horizontes menos el mínimo facturado bajo contratos vigentes
+    return np.maximum(((prom_3 + prom_6 + prom_12) / 3) - contratos['suma_min_contratos'], 0)
+
+
+def _stock_virtual(base: dict, reserv_mexico, bo_mexico) -> np.ndarray:
+    """Paso 5: stock virtual (consolidado + en SV + disponible y BO de México)."""
+    return (
+        _num(base, 'consolidado') +
+        _num(base, 'en_sv_en_menos_30_dias') +
+        _num(base, 'en_sv_en_mas_30_dias') +
+        reserv_mexico +
+        bo_mexico
+    )
+
+
+def _tramo_precio(base: dict, precio_polifiltro) -> dict:
+    """Paso 6: diferencia de precio Polifiltro vs México y tramo de compra.
+
+    `tramo` es la posición en TRAMOS; `donde_comprar` su etiqueta.
+    """
+    # Valor negativo = Polifiltro más barato. Ej: -10 significa 10% más barato.
+    pc = _num(base, 'pc')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        diff = np.where(pc > 0, (precio_polifiltro - pc) / pc * 100, np.nan)
+
+    # Clasificación del tramo de precio para decidir dónde y cuánto comprar:
+    #   'POLI_FUERTE' : Polifiltro >= 8% más barato  → proporciones máximas en Poli
+    #   'POLI_LEVE'   : Polifiltro entre 5.5% y 8% más barato → proporciones intermedias
+    #   'MEX'         : diferencia < 5.5%  → todo México
+    tiene_precio_poli = precio_polifiltro > 0
+    tramo = np.where(
+        tiene_precio_poli & (diff <= UMBRAL_POLI_FUERTE),   TRAMOS.index('POLI_FUERTE'),
+        np.where(
+        tiene_precio_poli & (diff <= UMBRAL_POLI_LEVE),     TRAMOS.index('POLI_LEVE'),
+                                                            TRAMOS.index('MEX')
+    ))
+    return {
+        'diferencia_precio_pct': diff,
+        'donde_comprar': np.asarray(TRAMOS, dtype=object)[tramo],
+        'tramo': tramo,
+    }
+
+
+def _parametros_casos(tabla=None) -> dict:
+    """Arrays por caso de TABLA_CASOS y matriz [tramo, premium] → caso.
+
+    La fracción de México se reduce (ej. 6/8 → 3/4; 6/6 → 1/1) para que el cálculo
+    dé exactamente el mismo redondeo que las fórmulas escritas a mano.
+    """
+    tabla = TABLA_CASOS if tabla is None else tabla
+    caso_por_tramo = np.zeros((len(TRAMOS), 2), dtype=np.intp)   # sin caso → el primero
+    for i, (_, tramo, premium, _, _, _) in enumerate(tabla):
+        t = TRAMOS.index(tramo)
+        for p in ((False, True) if premium is None else (premium,)):
+            caso_por_tramo[t, int(p)] = i
+    num, den = [], []
+    for _, _, _, _, meses_mex, meses_poli in tabla:
+        g = math.gcd(meses_mex, meses_mex + meses_poli)
+        num.append(meses_mex // g)
+        den.append((meses_mex + meses_poli) // g)
+    return {
+        'caso_por_tramo': caso_por_tramo,
+        'caso': np.array([f[0] for f in tabla], dtype=object),
+        'proporcion': np.array([f'{f[4]}x{f[5]}' for f in tabla], dtype=object),
+        'meses_dms': np.array([f[3] for f in tabla], dtype=float),
+        'mex_num': np.array(num, dtype=float),
+        'mex_den': np.array(den, dtype=float),
+        'compra_poli': np.array([f[5] > 0 for f in tabla]),
+    }
+
+
+def _cantidades(base: dict, dms, dmc, sv, tramo, rp, bop, tabla=None) -> dict:
+    """Pasos 7-9: stock objetivo, caso, proporción y cantidades redondeadas a caja.
+
+    Cada fila toma su caso de TABLA_CASOS con un solo gather; las cantidades se
+    calculan en una pasada sobre los parámetros del caso, sin evaluar las
+    fórmulas de todos los casos para todas las filas.
+    """
+    p = _parametros_casos(tabla)
+    idx = p['caso_por_tramo'][tramo, base['premium'].astype(np.intp)]
+
+    # ── 7. Stock objetivo: meses_dms × dms + MESES_CONTRATOS × dmc ──
+    so = p['meses_dms'][idx] * dms
+    so += MESES_CONTRATOS * dmc
+
+    # ── 8. Cantidades a comprar ──
+    # México cubre la fracción meses_mex / (meses_mex + meses_poli) del stock objetivo
+    qty_mexico = p['mex_num'][idx] * so
+    qty_mexico /= p['mex_den'][idx]
+    qty_mexico -= sv
+    np.maximum(qty_mexico, 0, out=qty_mexico)
+
+    # Polifiltro completa el resto, descontando su disponible y backorder
+    qty_polifiltro = so - sv
+    qty_polifiltro -= qty_mexico
+    qty_polifiltro -= rp
+    qty_polifiltro -= bop
+    np.maximum(qty_polifiltro, 0, out=qty_polifiltro)
+    qty_polifiltro[~p['compra_poli'][idx]] = 0
+
+    # ── 9. Redondeo al tamaño de caja (ceiling al múltiplo de qty_piezas_por_caja) ──
+    # Si qty_piezas_por_caja <= 0 o es NaN, se trata como caja de 1 (sin efecto).
+    # Fórmula: ceil(qty / caja) * caja  →  garantiza comprar cajas completas.
+    caja = _num(base, 'qty_piezas_por_caja')
+    caja = np.maximum(np.where(np.isnan(caja), 1, caja), 1)
+
+    return {
+        'stock_objetivo': so,
+        'caso': p['caso'][idx],
+        'proporcion': p['proporcion'][idx],
+        'qty_comprar_mexico': redondear_caja(qty_mexico, caja),
+        'qty_comprar_polifiltro': redondear_caja(qty_polifiltro, caja),
+    }
+
+
+def redondear_caja(qty_serie, caja_serie):
+    """Redondea cada cantidad hacia arriba al múltiplo de caja más cercano.
+    Si la cantidad es 0, devuelve 0 (no se genera pedido)."""
+    qty = np.maximum(np.asarray(qty_serie, dtype=float), 0)
+    caja = np.asarray(caja_serie, dtype=float)
+    redondeado = np.where(
+        qty > 0,
+        np.ceil(qty / caja) * caja,
+        0
+    )
+    return redondeado.astype(int)
+
+
+class PipelineCompras:
+    """Cálculo de compras por etapas con cache de cada etapa.
+
+    Cada etapa guarda su resultado junto con la identidad de sus dependencias
+    (DataFrames de entrada u otras etapas). Al volver a calcular solo se rehacen
+    las etapas cuyas dependencias cambiaron y las que dependen de ellas: cambiar
+    la lista de precios de Polifiltro no vuelve a alinear proveedores ni contratos.
+    Las entradas se identifican por objeto, por lo que deben reemplazarse (no
+    modificarse en el lugar) cuando cambian.
+
+    Los contratos además se reducen por empresa: al agregar o editar una empresa
+    solo se vuelve a reducir su aporte y se suman los aportes guardados del resto.
+
+    `recalculadas` lista las etapas rehechas en el último `calcular`.
+    """
+
+    # Paso del cálculo (numeración de los comentarios) de cada etapa, para diagnóstico
+    PASOS = {
+        'base': '1', 'reserv_mexico': '2', 'bo_mexico': '2', 'reserv_polifiltro': '2',
+        'bo_polifiltro': '2', 'precio_polifiltro': '2', 'contratos': '3', 'demanda': '4',
+        'stock_virtual': '5', 'precio': '6', 'cantidades': '7-9', 'ensamblado': '-',
+    }
+
+    def __init__(self):
+        self._cache = {}
+        self._aportes_contratos = {}
+        self._versiones = itertools.count(1)
+        self._medidor = None
+        self._filas = None
+        self.recalculadas = []
+
+    def _etapa(self, nombre, deps: tuple, fn):
+        """Retorna (resultado, token) de la etapa; la recalcula si cambió alguna dependencia.
+
+        `deps` son objetos (entradas) o tokens de otras etapas; el cache guarda
+        referencias a las entradas para que su id no se reutilice mientras vive.
+        """
+        clave = tuple(id(d) if isinstance(d, (pd.DataFrame, list)) else d for d in deps)
+        previo = self._cache.get(nombre)
+        if previo is not None and previo[0] == clave:
+            if self._medidor is not None:
+                self._medidor.registrar({'etapa': nombre, 'paso': self.PASOS.get(nombre),
+                                         'filas': self._filas, 'segundos': 0.0, 'cache': True})
+            return previo[2], previo[3]
+        with self._medir(nombre):
+            resultado = fn()
+        token = (nombre, next(self._versiones))
+        self._cache[nombre] = (clave, deps, resultado, token)
+        self.recalculadas.append(nombre)
+        return resultado, token
+
+    def _aportes(self, tipo: str, contratos: list, base: dict, t_base) -> list:
+        """Aportes por empresa de un tipo de contrato, reutilizando los de DataFrames sin cambios."""
+        previos = self._aportes_contratos.get(tipo, {})
+        vigentes, aportes = {}, []
+        for df in contratos:
+            previo = previos.get(id(df))
+            if previo is not None and previo[0] == t_base:
+                aporte = previo[2]
+            else:
+                aporte = _reducir_contrato(base, df, tipo)
+                empresa = df['empresa'].iat[0] if 'empresa' in df and len(df) else len(aportes) + 1
+                self.recalculadas.append(f"{tipo}[{empresa}]")
+            vigentes[id(df)] = (t_base, df, aporte)
+            aportes.append(aporte)
+        self._aportes_contratos[tipo] = vigentes
+        return aportes
+
+    def _medir(self, nombre):
+        if self._medidor is None:
+            return contextlib.nullcontext()
+        return self._medidor.etapa(nombre, filas=self._filas, paso=self.PASOS.get(nombre), cache=False)
+
+    def calcular(self, repo, reserv_mexico=None, bo_mexico=None,
+                 reserv_polifiltro=None, bo_polifiltro=None,
+                 precio_polifiltro=None, contratos_vigentes=(),
+                 contratos_excluir=(), medidor=None) -> pd.DataFrame:
+        """Igual que `calcular_compras`, reutilizando las etapas sin cambios.
+
+        Si se pasa un `diagnostico.Medidor`, registra tiempo, filas y (si está activa)
+        memoria de cada etapa (las tomadas del cache se registran con 0 segundos).
+        """
+        self.recalculadas = []
+        self._medidor = medidor
+        self._filas = len(repo)
+        entradas = {
+            'reserv_mexico': reserv_mexico,
+            'bo_mexico': bo_mexico,
+            'reserv_polifiltro': reserv_polifiltro,
+            'bo_polifiltro': bo_polifiltro,
+            'precio_polifiltro': precio_polifiltro,
+        }
+        cv_list = [c for c in contratos_vigentes if c is not None]
+        ce_list = [c for c in contratos_excluir if c is not None]
+
+        # ── 1. Base: REPO ──
+        base, t_base = self._etapa('base', (repo,), lambda: _factorizar_base(repo))
+
+        # ── 2. Datos de proveedores y precio (una etapa por entrada) ──
+        prov, t_prov = {}, {}
+        for col, df_p in entradas.items():
+            prov[col], t_prov[col] = self._etapa(
+                col, (t_base, df_p), lambda df_p=df_p, col=col: _alinear_proveedor(base, df_p, col)
+            )
+
+        # ── 3. Contratos ──
+        contratos, t_contratos = self._etapa(
+            'contratos', (t_base, *cv_list, None, *ce_list),
+            lambda: _sumar_aportes(len(base['codes']),
+                                   self._aportes('contratos_vigentes', cv_list, base, t_base),
+                                   self._aportes('contratos_excluir', ce_list, base, t_base))
+        )
+
+        # ── 4. Demanda mensual sin contratos ──
+        dms, t_dms = self._etapa('demanda', (t_base, t_contratos), lambda: _demanda(base, contratos))
+
+        # ── 5. Stock virtual ──
+        sv, t_sv = self._etapa(
+            'stock_virtual', (t_base, t_prov['reserv_mexico'], t_prov['bo_mexico']),
+            lambda: _stock_virtual(base, prov['reserv_mexico'], prov['bo_mexico'])
+        )
+
+        # ── 6. Diferencia de precio y tramo ──
+        tramo, t_tramo = self._etapa(
+            'precio', (t_base, t_prov['precio_polifiltro']),
+            lambda: _tramo_precio(base, prov['precio_polifiltro'])
+        )
+
+        # ── 7-9. Stock objetivo, casos y cantidades ──
+        cantidades, _ = self._etapa(
+            'cantidades',
+            (t_base, t_dms, t_contratos, t_sv, t_tramo, t_prov['reserv_polifiltro'], t_prov['bo_polifiltro']),
+            lambda: _cantidades(base, dms, contratos['demanda_mensual_contratos'], sv,
+                                tramo['tramo'], prov['reserv_polifiltro'], prov['bo_polifiltro'])
+        )
+
+        with self._medir('ensamblado'):
+            nuevas = dict(prov)
+            nuevas.update(contratos)
+            nuevas['demanda_mensual_sin_contratos'] = dms
+            nuevas['stock_virtual'] = sv
+            nuevas['diferencia_precio_pct'] = tramo['diferencia_precio_pct']
+            nuevas['donde_comprar'] = tramo['donde_comprar']
+            nuevas.update(cantidades)
+            df = pd.concat([base['base'], pd.DataFrame(nuevas, index=base['base'].index)], axis=1)
+        self._medidor = None
+        return df
+
+
+def calcular_compras(repo, reserv_mexico=None, bo_mexico=None,
+                     reserv_polifiltro=None, bo_polifiltro=None,
+                     precio_polifiltro=None, contratos_vigentes=(),
+                     contratos_excluir=()) -> pd.DataFrame:
+    """Calcula demanda, stock virtual, stock objetivo y cantidades a comprar.
+
+    `repo` es el REPO filtrado; las entradas de proveedores son DataFrames
+    {codigo, cantidad} o None; los contratos son listas de DataFrames (se ignoran
+    los None). Retorna el DataFrame de resultados completo.
+    """
+    return PipelineCompras().calcular(
+        repo, reserv_mexico=reserv_mexico, bo_mexico=bo_mexico,
+        reserv_polifiltro=reserv_polifiltro, bo_polifiltro=bo_polifiltro,
+        precio_polifiltro=precio_polifiltro, contratos_vigentes=contratos_vigentes,
+        contratos_excluir=contratos_excluir,
+    )
+
+
+def ordenes_compra(df_res: pd.DataFrame):
+    """Arma las órdenes de compra (México, Polifiltro) a partir del resultado.
+
+    Si el resultado fue ajustado a presupuesto (`presupuesto.ajustar_a_presupuesto`),
+    cada orden incluye también la cantidad sugerida antes del recorte.
+    """
+    def sugerida(proveedor):
+        col = f'qty_sugerida_{proveedor}'
+        return [col] if col in df_res else []
+
+    # Orden México
+    df_mex = df_res[df_res['qty_comprar_mexico'] > 0][[
+        'codigo', 'codfabricante', 'descripcion', 'clasificacion', 'caso', 'proporcion',
+        'demanda_mensual_sin_contratos', 'demanda_mensual_contratos',
+        'stock_virtual', 'stock_objetivo', *sugerida('mexico'), 'qty_comprar_mexico', 'pc'
+    ]].copy()
+    df_mex['monto_mexico'] = (df_mex['qty_comprar_mexico'] * df_mex['pc']).round(2)
+
+    # Orden Polifiltro
+    df_poli = df_res[df_res['qty_comprar_polifiltro'] > 0][[
+        'codigo', 'codfabricante', 'descripcion', 'clasificacion', 'caso', 'proporcion',
+        'demanda_mensual_sin_contratos', 'demanda_mensual_contratos',
+        'stock_virtual', 'stock_objetivo', *sugerida('polifiltro'), 'qty_comprar_polifiltro', 'precio_polifiltro'
+    ]].copy()
+    df_poli['monto_polifiltro'] = (df_poli['qty_comprar_polifiltro'] * df_poli['precio_polifiltro']).round(2)
+    return df_mex, df_poli
+
+
+# ─────────────────────────────────────────────
+# Línea de comandos
+# ─────────────────────────────────────────────
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m calculo',
+        description='Calcula las cantidades a comprar en México y Polifiltro sin la interfaz Streamlit.'
+    )
+    parser.add_argument('--repo', required=True, help='Excel REPO exportado del sistema (.xlsx)')
+    parser.add_argument('--reserv-mexico', required=True, help='CSV/TSV/Excel codigo, cantidad disponible México')
+    parser.add_argument('--bo-mexico', required=True, help='CSV/TSV/Excel codigo, backorder México')
+    parser.add_argument('--reserv-polifiltro', help='CSV/TSV/Excel codigo, cantidad disponible Polifiltro')
+    parser.add_argument('--bo-polifiltro', help='CSV/TSV/Excel codigo, backorder Polifiltro')
+    parser.add_argument('--precio-polifiltro', required=True, help='CSV/TSV/Excel codigo, precio Polifiltro')
+    parser.add_argument('--contrato-vigente', action='append', metavar='ARCHIVO',
+                        help='CSV/TSV/Excel codigo, q_fact, q_contrato (uno por empresa, repetible)')
+    parser.add_argument('--contrato-excluir', action='append', metavar='ARCHIVO',
+                        help='CSV/TSV/Excel codigo, q_3m, q_6m, q_12m (uno por empresa, repetible)')
+    parser.add_argument('--presupuesto-mexico', type=float, metavar='MONTO',
+                        help='Tope de gasto en México: recorta la orden (ver presupuesto.py)')
+    parser.add_argument('--presupuesto-polifiltro', type=float, metavar='MONTO',
+                        help='Tope de gasto en Polifiltro: recorta la orden (ver presupuesto.py)')
+    parser.add_argument('--salida', default='.', help='Directorio donde escribir los archivos (default: .)')
+    parser.add_argument('--formatos', nargs='+', choices=list(FORMATOS), default=['xlsx'],
+                        help='Formatos de salida (default: xlsx). parquet requiere pyarrow')
+    args = parser.parse_args(argv)
+    no_disponibles = sorted(set(args.formatos) - set(formatos_disponibles()))
+    if no_disponibles:
+        parser.error(f"formatos no disponibles en este entorno: {', '.join(no_disponibles)}")
+
+    repo, n_total, missing, columnas = leer_repo(args.repo)
+    if missing:
+        print(f"Columnas faltantes en el archivo REPO: {missing}", file=sys.stderr)
+        print(f"Columnas disponibles: {columnas}", file=sys.stderr)
+        return 1
+
+    entradas = {}
+    for clave in ('reserv_mexico', 'bo_mexico', 'reserv_polifiltro', 'bo_polifiltro', 'precio_polifiltro'):
+        ruta = getattr(args, clave)
+        df_e = leer_tabla(ruta, COLUMNAS_ENTRADA[clave]) if ruta else None
+        entradas[clave], n_rep = agregar_duplicados(df_e, POLITICA_DUPLICADOS[clave])
+        if n_rep:
+            print(f"{clave}: {n_rep:,} códigos repetidos agregados ({NOMBRE_POLITICA[POLITICA_DUPLICADOS[clave]]})",
+                  file=sys.stderr)
+
+    df_res = calcular_compras(
+        repo,
+        contratos_vigentes=leer_contratos(args.contrato_vigente, 'contratos_vigentes'),
+        contratos_excluir=leer_contratos(args.contrato_excluir, 'contratos_excluir'),
+        **entradas
+    )
+    presupuestos = {'mexico': args.presupuesto_mexico, 'polifiltro': args.presupuesto_polifiltro}
+    if any(v is not None for v in presupuestos.values()):
+        from presupuesto import ajustar_a_presupuesto
+        df_res, resumen = ajustar_a_presupuesto(df_res, presupuestos)
+        for r in resumen.itertuples():
+            print(f"Presupuesto {r.proveedor}: {r.monto_sugerido:,.2f} → {r.monto_ajustado:,.2f} "
+                  f"(tope {r.presupuesto:,.2f}, {r.codigos_recortados:,} códigos recortados)")
+    df_mex, df_poli = ordenes_compra(df_res)
+
+    salida = Path(args.salida)
+    salida.mkdir(parents=True, exist_ok=True)
+    for formato in args.formatos:
+        guardar_archivos({'Resultados': df_res}, salida, 'resultados_compras_completo', formato)
+        guardar_archivos({
+            'OC México': df_mex,
+            'OC Polifiltro': df_poli
+        }, salida, 'ordenes_compra_proveedores', formato)
+
+    print(f"REPO: {n_total:,} registros, {len(repo):,} después de filtros")
+    print(f"OC México: {len(df_mex):,} códigos, {df_mex['qty_comprar_mexico'].sum():,} und.")
+    print(f"OC Polifiltro: {len(df_poli):,} códigos, {df_poli['qty_comprar_polifiltro'].sum():,} und.")
+    print(f"Archivos escritos en {salida.resolve()}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,108 @@
+"""
+Cache compartido entre sesiones para entradas inmutables (REPO filtrado, precios).
+
+Varios usuarios del mismo servidor suelen cargar el mismo REPO del día y la misma
+lista de precios Polifiltro. `RegistroCompartido` guarda una sola copia de cada
+DataFrame por contenido (hash) y cada sesión queda con una referencia a esa copia
+en lugar de la suya. Cada sesión cliente ocupa a lo sumo una referencia por
+entrada: al cargar otra versión suelta la anterior. Las referencias de sesiones
+que dejan de refrescarse vencen a las `ttl` segundos, y los DataFrames sin
+referencias se liberan.
+
+Los DataFrames compartidos son de solo lectura: las entradas de sesión se
+reemplazan, nunca se modifican (ver `calculo.PipelineCompras`).
+"""
+
+import hashlib
+import threading
+import time
+
+import pandas as pd
+
+
+# Segundos sin actividad tras los que vencen las referencias de una sesión
+TTL_REFERENCIA = 2 * 3600
+
+
+def hash_frame(df: pd.DataFrame) -> str:
+    """Hash SHA-256 del contenido de `df` (columnas y valores, sin el índice)."""
+    h = hashlib.sha256('\t'.join(map(str, df.columns)).encode())
+    h.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+class RegistroCompartido:
+    """Registro de DataFrames compartidos con conteo de referencias por sesión cliente."""
+
+    def __init__(self, ttl=TTL_REFERENCIA):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._frames = {}       # {(clave, hash): DataFrame}
+        self._referencias = {}  # {(cliente, clave): hash}
+        self._actividad = {}    # {cliente: último uso}
+
+    def compartir(self, cliente: str, clave: str, df: pd.DataFrame, contenido_hash=None) -> pd.DataFrame:
+        """Registra `df` como la entrada `clave` del cliente y retorna la copia compartida.
+
+        Si otra sesión ya cargó el mismo contenido se retorna su DataFrame y `df`
+        se descarta. Sin `contenido_hash` se calcula con `hash_frame`.
+        """
+        contenido_hash = contenido_hash or hash_frame(df)
+        with self._lock:
+            compartido = self._frames.setdefault((clave, contenido_hash), df)
+            anterior = self._referencias.get((cliente, clave))
+            self._referencias[(cliente, clave)] = contenido_hash
+            self._actividad[cliente] = time.time()
+            if anterior is not None and anterior != contenido_hash:
+                self._liberar_sin_referencias()
+        return compartido
+
+    def soltar(self, cliente: str, clave=None):
+        """Suelta la referencia del cliente a `clave` (o a todas sus entradas)."""
+        with self._lock:
+            for ref in [r for r in self._referencias if r[0] == cliente and clave in (None, r[1])]:
+                del self._referencias[ref]
+            if clave is None:
+                self._actividad.pop(cliente, None)
+            self._liberar_sin_referencias()
+
+    def tocar(self, cliente: str):
+        with self._lock:
+            self._actividad[cliente] = time.time()
+
+    def desalojar(self) -> int:
+        """Vence las referencias de clientes inactivos y libera los DataFrames sin referencias.
+
+        Retorna cuántos DataFrames se liberaron.
+        """
+        limite = time.time() - self.ttl
+        with self._lock:
+            inactivos = {c for c, t in self._actividad.items() if t < limite}
+            for ref in [r for r in self._referencias if r[0] in inactivos]:
+                del self._referencias[ref]
+            for cliente in inactivos:
+                del self._actividad[cliente]
+            return self._liberar_sin_referencias()
+
+    def _liberar_sin_referencias(self) -> int:
+        en_uso = {(clave, h) for (_, clave), h in self._referencias.items()}
+        libres = [k for k in self._frames if k not in en_uso]
+        for k in libres:
+            del self._frames[k]
+        return len(libres)
+
+    def estadisticas(self) -> pd.DataFrame:
+        """Una fila por DataFrame compartido: entrada, hash, filas, MB y referencias."""
+        with self._lock:
+            frames = list(self._frames.items())
+            conteo = {}
+            for (_, clave), h in self._referencias.items():
+                conteo[(clave, h)] = conteo.get((clave, h), 0) + 1
+        filas = [{
+            'entrada': clave,
+            'hash': h[:12],
+            'filas': len(df),
+            'mb': round(df.memory_usage(deep=True).sum() / 1e6, 2),
+            'referencias': conteo.get((clave, h), 0),
+        } for (clave, h), df in frames]
+        return pd.DataFrame(filas, columns=['entrada', 'hash', 'filas', 'mb', 'referencias'])
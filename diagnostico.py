@@ -0,0 +1,78 @@
+"""
+Instrumentación por etapa: tiempo, filas y memoria pico.
+"""
+
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import pandas as pd
+
+
+# Si está definida, cada etapa medida se agrega como una línea JSON a este archivo
+LOG_DIAGNOSTICO = os.environ.get('COMPRAS_LOG_DIAGNOSTICO')
+
+# Medición de memoria pico por defecto (COMPRAS_DIAGNOSTICO_MEMORIA=1); agrega mucho overhead
+MEMORIA_DIAGNOSTICO = os.environ.get('COMPRAS_DIAGNOSTICO_MEMORIA') == '1'
+
+# tracemalloc es global al proceso: una sola etapa a la vez puede medir memoria
+_LOCK_TRACEMALLOC = threading.Lock()
+
+
+class Medidor:
+    """Registra tiempo de reloj, filas y memoria pico de cada etapa medida.
+
+    La memoria pico se mide con tracemalloc (incluye los arrays de NumPy) solo
+    con `memoria=True`: hace varias veces más lentas las etapas, así que es una
+    opción de diagnóstico. Como tracemalloc es global al proceso, si otra etapa
+    (de esta u otra sesión) ya está midiendo, la etapa queda sin memoria pico.
+    Si `log` es una ruta, cada registro se agrega como línea JSON.
+    """
+
+    def __init__(self, memoria=MEMORIA_DIAGNOSTICO, log=LOG_DIAGNOSTICO, max_registros=500):
+        self.memoria = memoria
+        self.log = log
+        self.max_registros = max_registros
+        self.registros = []
+
+    @contextmanager
+    def etapa(self, nombre, filas=None, memoria=None, **contexto):
+        """Mide el bloque. El dict que se entrega permite completar 'filas' al final.
+
+        `memoria` reemplaza para esta etapa la opción del medidor.
+        """
+        registro = {'etapa': nombre, 'filas': filas, **contexto}
+        memoria = self.memoria if memoria is None else memoria
+        propio = memoria and _LOCK_TRACEMALLOC.acquire(blocking=False)
+        if propio and tracemalloc.is_tracing():
+            # Lo inició código ajeno a los medidores: no se toca
+            _LOCK_TRACEMALLOC.release()
+            propio = False
+        if propio:
+            tracemalloc.start()
+        t0 = time.perf_counter()
+        try:
+            yield registro
+        finally:
+            registro['segundos'] = round(time.perf_counter() - t0, 6)
+            if propio:
+                registro['memoria_pico_mb'] = round(tracemalloc.get_traced_memory()[1] / 1e6, 3)
+                tracemalloc.stop()
+                _LOCK_TRACEMALLOC.release()
+            elif memoria:
+                registro['memoria_pico_mb'] = None
+            self.registrar(registro)
+
+    def registrar(self, registro: dict):
+        registro.setdefault('momento', time.strftime('%Y-%m-%dT%H:%M:%S'))
+        self.registros.append(registro)
+        del self.registros[:-self.max_registros]
+        if self.log:
+            with open(self.log, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(registro, ensure_ascii=False, default=str) + '\n')
+
+    def tabla(self) -> pd.DataFrame:
+        return pd.DataFrame(self.registros)
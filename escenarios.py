@@ -0,0 +1,196 @@
+"""
+Escenarios what-if: evalúa muchas combinaciones de parámetros de compra de una vez.
+
+Parte de un resultado ya calculado (`calcular_compras`): demanda, stock virtual,
+disponible/backorder de Polifiltro y diferencia de precio no dependen de los
+parámetros de compra, así que cada escenario solo rehace los pasos 6-9 (tramo,
+stock objetivo, caso y cantidades). Los escenarios se evalúan juntos en arrays
+escenarios × códigos, por bloques para acotar la memoria.
+
+Parámetros de cada escenario (los que no se dan toman el valor de calculo.py):
+    umbral_poli_fuerte, umbral_poli_leve : umbrales de diferencia % de los tramos
+    meses_contratos                      : meses de demanda con contrato en el stock objetivo
+    delta_meses_dms                      : meses que se suman a meses_dms de todos los casos
+    delta_meses_poli                     : meses que pasan de México a Polifiltro en los
+                                           casos que compran en Polifiltro (5x3 → 4x4 con 1,
+                                           5x3 → 6x2 con -1)
+    tabla                                : TABLA_CASOS alternativa (antes de aplicar los deltas)
+"""
+
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from calculo import (CLASIFICACIONES_PREMIUM, MESES_CONTRATOS, TABLA_CASOS, TRAMOS,
+                     UMBRAL_POLI_FUERTE, UMBRAL_POLI_LEVE, _parametros_casos)
+
+
+PARAMETROS_ESCENARIO = {
+    'umbral_poli_fuerte': UMBRAL_POLI_FUERTE,
+    'umbral_poli_leve': UMBRAL_POLI_LEVE,
+    'meses_contratos': MESES_CONTRATOS,
+    'delta_meses_dms': 0,
+    'delta_meses_poli': 0,
+    'tabla': TABLA_CASOS,
+}
+
+# Máximo de celdas (escenarios × códigos) por bloque de arrays
+CELDAS_POR_BLOQUE = 4_000_000
+
+
+def grilla(**valores) -> list:
+    """Todas las combinaciones de los valores dados por parámetro.
+
+    Ej.: grilla(umbral_poli_fuerte=[-10, -8, -6], meses_contratos=[3, 4]) → 6 escenarios.
+    """
+    desconocidos = set(valores) - set(PARAMETROS_ESCENARIO)
+    if desconocidos:
+        raise ValueError(f"Parámetros de escenario desconocidos: {sorted(desconocidos)}")
+    nombres = list(valores)
+    return [dict(zip(nombres, combinacion)) for combinacion in itertools.product(*valores.values())]
+
+
+def variar_tabla(tabla, delta_meses_dms=0, delta_meses_poli=0) -> list:
+    """Copia de `tabla` con meses_dms desplazado y meses movidos de México a Polifiltro.
+
+    Un `delta_meses_poli` negativo mueve meses de Polifiltro a México. El total de
+    meses de cada caso se conserva y ambos proveedores quedan con al menos un mes.
+    """
+    filas = []
+    for caso, tramo, premium, meses_dms, meses_mex, meses_poli in tabla:
+        if meses_poli > 0:
+            d = max(min(delta_meses_poli, meses_mex - 1), -(meses_poli - 1))
+            meses_mex, meses_poli = meses_mex - d, meses_poli + d
+        filas.append((caso, tramo, premium, max(meses_dms + delta_meses_dms, 0), meses_mex, meses_poli))
+    return filas
+
+
+def preparar_base(df_res: pd.DataFrame) -> dict:
+    """Arrays por código que no dependen de los parámetros de compra."""
+    def num(col):
+        return df_res[col].to_numpy(dtype=float)
+
+    caja = num('qty_piezas_por_caja')
+    return {
+        'dms': num('demanda_mensual_sin_contratos'),
+        'dmc': num('demanda_mensual_contratos'),
+        'sv': num('stock_virtual'),
+        'rp': num('reserv_polifiltro'),
+        'bop': num('bo_polifiltro'),
+        'diff': num('diferencia_precio_pct'),
+        'pc': num('pc'),
+        'precio_polifiltro': num('precio_polifiltro'),
+        'caja': np.maximum(np.where(np.isnan(caja), 1, caja), 1),
+        'premium': df_res['clasificacion'].astype(object).str.upper().isin(CLASIFICACIONES_PREMIUM).to_numpy(),
+    }
+
+
+def _parametros(escenarios: list) -> dict:
+    """Parámetros de los escenarios como arrays (S,) y tablas de casos (S, K)."""
+    completos = [{**PARAMETROS_ESCENARIO, **e} for e in escenarios]
+    casos = [_parametros_casos(variar_tabla(e['tabla'], e['delta_meses_dms'], e['delta_meses_poli']))
+             for e in completos]
+    k = max(len(p['meses_dms']) for p in casos)
+
+    def apilar(clave, relleno):
+        return np.array([np.pad(p[clave], (0, k - len(p[clave])), constant_values=relleno) for p in casos])
+
+    return {
+        'umbral_fuerte': np.array([e['umbral_poli_fuerte'] for e in completos], dtype=float),
+        'umbral_leve': np.array([e['umbral_poli_leve'] for e in completos], dtype=float),
+        'meses_contratos': np.array([e['meses_contratos'] for e in completos], dtype=float),
+        'caso_por_tramo': np.stack([p['caso_por_tramo'] for p in casos]),
+        'meses_dms': apilar('meses_dms', 0.0),
+        'mex_num': apilar('mex_num', 0.0),
+        'mex_den': apilar('mex_den', 1.0),
+        'compra_poli': apilar('compra_poli', False),
+    }
+
+
+def _redondear_caja(qty: np.ndarray, caja: np.ndarray) -> np.ndarray:
+    """`calculo.redondear_caja` para arrays 2-D, sin pasar a enteros."""
+    out = np.ceil(qty / caja)
+    out *= caja
+    out[~(qty > 0)] = 0
+    return out
+
+
+def _evaluar_bloque(b: dict, p: dict, s: slice) -> dict:
+    n = len(b['dms'])
+    filas = np.arange(s.stop - s.start)[:, None]
+
+    # ── 6. Tramo por escenario (S × N) ──
+    tiene_precio = b['precio_polifiltro'] > 0
+    fuerte = tiene_precio & (b['diff'] <= p['umbral_fuerte'][s, None])
+    leve = tiene_precio & (b['diff'] <= p['umbral_leve'][s, None])
+    tramo = np.where(fuerte, TRAMOS.index('POLI_FUERTE'),
+                     np.where(leve, TRAMOS.index('POLI_LEVE'), TRAMOS.index('MEX')))
+    idx = p['caso_por_tramo'][s][filas, tramo, np.broadcast_to(b['premium'].astype(np.intp), (len(filas), n))]
+
+    # ── 7. Stock objetivo ──
+    so = p['meses_dms'][s][filas, idx] * b['dms']
+    so += p['meses_contratos'][s, None] * b['dmc']
+
+    # ── 8. Cantidades (mismo orden de operaciones que calculo._cantidades) ──
+    qty_mexico = p['mex_num'][s][filas, idx] * so
+    qty_mexico /= p['mex_den'][s][filas, idx]
+    qty_mexico -= b['sv']
+    np.maximum(qty_mexico, 0, out=qty_mexico)
+
+    qty_polifiltro = so - b['sv']
+    qty_polifiltro -= qty_mexico
+    qty_polifiltro -= b['rp']
+    qty_polifiltro -= b['bop']
+    np.maximum(qty_polifiltro, 0, out=qty_polifiltro)
+    qty_polifiltro[~p['compra_poli'][s][filas, idx]] = 0
+
+    # ── 9. Redondeo a caja y totales por escenario ──
+    qty_mexico = _redondear_caja(qty_mexico, b['caja'])
+    qty_polifiltro = _redondear_caja(qty_polifiltro, b['caja'])
+    return {
+        'codigos_mexico': (qty_mexico > 0).sum(axis=1),
+        'und_mexico': qty_mexico.sum(axis=1),
+        'monto_mexico': qty_mexico @ np.nan_to_num(b['pc']),
+        'codigos_polifiltro': (qty_polifiltro > 0).sum(axis=1),
+        'und_polifiltro': qty_polifiltro.sum(axis=1),
+        'monto_polifiltro': qty_polifiltro @ np.nan_to_num(b['precio_polifiltro']),
+    }
+
+
+def evaluar_escenarios(df_res: pd.DataFrame, escenarios: list) -> pd.DataFrame:
+    """Unidades y montos a comprar en México y Polifiltro para cada escenario.
+
+    Retorna un DataFrame con una fila por escenario: sus parámetros (sin `tabla`,
+    que se identifica por `tabla_casos` si se varió) y los totales.
+    """
+    b = preparar_base(df_res)
+    p = _parametros(escenarios)
+    n_esc = len(escenarios)
+    paso = max(1, CELDAS_POR_BLOQUE // max(len(b['dms']), 1))
+
+    bloques = [_evaluar_bloque(b, p, slice(i, min(i + paso, n_esc))) for i in range(0, n_esc, paso)]
+    totales = {c: np.concatenate([t[c] for t in bloques]) if bloques else np.array([])
+               for c in ('codigos_mexico', 'und_mexico', 'monto_mexico',
+                         'codigos_polifiltro', 'und_polifiltro', 'monto_polifiltro')}
+
+    completos = [{**PARAMETROS_ESCENARIO, **e} for e in escenarios]
+    tablas = []
+    for e in completos:
+        if e['tabla'] not in tablas:
+            tablas.append(e['tabla'])
+    out = pd.DataFrame({
+        'umbral_poli_fuerte': [e['umbral_poli_fuerte'] for e in completos],
+        'umbral_poli_leve': [e['umbral_poli_leve'] for e in completos],
+        'meses_contratos': [e['meses_contratos'] for e in completos],
+        'delta_meses_dms': [e['delta_meses_dms'] for e in completos],
+        'delta_meses_poli': [e['delta_meses_poli'] for e in completos],
+    })
+    if len(tablas) > 1:
+        out['tabla_casos'] = [tablas.index(e['tabla']) for e in completos]
+    for c in ('codigos_mexico', 'und_mexico', 'codigos_polifiltro', 'und_polifiltro'):
+        out[c] = totales[c].astype(np.int64)
+    out['monto_mexico'] = totales['monto_mexico'].round(2)
+    out['monto_polifiltro'] = totales['monto_polifiltro'].round(2)
+    out['monto_total'] = out['monto_mexico'] + out['monto_polifiltro']
+    return out
@@ -0,0 +1,195 @@
+"""
+Exportación de resultados de la calculadora de compras.
+
+Los Excel se escriben con openpyxl en modo write-only: las filas se envían al
+archivo por bloques a medida que se generan, sin armar el grafo completo de
+celdas en memoria. Además de xlsx se puede exportar a CSV, TSV, CSV comprimido
+con gzip y Parquet (este último solo si está instalado pyarrow).
+"""
+
+import importlib.util
+import unicodedata
+from contextlib import nullcontext
+from io import BytesIO
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, Side
+
+
+# Formato numérico por columna (el resto queda en formato General)
+FORMATOS_COLUMNA = {
+    'pc': '#,##0.00',
+    'precio_polifiltro': '#,##0.00',
+    'monto_mexico': '#,##0.00',
+    'monto_polifiltro': '#,##0.00',
+    'diferencia_precio_pct': '0.00',
+}
+
+# Filas que se convierten a valores Python por vez
+FILAS_POR_BLOQUE = 50_000
+
+_BORDE = Side(style='thin')
+
+
+def _valores_excel(valores: np.ndarray) -> list:
+    """Convierte un bloque de una columna a valores Python para openpyxl.
+
+    NaN/None quedan como celda vacía e infinito como texto 'inf'/'-inf'
+    (igual que `DataFrame.to_excel`).
+    """
+    if valores.dtype.kind in 'iub':
+        return valores.tolist()
+    if valores.dtype.kind == 'f':
+        salida = valores.astype(object)
+        salida[np.isnan(valores)] = None
+        if np.isinf(valores).any():
+            salida[np.isposinf(valores)] = 'inf'
+            salida[np.isneginf(valores)] = '-inf'
+        return salida.tolist()
+    salida = valores.astype(object)
+    salida[pd.isna(salida)] = None
+    return salida.tolist()
+
+
+def _escribir_hoja(wb: Workbook, nombre: str, df: pd.DataFrame):
+    ws = wb.create_sheet(nombre[:31])
+
+    encabezado = []
+    for col in df.columns:
+        celda = WriteOnlyCell(ws, value=str(col))
+        celda.font = Font(bold=True)
+        celda.border = Border(left=_BORDE, right=_BORDE, top=_BORDE, bottom=_BORDE)
+        celda.alignment = Alignment(horizontal='center', vertical='top')
+        encabezado.append(celda)
+    ws.append(encabezado)
+
+    # Una celda plantilla por columna con formato: el estilo se resuelve una sola
+    # vez y en cada fila solo se cambia el valor.
+    formateadas = []
+    for j, col in enumerate(df.columns):
+        if col in FORMATOS_COLUMNA:
+            plantilla = WriteOnlyCell(ws)
+            plantilla.number_format = FORMATOS_COLUMNA[col]
+            formateadas.append((j, plantilla))
+
+    arrays = [df.iloc[:, j].to_numpy() for j in range(df.shape[1])]
+    for inicio in range(0, len(df), FILAS_POR_BLOQUE):
+        columnas = [_valores_excel(a[inicio:inicio + FILAS_POR_BLOQUE]) for a in arrays]
+        for fila in zip(*columnas):
+            if formateadas:
+                fila = list(fila)
+                for j, plantilla in formateadas:
+                    if fila[j] is not None:
+                        plantilla.value = fila[j]
+                        fila[j] = plantilla
+            ws.append(fila)
+
+
+def guardar_excel(dfs: dict, destino, medidor=None):
+    """Escribe dict {sheet_name: df} como Excel en `destino` (ruta o archivo binario).
+
+    Con un `diagnostico.Medidor` registra la exportación como etapa 'to_excel_bytes'.
+    """
+    filas = sum(len(df) for df in dfs.values())
+    with medidor.etapa('to_excel_bytes', filas=filas, hojas=', '.join(dfs)) if medidor else nullcontext():
+        wb = Workbook(write_only=True)
+        for sheet, df in dfs.items():
+            _escribir_hoja(wb, sheet, df)
+        wb.save(destino)
+
+
+def to_excel_bytes(dfs: dict, medidor=None) -> bytes:
+    """Convierte dict {sheet_name: df} a bytes Excel (ver `guardar_excel`)."""
+    buf = BytesIO()
+    guardar_excel(dfs, buf, medidor)
+    return buf.getvalue()
+
+
+# ─────────────────────────────────────────────
+# Otros formatos
+# ─────────────────────────────────────────────
+# formato: (etiqueta, extensión, tipo MIME)
+FORMATOS = {
+    'xlsx': ('Excel (.xlsx)', '.xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'csv': ('CSV (.csv)', '.csv', 'text/csv'),
+    'tsv': ('TSV (.tsv)', '.tsv', 'text/tab-separated-values'),
+    'csv.gz': ('CSV comprimido (.csv.gz)', '.csv.gz', 'application/gzip'),
+    'parquet': ('Parquet (.parquet)', '.parquet', 'application/vnd.apache.parquet'),
+}
+
+
+def formatos_disponibles() -> list:
+    """Formatos de FORMATOS que se pueden escribir en este entorno."""
+    formatos = list(FORMATOS)
+    if importlib.util.find_spec('pyarrow') is None:
+        formatos.remove('parquet')
+    return formatos
+
+
+def _slug(texto: str) -> str:
+    """'OC México' → 'oc_mexico'."""
+    sin_acentos = unicodedata.normalize('NFKD', texto).encode('ascii', 'ignore').decode()
+    return '_'.join(sin_acentos.lower().split())
+
+
+def archivos_exportacion(dfs: dict, nombre_base: str, formato: str) -> list:
+    """Reparte dict {sheet_name: df} en archivos. Retorna [(nombre_archivo, {sheet: df})].
+
+    En xlsx es un solo libro con una hoja por DataFrame; en los demás formatos, que
+    tienen una sola tabla por archivo, un archivo por DataFrame
+    (`<nombre_base>_<hoja>.<ext>`, o `<nombre_base>.<ext>` si hay uno solo).
+    """
+    ext = FORMATOS[formato][1]
+    if formato == 'xlsx' or len(dfs) == 1:
+        return [(nombre_base + ext, dfs)]
+    return [(f'{nombre_base}_{_slug(hoja)}{ext}', {hoja: df}) for hoja, df in dfs.items()]
+
+
+def _guardar_tabla(df: pd.DataFrame, destino, formato: str):
+    if formato == 'csv':
+        df.to_csv(destino, index=False)
+    elif formato == 'tsv':
+        df.to_csv(destino, sep='\t', index=False)
+    elif formato == 'csv.gz':
+        df.to_csv(destino, index=False, compression={'method': 'gzip', 'compresslevel': 6, 'mtime': 0})
+    elif formato == 'parquet':
+        df.to_parquet(destino, index=False)
+    else:
+        raise ValueError(f"Formato de exportación desconocido: {formato}")
+
+
+def _escribir(grupo: dict, destino, formato: str, nombre: str, medidor=None):
+    if formato == 'xlsx':
+        guardar_excel(grupo, destino, medidor)
+        return
+    (df,) = grupo.values()
+    with medidor.etapa(f'exportar_{formato}', filas=len(df), archivo=nombre) if medidor else nullcontext():
+        _guardar_tabla(df, destino, formato)
+
+
+def guardar_archivos(dfs: dict, directorio, nombre_base: str, formato: str, medidor=None) -> list:
+    """Escribe `dfs` en `directorio` en el formato pedido. Retorna las rutas escritas.
+
+    Cada archivo se escribe directo a disco (pandas escribe CSV por bloques), sin
+    armar el contenido completo en memoria.
+    """
+    rutas = []
+    for nombre, grupo in archivos_exportacion(dfs, nombre_base, formato):
+        ruta = Path(directorio) / nombre
+        _escribir(grupo, ruta, formato, nombre, medidor)
+        rutas.append(ruta)
+    return rutas
+
+
+def exportar_bytes(dfs: dict, nombre_base: str, formato: str, medidor=None) -> list:
+    """Como `guardar_archivos`, pero en memoria. Retorna [(nombre_archivo, bytes)] para descargar."""
+    archivos = []
+    for nombre, grupo in archivos_exportacion(dfs, nombre_base, formato):
+        buf = BytesIO()
+        _escribir(grupo, buf, formato, nombre, medidor)
+        archivos.append((nombre, buf.getvalue()))
+    return archivos
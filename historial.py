@@ -0,0 +1,232 @@
+"""
+Historial de corridas: archivo append-only de resultados para comparar compras.
+
+Cada corrida se guarda con el formato columnar de `almacen` en
+`<DIR_HISTORIAL>/corridas/<id>`, con las columnas de COLUMNAS_HISTORIAL y las
+filas ordenadas por `codigo`. El id empieza con la fecha y hora de la corrida, y
+cada corrida agrega una línea a `indice.jsonl` con sus totales. Las corridas
+nunca se modifican ni se reescriben.
+
+`diferencias` une dos corridas por código en una sola pasada vectorizada y
+marca los códigos nuevos, eliminados y los que cambiaron de caso o de cantidades.
+
+Uso:
+    python -m historial                                  (lista las corridas)
+    python -m historial --diff ID_ANTES ID_DESPUES [--salida DIR] [--formatos xlsx csv]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from almacen import abrir_columnar, guardar_columnar
+from compartido import hash_frame
+from exportar import FORMATOS, formatos_disponibles, guardar_archivos
+
+
+DIR_HISTORIAL = Path(os.environ.get('COMPRAS_HISTORIAL', 'historial'))
+INDICE = 'indice.jsonl'
+
+# Columnas del resultado que se archivan (las que falten en una corrida se omiten)
+COLUMNAS_HISTORIAL = [
+    'codigo', 'clasificacion', 'donde_comprar', 'caso', 'stock_objetivo',
+    'qty_comprar_mexico', 'qty_comprar_polifiltro', 'pc', 'precio_polifiltro',
+]
+CATEGORICAS = ['clasificacion', 'donde_comprar', 'caso']
+
+# Columnas numéricas que se comparan entre corridas
+COLUMNAS_DELTA = ['stock_objetivo', 'qty_comprar_mexico', 'qty_comprar_polifiltro']
+
+ESTADOS = ['nuevo', 'eliminado', 'cambiado', 'igual']
+
+
+# ─────────────────────────────────────────────
+# Archivo de corridas
+# ─────────────────────────────────────────────
+def _ruta_corrida(id_corrida: str, directorio=None) -> Path:
+    return Path(directorio or DIR_HISTORIAL) / 'corridas' / id_corrida
+
+
+def archivar_corrida(df_res: pd.DataFrame, directorio=None, **meta) -> dict | None:
+    """Agrega `df_res` al historial. Retorna la entrada del índice (id, fecha, totales, meta).
+
+    Si las columnas archivadas son iguales a las de la última corrida (mismo hash)
+    no se agrega nada y retorna None.
+    """
+    directorio = Path(directorio or DIR_HISTORIAL)
+    ahora = time.time()
+    id_corrida = datetime.fromtimestamp(ahora).strftime('%Y%m%d-%H%M%S-') + uuid.uuid4().hex[:6]
+
+    df = df_res[[c for c in COLUMNAS_HISTORIAL if c in df_res.columns]]
+    df = df.sort_values('codigo', kind='stable', ignore_index=True)
+    df = df.astype({c: 'category' for c in CATEGORICAS if c in df.columns})
+    contenido_hash = hash_frame(df)
+    corridas = listar_corridas(directorio)
+    if 'hash' in corridas and len(corridas) and corridas['hash'].iat[-1] == contenido_hash:
+        return None
+
+    entrada = {
+        'id': id_corrida,
+        'fecha': datetime.fromtimestamp(ahora).isoformat(timespec='seconds'),
+        'hash': contenido_hash,
+        'codigos': len(df),
+        'und_mexico': int(df['qty_comprar_mexico'].sum()),
+        'und_polifiltro': int(df['qty_comprar_polifiltro'].sum()),
+        'monto_mexico': round(float(df['qty_comprar_mexico'] @ df['pc'].fillna(0)), 2),
+        'monto_polifiltro': round(float(df['qty_comprar_polifiltro'] @ df['precio_polifiltro'].fillna(0)), 2),
+        **meta,
+    }
+    # Primero la corrida y después el índice: el índice nunca apunta a una corrida a medio escribir
+    guardar_columnar(df, _ruta_corrida(id_corrida, directorio), **entrada)
+    with open(directorio / INDICE, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(entrada, ensure_ascii=False) + '\n')
+    return entrada
+
+
+def listar_corridas(directorio=None, desde=None, hasta=None) -> pd.DataFrame:
+    """Índice de corridas (una fila por corrida, de la más antigua a la más reciente).
+
+    `desde` / `hasta` filtran por fecha ('2026-10-01', datetime, ...), ambos inclusive.
+    """
+    ruta = Path(directorio or DIR_HISTORIAL) / INDICE
+    if not ruta.exists():
+        return pd.DataFrame(columns=['id', 'fecha', 'codigos'])
+    with open(ruta, encoding='utf-8') as f:
+        corridas = pd.DataFrame([json.loads(linea) for linea in f if linea.strip()])
+    fechas = pd.to_datetime(corridas['fecha'])
+    if desde is not None:
+        corridas = corridas[fechas >= pd.Timestamp(desde)]
+    if hasta is not None:
+        corridas = corridas[fechas <= pd.Timestamp(hasta)]
+    return corridas.reset_index(drop=True)
+
+
+def abrir_corrida(id_corrida: str, directorio=None) -> pd.DataFrame:
+    """Reabre una corrida archivada (columnas numéricas memory-mapped, ordenada por código)."""
+    df, _ = abrir_columnar(_ruta_corrida(id_corrida, directorio))
+    return df
+
+
+# ─────────────────────────────────────────────
+# Diferencias entre corridas
+# ─────────────────────────────────────────────
+def _claves(df: pd.DataFrame, ocurrencias: bool) -> pd.Index:
+    """Clave de unión de una corrida: el código, o (código, ocurrencia) con `ocurrencias`."""
+    codigo = pd.Index(df['codigo'])
+    if not ocurrencias:
+        return codigo
+    ocurrencia = pd.Series(codigo).groupby(codigo, sort=False).cumcount().to_numpy()
+    return pd.MultiIndex.from_arrays([codigo, ocurrencia], names=['codigo', 'ocurrencia'])
+
+
+def diferencias(antes: pd.DataFrame, despues: pd.DataFrame, solo_cambios=True) -> pd.DataFrame:
+    """Une dos corridas por código y compara caso y cantidades.
+
+    Retorna una fila por código (de la unión, ordenada) con `estado` (nuevo,
+    eliminado, cambiado, igual), `caso_antes` / `caso_despues` y, para cada
+    columna de COLUMNAS_DELTA, `<col>_antes`, `<col>_despues` y `<col>_delta`
+    (los valores de la corrida donde el código no está quedan NaN y el delta se
+    calcula contra 0). Con `solo_cambios` se omiten los códigos iguales.
+
+    Si el REPO repetía un código, sus filas se emparejan por número de aparición
+    (la primera con la primera, ...) y el resultado lleva la columna `ocurrencia`.
+    """
+    ocurrencias = not (antes['codigo'].is_unique and despues['codigo'].is_unique)
+    ka, kb = _claves(antes, ocurrencias), _claves(despues, ocurrencias)
+    claves = ka.union(kb)
+    ia, ib = ka.get_indexer(claves), kb.get_indexer(claves)
+    en_a, en_b = ia >= 0, ib >= 0
+
+    def tomar(df, idx, presente, col):
+        valores = df[col].to_numpy()[idx]
+        if valores.dtype.kind in 'iuf':
+            valores = valores.astype(float)
+            valores[~presente] = np.nan
+        else:
+            valores = valores.astype(object)
+            valores[~presente] = None
+        return valores
+
+    if isinstance(claves, pd.MultiIndex):
+        out = {'codigo': claves.get_level_values(0).to_numpy(), 'ocurrencia': claves.get_level_values(1).to_numpy()}
+    else:
+        out = {'codigo': claves.to_numpy()}
+    caso_a, caso_b = tomar(antes, ia, en_a, 'caso'), tomar(despues, ib, en_b, 'caso')
+    out['caso_antes'], out['caso_despues'] = caso_a, caso_b
+    cambiado = caso_a != caso_b
+    for col in COLUMNAS_DELTA:
+        a, b = tomar(antes, ia, en_a, col), tomar(despues, ib, en_b, col)
+        delta = np.nan_to_num(b) - np.nan_to_num(a)
+        out[f'{col}_antes'], out[f'{col}_despues'], out[f'{col}_delta'] = a, b, delta
+        cambiado |= delta != 0
+
+    estado = np.select([~en_a, ~en_b, cambiado], ESTADOS[:3], default='igual')
+    df = pd.DataFrame(out)
+    df.insert(2 if 'ocurrencia' in out else 1, 'estado', pd.Categorical(estado, categories=ESTADOS))
+    if solo_cambios:
+        df = df[estado != 'igual'].reset_index(drop=True)
+    return df
+
+
+def resumen_diferencias(diff: pd.DataFrame) -> pd.DataFrame:
+    """Códigos y deltas totales por estado."""
+    deltas = [f'{c}_delta' for c in COLUMNAS_DELTA]
+    return (diff.groupby('estado', observed=False)
+            .agg(codigos=('codigo', 'size'), **{d: (d, 'sum') for d in deltas})
+            .reset_index())
+
+
+def diferencias_corridas(id_antes: str, id_despues: str, directorio=None, solo_cambios=True) -> pd.DataFrame:
+    return diferencias(abrir_corrida(id_antes, directorio), abrir_corrida(id_despues, directorio), solo_cambios)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m historial',
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('--historial', default=None, help=f'Directorio del historial (default: {DIR_HISTORIAL})')
+    parser.add_argument('--diff', nargs=2, metavar=('ID_ANTES', 'ID_DESPUES'), help='Comparar dos corridas')
+    parser.add_argument('--todos', action='store_true', help='Incluir en el diff los códigos sin cambios')
+    parser.add_argument('--salida', default='.', help='Directorio donde escribir el diff (default: actual)')
+    parser.add_argument('--formatos', nargs='+', choices=list(FORMATOS), default=['xlsx'],
+                        help='Formatos del diff (default: xlsx). parquet requiere pyarrow')
+    args = parser.parse_args(argv)
+
+    if args.diff is None:
+        corridas = listar_corridas(args.historial)
+        if corridas.empty:
+            print("No hay corridas archivadas.")
+        else:
+            print(corridas.to_string(index=False))
+        return 0
+
+    no_disponibles = sorted(set(args.formatos) - set(formatos_disponibles()))
+    if no_disponibles:
+        parser.error(f"formatos no disponibles en este entorno: {', '.join(no_disponibles)}")
+    try:
+        diff = diferencias_corridas(*args.diff, args.historial, solo_cambios=not args.todos)
+    except FileNotFoundError as e:
+        print(f"Corrida no encontrada: {e.filename}", file=sys.stderr)
+        return 1
+
+    print(resumen_diferencias(diff).to_string(index=False))
+    salida = Path(args.salida)
+    salida.mkdir(parents=True, exist_ok=True)
+    nombre = f'diff_{args.diff[0]}_{args.diff[1]}'
+    for formato in args.formatos:
+        guardar_archivos({'Diferencias': diff}, salida, nombre, formato)
+    print(f"Diferencias escritas en {salida.resolve()}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,228 @@
+"""
+Procesamiento por lotes: el mismo cálculo de compras para varias sucursales.
+
+Estructura del directorio de entrada (la lista de precios Polifiltro es común):
+
+    lote/
+        precio_polifiltro.tsv
+        <sucursal>/
+            repo.xlsx
+            reserv_mexico.tsv
+            bo_mexico.tsv
+            reserv_polifiltro.tsv      (opcional)
+            bo_polifiltro.tsv          (opcional)
+            contratos_vigentes/*.csv   (opcional, un archivo por empresa)
+            contratos_excluir/*.csv    (opcional, un archivo por empresa)
+
+Las tablas pueden ser .tsv, .csv o .txt con el mismo formato que los datos
+pegados, o Excel (.xlsx/.xls, primera hoja). Cada sucursal se calcula en un
+proceso del pool; la lista de precios se lee una sola vez y se entrega a cada
+proceso al iniciarlo. Por sucursal se escriben los resultados y las órdenes de
+compra en `<salida>/<sucursal>/`, y en `<salida>` un resumen consolidado, que
+cuenta también los códigos repetidos en las tablas de cada sucursal
+(`duplicados`, colapsados según POLITICA_DUPLICADOS).
+
+Uso:
+    python -m lotes --lote LOTE [--salida SALIDA] [--procesos N] [--formatos xlsx csv]
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import pandas as pd
+
+from calculo import (COLUMNAS_ENTRADA, POLITICA_DUPLICADOS, agregar_duplicados, calcular_compras,
+                     leer_contratos, leer_repo, leer_tabla, ordenes_compra)
+from exportar import FORMATOS, formatos_disponibles, guardar_archivos
+
+
+EXTENSIONES_TABLA = ('.tsv', '.csv', '.txt', '.xlsx', '.xls')
+
+ENTRADAS_SUCURSAL = ['reserv_mexico', 'bo_mexico', 'reserv_polifiltro', 'bo_polifiltro']
+ENTRADAS_REQUERIDAS = ['reserv_mexico', 'bo_mexico']
+
+COLUMNAS_RESUMEN = [
+    'sucursal', 'registros_repo', 'codigos', 'duplicados',
+    'codigos_mexico', 'und_mexico', 'monto_mexico',
+    'codigos_polifiltro', 'und_polifiltro', 'monto_polifiltro',
+    'segundos', 'error',
+]
+
+# Lista de precios compartida, cargada por `_inicializar_proceso` en cada proceso del pool
+_PRECIO_POLIFILTRO = None
+
+
+# ─────────────────────────────────────────────
+# Lectura de un lote
+# ─────────────────────────────────────────────
+def _buscar_tabla(directorio: Path, nombre: str) -> Path | None:
+    for ext in EXTENSIONES_TABLA:
+        ruta = directorio / (nombre + ext)
+        if ruta.exists():
+            return ruta
+    return None
+
+
+def _tablas_de(directorio: Path) -> list:
+    if not directorio.is_dir():
+        return []
+    return sorted(p for p in directorio.iterdir() if p.suffix.lower() in EXTENSIONES_TABLA)
+
+
+def sucursales(lote) -> list:
+    """Subdirectorios de `lote` que tienen un REPO (repo.xlsx o repo.xls), ordenados."""
+    return sorted(
+        d for d in Path(lote).iterdir()
+        if d.is_dir() and ((d / 'repo.xlsx').exists() or (d / 'repo.xls').exists())
+    )
+
+
+def leer_precios(lote) -> pd.DataFrame:
+    ruta = _buscar_tabla(Path(lote), 'precio_polifiltro')
+    if ruta is None:
+        raise FileNotFoundError(f"No se encontró precio_polifiltro ({'/'.join(EXTENSIONES_TABLA)}) en {lote}")
+    df, _ = agregar_duplicados(leer_tabla(ruta, COLUMNAS_ENTRADA['precio_polifiltro']),
+                               POLITICA_DUPLICADOS['precio_polifiltro'])
+    return df
+
+
+# ─────────────────────────────────────────────
+# Trabajo por sucursal (en los procesos del pool)
+# ─────────────────────────────────────────────
+def _inicializar_proceso(precio_polifiltro: pd.DataFrame):
+    global _PRECIO_POLIFILTRO
+    _PRECIO_POLIFILTRO = precio_polifiltro
+
+
+def procesar_sucursal(directorio, salida, formatos=('xlsx',), precio_polifiltro=None) -> dict:
+    """Calcula una sucursal y escribe sus archivos en `<salida>/<sucursal>/`.
+
+    Retorna la fila del resumen consolidado; si falla, la fila lleva el error
+    en lugar de detener el lote.
+    """
+    directorio = Path(directorio)
+    fila = {'sucursal': directorio.name}
+    t0 = time.perf_counter()
+    try:
+        if precio_polifiltro is None:
+            precio_polifiltro = _PRECIO_POLIFILTRO
+        entradas = {}
+        duplicados = 0
+        for clave in ENTRADAS_SUCURSAL:
+            ruta = _buscar_tabla(directorio, clave)
+            if ruta is None and clave in ENTRADAS_REQUERIDAS:
+                raise FileNotFoundError(f"Falta {clave} ({'/'.join(EXTENSIONES_TABLA)})")
+            df_e = leer_tabla(ruta, COLUMNAS_ENTRADA[clave]) if ruta else None
+            entradas[clave], n_repetidos = agregar_duplicados(df_e, POLITICA_DUPLICADOS[clave])
+            duplicados += n_repetidos
+
+        ruta_repo = directorio / 'repo.xlsx'
+        if not ruta_repo.exists():
+            ruta_repo = directorio / 'repo.xls'
+        repo, n_total, missing, _ = leer_repo(ruta_repo)
+        if missing:
+            raise ValueError(f"Columnas faltantes en el REPO: {missing}")
+
+        df_res = calcular_compras(
+            repo,
+            precio_polifiltro=precio_polifiltro,
+            contratos_vigentes=leer_contratos(_tablas_de(directorio / 'contratos_vigentes'), 'contratos_vigentes'),
+            contratos_excluir=leer_contratos(_tablas_de(directorio / 'contratos_excluir'), 'contratos_excluir'),
+            **entradas
+        )
+        df_mex, df_poli = ordenes_compra(df_res)
+
+        destino = Path(salida) / directorio.name
+        destino.mkdir(parents=True, exist_ok=True)
+        for formato in formatos:
+            guardar_archivos({'Resultados': df_res}, destino, 'resultados_compras_completo', formato)
+            guardar_archivos({'OC México': df_mex, 'OC Polifiltro': df_poli},
+                             destino, 'ordenes_compra_proveedores', formato)
+
+        fila.update({
+            'registros_repo': n_total,
+            'codigos': len(df_res),
+            'duplicados': duplicados,
+            'codigos_mexico': len(df_mex),
+            'und_mexico': int(df_mex['qty_comprar_mexico'].sum()),
+            'monto_mexico': round(float(df_mex['monto_mexico'].sum()), 2),
+            'codigos_polifiltro': len(df_poli),
+            'und_polifiltro': int(df_poli['qty_comprar_polifiltro'].sum()),
+            'monto_polifiltro': round(float(df_poli['monto_polifiltro'].sum()), 2),
+            'error': None,
+        })
+    except Exception as e:
+        fila['error'] = f"{type(e).__name__}: {e}"
+    fila['segundos'] = round(time.perf_counter() - t0, 3)
+    return fila
+
+
+# ─────────────────────────────────────────────
+# Lote completo
+# ─────────────────────────────────────────────
+def procesar_lote(lote, salida, formatos=('xlsx',), procesos=None) -> pd.DataFrame:
+    """Procesa todas las sucursales de `lote` en un pool de procesos.
+
+    Escribe `<salida>/resumen_sucursales` en cada formato y retorna el resumen
+    (una fila por sucursal, en orden alfabético, más una fila TOTAL).
+    """
+    dirs = sucursales(lote)
+    if not dirs:
+        raise FileNotFoundError(f"No hay sucursales con repo.xlsx en {lote}")
+    precio_polifiltro = leer_precios(lote)
+    salida = Path(salida)
+    salida.mkdir(parents=True, exist_ok=True)
+
+    procesos = min(procesos or os.cpu_count() or 1, len(dirs))
+    filas = []
+    with ProcessPoolExecutor(max_workers=procesos, initializer=_inicializar_proceso,
+                             initargs=(precio_polifiltro,)) as pool:
+        futuros = [pool.submit(procesar_sucursal, d, salida, tuple(formatos)) for d in dirs]
+        for futuro in as_completed(futuros):
+            fila = futuro.result()
+            estado = f"ERROR {fila['error']}" if fila['error'] else f"{fila['codigos']:,} códigos"
+            print(f"{fila['sucursal']}: {estado} ({fila['segundos']:.1f} s)")
+            filas.append(fila)
+
+    resumen = pd.DataFrame(filas, columns=COLUMNAS_RESUMEN).sort_values('sucursal', ignore_index=True)
+    totales = resumen.drop(columns=['sucursal', 'error', 'segundos']).sum(numeric_only=True)
+    resumen.loc[len(resumen)] = {**totales.to_dict(), 'sucursal': 'TOTAL', 'error': None,
+                                 'segundos': resumen['segundos'].sum()}
+
+    for formato in formatos:
+        guardar_archivos({'Resumen': resumen}, salida, 'resumen_sucursales', formato)
+    return resumen
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m lotes',
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('--lote', required=True, help='Directorio con precio_polifiltro y una carpeta por sucursal')
+    parser.add_argument('--salida', default='salida_lote', help='Directorio de salida (default: salida_lote)')
+    parser.add_argument('--procesos', type=int, help='Procesos del pool (default: núcleos disponibles)')
+    parser.add_argument('--formatos', nargs='+', choices=list(FORMATOS), default=['xlsx'],
+                        help='Formatos de salida (default: xlsx). parquet requiere pyarrow')
+    args = parser.parse_args(argv)
+    no_disponibles = sorted(set(args.formatos) - set(formatos_disponibles()))
+    if no_disponibles:
+        parser.error(f"formatos no disponibles en este entorno: {', '.join(no_disponibles)}")
+
+    try:
+        resumen = procesar_lote(args.lote, args.salida, args.formatos, args.procesos)
+    except FileNotFoundError as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    errores = resumen['error'].notna().sum()
+    print(f"{len(resumen) - 1} sucursales procesadas, {errores} con error. Resumen en {Path(args.salida).resolve()}")
+    return 1 if errores else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
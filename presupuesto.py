@@ -0,0 +1,129 @@
+"""
+Ajuste de las órdenes de compra a un presupuesto por proveedor.
+
+Parte de las cantidades calculadas (`qty_comprar_*`, ya redondeadas a caja) y,
+para cada proveedor con tope, elige cuántas cajas de cada código mantener para
+maximizar la cobertura ponderada de lo que falta para el stock objetivo:
+
+    Σ peso(clasificación) × unidades compradas / faltante
+
+con faltante = max(stock_objetivo - stock_virtual, 1).
+
+Como el beneficio por unidad de cada código es constante, el óptimo greedy es
+recorrer los códigos de mayor a menor beneficio por peso gastado y comprar
+todas las cajas que entren en el presupuesto restante. El recorrido se hace por
+bloques con sumas acumuladas: cada bloque compra completos todos los códigos
+hasta el primero que no entra, que recibe las cajas que alcancen.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+# Peso de cada código según la primera letra de su clasificación
+PESOS_CLASIFICACION = {'A': 3.0, 'B': 2.0, 'C': 1.0}
+PESO_SIN_CLASIFICACION = 1.0
+
+# proveedor: (columna de cantidad, columna de precio)
+PROVEEDORES = {
+    'mexico': ('qty_comprar_mexico', 'pc'),
+    'polifiltro': ('qty_comprar_polifiltro', 'precio_polifiltro'),
+}
+
+
+def pesos_clasificacion(clasificacion: pd.Series, pesos=None) -> np.ndarray:
+    pesos = PESOS_CLASIFICACION if pesos is None else pesos
+    letra = clasificacion.astype(object).str.strip().str.upper().str[:1]
+    return letra.map(pesos).fillna(PESO_SIN_CLASIFICACION).to_numpy(dtype=float)
+
+
+def asignar_cajas(cajas: np.ndarray, costo_caja: np.ndarray, prioridad: np.ndarray,
+                  presupuesto: float) -> np.ndarray:
+    """Cajas a comprar de cada código sin superar `presupuesto`.
+
+    Recorre los códigos por `prioridad` descendente; los de costo 0 se compran
+    siempre. Retorna un array de enteros con las cajas elegidas por código.
+    """
+    elegidas = np.zeros(len(cajas), dtype=np.int64)
+    gratis = costo_caja <= 0
+    elegidas[gratis] = cajas[gratis]
+
+    candidatos = np.flatnonzero(~gratis & (cajas > 0))
+    orden = candidatos[np.argsort(-prioridad[candidatos], kind='stable')]
+    restante = float(presupuesto)
+    while len(orden) and restante > 0:
+        # Solo siguen en carrera los códigos con al menos una caja que entre
+        orden = orden[costo_caja[orden] <= restante]
+        if not len(orden):
+            break
+        costo_total = cajas[orden] * costo_caja[orden]
+        acumulado = np.cumsum(costo_total)
+        completos = int(np.searchsorted(acumulado, restante, side='right'))
+        elegidas[orden[:completos]] = cajas[orden[:completos]]
+        if completos:
+            restante -= acumulado[completos - 1]
+        if completos == len(orden):
+            break
+        i = orden[completos]
+        parcial = int(restante // costo_caja[i])
+        elegidas[i] = parcial
+        restante -= parcial * costo_caja[i]
+        orden = orden[completos + 1:]
+    return elegidas
+
+
+def quitar_ajuste(df_res: pd.DataFrame) -> pd.DataFrame:
+    """Vuelve a las cantidades sugeridas si el resultado ya estaba ajustado."""
+    df = df_res.copy()
+    for proveedor, (col_qty, _) in PROVEEDORES.items():
+        sugerida = f'qty_sugerida_{proveedor}'
+        if sugerida in df:
+            df[col_qty] = df.pop(sugerida)
+    return df
+
+
+def ajustar_a_presupuesto(df_res: pd.DataFrame, presupuestos: dict, pesos=None):
+    """Recorta las cantidades a comprar para respetar el presupuesto de cada proveedor.
+
+    `presupuestos` es {'mexico': monto, 'polifiltro': monto}; los proveedores sin
+    monto (o con None) no se recortan. Las cantidades originales quedan en
+    `qty_sugerida_<proveedor>` y `qty_comprar_<proveedor>` pasa a ser la recortada,
+    de modo que `ordenes_compra` arma las órdenes ajustadas. Si `df_res` ya estaba
+    ajustado, se parte de las sugeridas.
+    Retorna (df_ajustado, resumen) con una fila de resumen por proveedor.
+    """
+    df = quitar_ajuste(df_res)
+    caja = df['qty_piezas_por_caja'].to_numpy(dtype=float)
+    caja = np.maximum(np.where(np.isnan(caja), 1, caja), 1)
+    faltante = df['stock_objetivo'].to_numpy(dtype=float) - np.nan_to_num(df['stock_virtual'].to_numpy(dtype=float))
+    faltante = np.maximum(np.nan_to_num(faltante), 1)
+    peso = pesos_clasificacion(df['clasificacion'], pesos)
+
+    filas = []
+    for proveedor, (col_qty, col_precio) in PROVEEDORES.items():
+        qty = df[col_qty].to_numpy()
+        precio = np.nan_to_num(df[col_precio].to_numpy(dtype=float))
+        monto_sugerido = float(qty @ precio)
+        tope = presupuestos.get(proveedor)
+        if tope is None:
+            continue
+
+        cajas = np.ceil(qty / caja).astype(np.int64)
+        with np.errstate(divide='ignore'):
+            prioridad = peso / (faltante * precio)
+        elegidas = asignar_cajas(cajas, caja * precio, prioridad, tope)
+        ajustada = np.minimum(elegidas * caja, qty).astype(qty.dtype)
+
+        df[f'qty_sugerida_{proveedor}'] = qty
+        df[col_qty] = ajustada
+        filas.append({
+            'proveedor': proveedor,
+            'presupuesto': tope,
+            'monto_sugerido': round(monto_sugerido, 2),
+            'monto_ajustado': round(float(ajustada @ precio), 2),
+            'und_sugeridas': int(qty.sum()),
+            'und_ajustadas': int(ajustada.sum()),
+            'codigos_recortados': int((ajustada < qty).sum()),
+            'codigos_sin_compra': int(((ajustada == 0) & (qty > 0)).sum()),
+        })
+    return df, pd.DataFrame(filas)
@@ -0,0 +1,172 @@
+"""
+Almacén local de sesiones: las entradas cargadas sobreviven a un refresh del
+navegador o a un reinicio del servidor.
+
+Cada entrada (REPO filtrado, disponible/backorder, precios, contratos) se guarda
+con el formato columnar de `almacen` en `<DIR_SESIONES>/<sesion>/<clave>`, y un
+índice SQLite registra sesiones, entradas, tamaños y último uso. Al volver a
+abrir una sesión las entradas se reabren memory-mapped, sin volver a parsear.
+Las sesiones sin uso por más de `MAX_EDAD_DIAS` se eliminan, y si el total supera
+`MAX_BYTES` se eliminan las usadas hace más tiempo, salvo las usadas en los
+últimos `ACTIVA_SEGUNDOS` (que pueden tener una pestaña abierta).
+"""
+
+import json
+import os
+import re
+import shutil
+import sqlite3
+import time
+import uuid
+from contextlib import closing
+from pathlib import Path
+
+from almacen import abrir_columnar, guardar_columnar
+
+
+DIR_SESIONES = Path(os.environ.get('COMPRAS_SESIONES', 'sesiones'))
+INDICE = 'indice.sqlite'
+
+# Formato de los ids que genera `nueva_sesion`
+ID_SESION = re.compile(r'[0-9a-f]{16}')
+
+MAX_EDAD_DIAS = float(os.environ.get('COMPRAS_SESIONES_DIAS', 14))
+MAX_BYTES = float(os.environ.get('COMPRAS_SESIONES_BYTES', 2e9))
+
+# Sesiones usadas en este lapso se consideran activas y no se desalojan por tamaño
+ACTIVA_SEGUNDOS = 2 * 3600
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS sesiones (
+    id TEXT PRIMARY KEY,
+    creada REAL NOT NULL,
+    usada REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entradas (
+    sesion TEXT NOT NULL REFERENCES sesiones(id) ON DELETE CASCADE,
+    clave TEXT NOT NULL,
+    bytes INTEGER NOT NULL,
+    guardada REAL NOT NULL,
+    meta TEXT NOT NULL,
+    PRIMARY KEY (sesion, clave)
+);
+"""
+
+
+def _conectar(directorio=None) -> sqlite3.Connection:
+    """Conexión al índice. Usar como `with closing(_conectar()) as con, con:` (cierra y confirma)."""
+    directorio = Path(directorio or DIR_SESIONES)
+    directorio.mkdir(parents=True, exist_ok=True)
+    con = sqlite3.connect(directorio / INDICE, timeout=10)
+    con.execute('PRAGMA foreign_keys = ON')
+    con.executescript(_ESQUEMA)
+    return con
+
+
+def _ruta(directorio, sesion: str, clave=None) -> Path:
+    """Ruta de una sesión (o de una de sus entradas) dentro del almacén.
+
+    Lanza ValueError si la ruta resuelta queda fuera de `directorio`, p. ej. con un
+    id de sesión como '../otro': nada se lee, escribe ni borra fuera del almacén.
+    """
+    base = Path(directorio or DIR_SESIONES).resolve()
+    ruta = base / sesion if clave is None else base / sesion / clave
+    ruta = ruta.resolve()
+    if base not in ruta.parents:
+        raise ValueError(f"Ruta de sesión fuera del almacén: {sesion!r} / {clave!r}")
+    return ruta
+
+
+def _tamano(ruta: Path) -> int:
+    return sum(f.stat().st_size for f in ruta.iterdir() if f.is_file())
+
+
+def nueva_sesion() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def es_id_valido(sesion) -> bool:
+    """True si `sesion` tiene el formato de `nueva_sesion` (16 dígitos hexadecimales)."""
+    return isinstance(sesion, str) and ID_SESION.fullmatch(sesion) is not None
+
+
+def tocar_sesion(sesion: str, directorio=None):
+    """Registra la sesión (si no existe) y actualiza su último uso."""
+    ahora = time.time()
+    with closing(_conectar(directorio)) as con, con:
+        con.execute('INSERT INTO sesiones (id, creada, usada) VALUES (?, ?, ?) '
+                    'ON CONFLICT(id) DO UPDATE SET usada = excluded.usada', (sesion, ahora, ahora))
+
+
+# ─────────────────────────────────────────────
+# Entradas
+# ─────────────────────────────────────────────
+def guardar_entrada(sesion: str, clave: str, df, directorio=None, **meta):
+    """Guarda (o reemplaza) una entrada de la sesión."""
+    ruta = guardar_columnar(df, _ruta(directorio, sesion, clave), clave=clave)
+    tocar_sesion(sesion, directorio)
+    with closing(_conectar(directorio)) as con, con:
+        con.execute('INSERT OR REPLACE INTO entradas (sesion, clave, bytes, guardada, meta) VALUES (?, ?, ?, ?, ?)',
+                    (sesion, clave, _tamano(ruta), time.time(), json.dumps(meta, ensure_ascii=False)))
+
+
+def borrar_entrada(sesion: str, clave: str, directorio=None):
+    shutil.rmtree(_ruta(directorio, sesion, clave), ignore_errors=True)
+    with closing(_conectar(directorio)) as con, con:
+        con.execute('DELETE FROM entradas WHERE sesion = ? AND clave = ?', (sesion, clave))
+
+
+def listar_entradas(sesion: str, directorio=None) -> dict:
+    """{clave: meta} de las entradas guardadas de la sesión."""
+    with closing(_conectar(directorio)) as con, con:
+        filas = con.execute('SELECT clave, meta FROM entradas WHERE sesion = ?', (sesion,)).fetchall()
+    return {clave: json.loads(meta) for clave, meta in filas}
+
+
+def abrir_entrada(sesion: str, clave: str, directorio=None):
+    """Reabre una entrada guardada (columnas numéricas memory-mapped)."""
+    df, _ = abrir_columnar(_ruta(directorio, sesion, clave))
+    return df
+
+
+# ─────────────────────────────────────────────
+# Sesiones
+# ─────────────────────────────────────────────
+def borrar_sesion(sesion: str, directorio=None):
+    shutil.rmtree(_ruta(directorio, sesion), ignore_errors=True)
+    with closing(_conectar(directorio)) as con, con:
+        con.execute('DELETE FROM sesiones WHERE id = ?', (sesion,))
+
+
+def desalojar(max_edad_dias=None, max_bytes=None, excluir=(), activa_segundos=ACTIVA_SEGUNDOS,
+              directorio=None) -> list:
+    """Elimina sesiones sin uso por más de `max_edad_dias` y, si el total de bytes
+    supera `max_bytes`, las usadas hace más tiempo. Nunca elimina las de `excluir`
+    ni, por tamaño, las usadas en los últimos `activa_segundos`.
+    Retorna los ids eliminados."""
+    max_edad_dias = MAX_EDAD_DIAS if max_edad_dias is None else max_edad_dias
+    max_bytes = MAX_BYTES if max_bytes is None else max_bytes
+    with closing(_conectar(directorio)) as con, con:
+        filas = con.execute(
+            'SELECT s.id, s.usada, COALESCE(SUM(e.bytes), 0) FROM sesiones s '
+            'LEFT JOIN entradas e ON e.sesion = s.id GROUP BY s.id ORDER BY s.usada'
+        ).fetchall()
+
+    ahora = time.time()
+    limite = ahora - max_edad_dias * 86400
+    total = sum(b for _, _, b in filas)
+    eliminadas = []
+    for sesion, usada, bytes_ in filas:
+        if usada >= limite and (total <= max_bytes or usada >= ahora - activa_segundos):
+            break
+        if sesion in excluir:
+            continue
+        try:
+            borrar_sesion(sesion, directorio)
+        except ValueError:
+            # Id que no corresponde a un directorio del almacén: solo se quita del índice
+            with closing(_conectar(directorio)) as con, con:
+                con.execute('DELETE FROM sesiones WHERE id = ?', (sesion,))
+        eliminadas.append(sesion)
+        total -= bytes_
+    return eliminadas